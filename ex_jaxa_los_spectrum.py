@@ -11,34 +11,75 @@ Pannier and Laux 2018, "Analysis of JAXA Nonequilibrium Infrared Emission Spectr
 
 """
 
-from radis import SpectrumFactory, SerialSlabs
+from radis import SpectrumFactory
+from radis.phys.convert import nm_air2cm
+from radis_tools import (calc_sharded, SerialLOS, MergeLOS, load_databank, calc_streamed,
+                         apply_slit)
+
+SHARDED = False     # if True, calculate CO2 on spectral sub-ranges in parallel processes
+N_SHARDS = 16       # more shards: less memory per process
+N_WORKERS = None    # None: all processors
+LINE_CACHE = True   # if True, read only the lines of the spectral range from a memory-mapped
+                    # cache of the database (built at the first run, next to the database files)
+MEMORY_LIMIT = None # e.g. '4GB': stream the lines from the line cache in chunks, within this
+                    # memory limit (peak memory in s.conditions['peak_memory'])
 
 # Calculate CO2
-sf = SpectrumFactory(wavelength_min=4000, 
-                     wavelength_max=5000,                # cm-1
-                     wstep=0.01,
-                     isotope='1',
-                     verbose=3,
-                     chunksize='DLM',
-                     )
-sf.load_databank('HITEMP-CO2')  # link to my CO2 HITEMP database files
-s_forebody = sf.eq_spectrum(Tgas=4000, pressure=1, mole_fraction=0.027, path_length=1)
-s_freeflow = sf.non_eq_spectrum(Trot=1690, pressure=0.017, Tvib=2200, mole_fraction=0.606, path_length=3)
+if not SHARDED:
+    sf = SpectrumFactory(wavelength_min=4000, 
+                         wavelength_max=5000,                # nm
+                         wstep=0.01,
+                         isotope='1',
+                         verbose=3,
+                         chunksize='DLM',
+                         )
+    if MEMORY_LIMIT is not None:
+        s_forebody = calc_streamed(sf, 'HITEMP-CO2', MEMORY_LIMIT, 'eq_spectrum',
+                                   Tgas=4000, pressure=1, mole_fraction=0.027, path_length=1)
+        s_freeflow = calc_streamed(sf, 'HITEMP-CO2', MEMORY_LIMIT, 'non_eq_spectrum',
+                                   Trot=1690, pressure=0.017, Tvib=2200, mole_fraction=0.606, path_length=3)
+    else:
+        if LINE_CACHE:
+            load_databank(sf, 'HITEMP-CO2')
+        else:
+            sf.load_databank('HITEMP-CO2')  # link to my CO2 HITEMP database files
+        s_forebody = sf.eq_spectrum(Tgas=4000, pressure=1, mole_fraction=0.027, path_length=1)
+        s_freeflow = sf.non_eq_spectrum(Trot=1690, pressure=0.017, Tvib=2200, mole_fraction=0.606, path_length=3)
+else:
+    # Shards are stitched on the same wavenumber grid. With the DLM, results agree
+    # with the single-process calculation within the DLM accuracy
+    # (use optimization=None for identical results)
+    s_forebody, s_freeflow = calc_sharded(
+            dict(wavenum_min=nm_air2cm(5000),
+                 wavenum_max=nm_air2cm(4000),                # cm-1
+                 wstep=0.01,
+                 isotope='1',
+                 verbose=0,
+                 chunksize='DLM',
+                 ),
+            'HITEMP-CO2',
+            [('eq_spectrum', dict(Tgas=4000, pressure=1, mole_fraction=0.027, path_length=1)),
+             ('non_eq_spectrum', dict(Trot=1690, pressure=0.017, Tvib=2200, mole_fraction=0.606, path_length=3))],
+            n_shards=N_SHARDS, max_workers=N_WORKERS, line_cache=LINE_CACHE)
 
 # Calcule CO
 sfco = SpectrumFactory(wavelength_min=4000, 
-                     wavelength_max=5000,                # cm-1
+                     wavelength_max=5000,                # nm
                      wstep=0.01,
                      isotope='1',
                      verbose=3,
                      )
-sfco.load_databank('HITEMP-CO')    # link to my CO HITEMP database files
+if LINE_CACHE:
+    load_databank(sfco, 'HITEMP-CO')
+else:
+    sfco.load_databank('HITEMP-CO')    # link to my CO HITEMP database files
 s_co = sfco.non_eq_spectrum(# non_eq_spectrum because eq_spectrum requires partitions functions 
                             # tabulated with TIPS which is limited to 3000 K 
                             Tvib=4000, Trot=4000, 
                             pressure=1, mole_fraction=0.519, path_length=1)  
 
-# Combine
-s = SerialSlabs(s_freeflow, s_forebody // s_co, s_freeflow)
-s.apply_slit(10, 'nm')
+# Combine: same as SerialSlabs(s_freeflow, s_forebody // s_co, s_freeflow), solved
+# at once (s_freeflow is read once, and spectra on the same grid are not resampled)
+s = SerialLOS(s_freeflow, MergeLOS(s_forebody, s_co), s_freeflow).evaluate()
+apply_slit(s, 10, 'nm')     # FFT convolution: the 10 nm slit is ~1000 points wide
 s.plot(wunit='nm', Iunit='W/cm2/sr/um')
@@ -32,11 +32,17 @@ from __future__ import print_function, absolute_import, division
 from radis import SpectrumFactory, sPlanck, SerialSlabs
 import matplotlib.pyplot as plt
 import pandas as pd
-from numpy import pi
+import numpy as np
 from radis.misc.progress_bar import ProgressBar
 from radis import cm2nm
 from radis.misc import centered_diff
 from publib import set_style, fix_style
+import sys
+sys.path.append('..')   # to import radis_tools from the repository root
+from radis_tools import (calc_layers, calc_layers_parallel, LOSAccumulator,
+                         ConcentrationSweep, CrossSectionTable, CorrelatedK,
+                         calc_irradiance, make_irradiance, calc_sharded,
+                         plot_envelope, compact, copy_view, compare_precision)
 
 
 #%% ===========================================================================
@@ -81,6 +87,24 @@ x_CO2 = 400e-6     #: float: mole fraction of CO2
 # Spectral Computation parameters
 wstep = 0.003                    # wavenumber step (cm-1)
 broadening_max_width = 3         # Line broadening (cm-1)
+LAYER_MODE = 'batched'           # 'serial': one sf.eq_spectrum() call per layer (reference);
+                                 # 'batched': same spectra, the line table and the wavenumber
+                                 #    grid shared by all layers (see radis_tools.layers);
+                                 # 'parallel': layers distributed over a process pool;
+                                 # 'table': interpolated in a precomputed cross-section table;
+                                 # 'sharded': spectral range split in sub-ranges calculated in parallel
+N_WORKERS = None                 # processes in 'parallel' and 'sharded' modes (None: all processors)
+N_SHARDS = 16                    # spectral sub-ranges in 'sharded' mode (more shards: less memory per worker)
+N_ANGLES = 4                     # zenith angles of the hemispheric irradiance quadrature
+                                 # (0: irradiance = pi * radiance along the vertical)
+STORAGE_DTYPE = 'float32'        # layer quantities stored in float32 (None: float64)
+CHECK_PRECISION = False          # if True, compare the line-of-sight to float64 layers
+RUN_SWEEP = False                # if True, radiative forcing for 26 CO2 mole fractions (200-1200 ppm)
+BAND_MODEL = None                # correlated-k band model (None: not calculated);
+                                 # 'factory': built from the line database one layer at a time, only
+                                 #    the k-distributions kept in memory (eq_spectrum steps);
+                                 # 'slabs': built from the layer spectra above, validated against
+                                 #    their SerialSlabs line-of-sight
 
 # %% Earth Model
 # without albedo, but lower effective temperature 
@@ -88,18 +112,19 @@ albedo = 0        # reflectivity of the earth surface
 T_earth = 288     # average night/day Earth surface  K 
 
 # %% Get Spectral line database
-sf = SpectrumFactory(wavenum_min=wmin, 
-                     wavenum_max=wmax,
-                     molecule='CO2',
-                     isotope='1,2,3',
-                     verbose=False,
-                     broadening_max_width=broadening_max_width,
-                     wstep=wstep,
-                     warnings={'MissingSelfBroadeningWarning':'ignore'},
-                     export_lines=False,
-                     optimization=None, # actually faster at low temperatures than using a line database & 'min-RMS',
-                     chunksize=1e7, 
-                     )
+factory_kwargs = dict(wavenum_min=wmin, 
+                      wavenum_max=wmax,
+                      molecule='CO2',
+                      isotope='1,2,3',
+                      verbose=False,
+                      broadening_max_width=broadening_max_width,
+                      wstep=wstep,
+                      warnings={'MissingSelfBroadeningWarning':'ignore'},
+                      export_lines=False,
+                      optimization=None, # actually faster at low temperatures than using a line database & 'min-RMS',
+                      chunksize=1e7, 
+                      )
+sf = SpectrumFactory(**factory_kwargs)
 sf.fetch_databank(load_energies=False)   # loads from HITRAN, requires an internet connection
 
 
@@ -115,31 +140,80 @@ s_earth_0 = sPlanck(wmin, wmax, wstep=wstep, T=T_earth, eps=1-albedo)
 
 # Calculate atmosphere layers
 
-slabs = []
 print(f'Calculating {len(atm)} Atmosphere layers')
-pb = ProgressBar(len(atm))
-for i, r in atm.iterrows():
-    pb.update(i)
-    s = sf.eq_spectrum(Tgas=r.T_K,
-                       mole_fraction=x_CO2,
-                       path_length=r.path_length*1e5, # cm
-                       pressure=r.P_Pa*1e-5, # bar
-                       )
-    slabs.append(s)
-pb.done()
+if LAYER_MODE == 'batched':
+    # the line table and the wavenumber grid are shared by all layers
+    slabs = calc_layers(sf, Tgas=atm.T_K,
+                        mole_fraction=x_CO2,
+                        path_length=atm.path_length*1e5, # cm
+                        pressure=atm.P_Pa*1e-5, # bar
+                        )
+elif LAYER_MODE == 'parallel':
+    # eq_spectrum in forked workers, which share the line database read-only
+    slabs = calc_layers_parallel(sf, Tgas=atm.T_K,
+                                 mole_fraction=x_CO2,
+                                 path_length=atm.path_length*1e5, # cm
+                                 pressure=atm.P_Pa*1e-5, # bar
+                                 max_workers=N_WORKERS,
+                                 )
+elif LAYER_MODE == 'table':
+    # built at the first run only, then memory-mapped from the disk
+    table = CrossSectionTable.load_or_build('out/co2_xsec_table', sf,
+                                            Tgas=np.arange(180, 301, 10),   # K
+                                            pressure=np.geomspace(2e-6, 1.1, 30), # bar
+                                            mole_fraction=x_CO2)
+    print('Cross-section table: max. interpolation error {0:.2%}'.format(table.error))
+    slabs = table.layers(Tgas=atm.T_K,
+                         mole_fraction=x_CO2,
+                         path_length=atm.path_length*1e5, # cm
+                         pressure=atm.P_Pa*1e-5, # bar
+                         )
+elif LAYER_MODE == 'sharded':
+    # the lines are fetched once, and each worker calculates all layers on the
+    # lines of its sub-range; with optimization=None the stitched spectra are
+    # identical to 'serial'
+    slabs = calc_sharded(factory_kwargs, 'fetch',
+                         [('eq_spectrum', dict(Tgas=r.T_K,
+                                               mole_fraction=x_CO2,
+                                               path_length=r.path_length*1e5, # cm
+                                               pressure=r.P_Pa*1e-5, # bar
+                                               ))
+                          for _, r in atm.iterrows()],
+                         n_shards=N_SHARDS, max_workers=N_WORKERS,
+                         databank_kwargs={'load_energies': False})
+elif LAYER_MODE == 'serial':
+    slabs = []
+    pb = ProgressBar(len(atm))
+    for i, r in atm.iterrows():
+        pb.update(i)
+        s = sf.eq_spectrum(Tgas=r.T_K,
+                           mole_fraction=x_CO2,
+                           path_length=r.path_length*1e5, # cm
+                           pressure=r.P_Pa*1e-5, # bar
+                           )
+        slabs.append(s)
+    pb.done()
+else:
+    raise ValueError('Unknown LAYER_MODE: {0}'.format(LAYER_MODE))
+
+if STORAGE_DTYPE is not None:
+    if CHECK_PRECISION:
+        compare_precision(slabs, lambda slabs: calc_irradiance(slabs, source=s_earth_0,
+                                                               n_angles=N_ANGLES),
+                          dtype=STORAGE_DTYPE)
+    compact(slabs, STORAGE_DTYPE)   # float32 quantities, one shared wavenumber grid
     
-# now solve the line of sight for the atmosphere:
-print('Solving radiative transfer equation')
-s_atm = SerialSlabs(*slabs)
-
 # %% Calculate the total Upward radiation
 
-s_los_400 = SerialSlabs(s_earth_0, s_atm, resample='intersect')
-
-# Note: RADIS does not have an irradiance unit by default. 
-# Here we create the irradiance from the radiance 
-s_los_400._q['irradiance'] = s_los_400.get('radiance_noslit')[1]*pi
-s_los_400.units['irradiance'] = s_los_400.units['radiance_noslit'].replace('/sr', '')
+# now solve the line of sight for the atmosphere:
+# (RADIS has no irradiance quantity: s_los is the irradiance, as radiance_noslit)
+print('Solving radiative transfer equation')
+if N_ANGLES:
+    # the layer absorption coefficients are used for all zenith angles
+    s_los_400 = calc_irradiance(slabs, source=s_earth_0, n_angles=N_ANGLES)
+else:
+    s_atm = SerialSlabs(*slabs)
+    s_los_400 = make_irradiance(SerialSlabs(s_earth_0, s_atm, resample='intersect'))   # pi * radiance
 s_los_400.name = 'Earth + Atmosphere'
 
 # %% Rescale to 1750 reference (278 ppm)
@@ -160,8 +234,9 @@ print('Calculating Reference Atmosphere')
 pb = ProgressBar(len(atm))
 for i, r in atm.iterrows():
     pb.update(i)
-    # 1. Rescale existing (see Note above):
-    s = slabs[i].copy()
+    # 1. Rescale existing (see Note above). The copy shares the arrays of slabs[i]
+    # until they are rescaled; calc_irradiance() only needs abscoeff:
+    s = copy_view(slabs[i], 'abscoeff' if N_ANGLES else 'all')
     s.rescale_mole_fraction(x_CO2_ref)
     # 2. Or recalculate:
 #    s = sf.eq_spectrum(Tgas=r.T_K,
@@ -172,23 +247,18 @@ for i, r in atm.iterrows():
     
     slabs_278.append(s)
 pb.done()
+if STORAGE_DTYPE is not None:
+    compact(slabs_278, STORAGE_DTYPE)
 
-# now solve the line of sight for the atmosphere:
-print('Solving radiative transfer equation')
-s_atm_278 = SerialSlabs(*slabs_278)
-    
 #%% Now Upward radiation
 
 # now solve the line of sight: 
-s_atm_278 = SerialSlabs(*slabs_278)
-    
-# %% Calculate the total Upward radiation
-s_los_278 = SerialSlabs(s_earth_0, s_atm_278, resample='intersect')
-
-# Note: RADIS does not have an irradiance unit by default. 
-# Here we create the irradiance from the radiance 
-s_los_278._q['irradiance'] = s_los_278.get('radiance_noslit')[1]*pi
-s_los_278.units['irradiance'] = s_los_278.units['radiance_noslit'].replace('/sr', '')
+print('Solving radiative transfer equation')
+if N_ANGLES:
+    s_los_278 = calc_irradiance(slabs_278, source=s_earth_0, n_angles=N_ANGLES)
+else:
+    s_atm_278 = SerialSlabs(*slabs_278)
+    s_los_278 = make_irradiance(SerialSlabs(s_earth_0, s_atm_278, resample='intersect'))   # pi * radiance
 s_los_278.name = 'Earth + Atmosphere'
 
 
@@ -209,8 +279,8 @@ s_los_278.crop(wmin=11100, wmax=20000, wunit='nm')
 s_los_400.crop(wmin=11100, wmax=20000, wunit='nm')
 
 # Get total power in this range
-P_278 = s_los_278.get_integral('irradiance', wunit='nm', Iunit='W/m2/nm')
-P_400 = s_los_400.get_integral('irradiance', wunit='nm', Iunit='W/m2/nm')
+P_278 = s_los_278.get_integral('radiance_noslit', wunit='nm', Iunit='W/m2/nm')
+P_400 = s_los_400.get_integral('radiance_noslit', wunit='nm', Iunit='W/m2/nm')
 
 print('Upward radiation @278 ppm: {0:.1f} W/m2'.format(P_278))
 print('Upward radiation @400 ppm: {0:.1f} W/m2'.format(P_400))
@@ -219,8 +289,10 @@ s_los_278.name = '278 ppm: {0:.1f} W/m2'.format(P_278)
 s_los_400.name = '400 ppm: {0:.1f} W/m2'.format(P_400)
 
 # Plot
-s_los_278.plot('irradiance', wunit='nm', Iunit=Iunit) #cm_1')
-s_los_400.plot('irradiance', wunit='nm', Iunit=Iunit, nfig='same', zorder=-1) #/cm_1
+# ... decimated to a min/max envelope per pixel: plot time does not depend on wstep
+plt.figure()
+plot_envelope(s_los_278, 'radiance_noslit', wunit='nm', Iunit=Iunit) #cm_1')
+plot_envelope(s_los_400, 'radiance_noslit', wunit='nm', Iunit=Iunit, zorder=-1) #/cm_1
 plt.ylim(ymin=0)
 plt.legend(loc='best')
 plt.tight_layout()
@@ -230,11 +302,8 @@ for T_planck in [200, 220, 240, 260, 280, 300, 320]:
     s_planck = sPlanck(wavelength_min=11100, 
                        wavelength_max=20000, 
                        wstep=10, T=T_planck, eps=1)
-    # Note: RADIS does not have an irradiance unit by default. 
-    # Here we create the irradiance from the radiance 
-    s_planck._q['irradiance'] = s_planck.get('radiance_noslit')[1]*pi
-    s_planck.units['irradiance'] = s_planck.units['radiance_noslit'].replace('/sr', '')
-    s_planck.plot('irradiance', wunit='nm', Iunit='W/m2/nm', nfig='same', color='lightgrey', ls='--', zorder=-10)
+    s_planck = make_irradiance(s_planck)   # pi * radiance (isotropic)
+    s_planck.plot('radiance_noslit', wunit='nm', Iunit='W/m2/nm', nfig='same', color='lightgrey', ls='--', zorder=-10)
 
 plt.grid(False)
 plt.ylabel('Irradiance ({0})'.format(make_up(Iunit)))
@@ -248,13 +317,73 @@ if SAVE_OUTPUT:
 # %% Below we calculate the upward radiation for different altitudes
 # Helps see the different layers of atmosphere
 
+# ... one pass over all layers: the upward radiance is stored at every layer top
+# ... (equivalent to SerialSlabs(s_earth_0, *slabs[:km]) for all km)
+los = LOSAccumulator(slabs[0].get_wavenumber(), len(slabs), source=s_earth_0)
+for s in slabs:
+    los.add(s)
+
 plt.figure()
 for km in [1, 5, 10, 20, 60]:
 
-    SerialSlabs(s_earth_0, *slabs[:km]).plot(Iunit='W/m2/sr/nm', nfig='same', label='{0} km'.format(km))
+    plot_envelope(los.spectrum(km), 'radiance_noslit', Iunit='W/m2/sr/nm', label='{0} km'.format(km))
 plt.legend()
 
 #%% ... Print
 
-print('Upward radiation @278 ppm: {0:.1f} W/m2'.format(s_los_278.get_integral('irradiance', wunit='nm', Iunit='W/m2/nm')))
-print('Upward radiation @400 ppm: {0:.1f} W/m2'.format(s_los_400.get_integral('irradiance', wunit='nm', Iunit='W/m2/nm')))
+print('Upward radiation @278 ppm: {0:.1f} W/m2'.format(s_los_278.get_integral('radiance_noslit', wunit='nm', Iunit='W/m2/nm')))
+print('Upward radiation @400 ppm: {0:.1f} W/m2'.format(s_los_400.get_integral('radiance_noslit', wunit='nm', Iunit='W/m2/nm')))
+
+# %% Band model (correlated-k): upward irradiance per spectral band
+# ... transfer is solved on a few quadrature points per band instead of the
+# ... full spectral grid, with the same zenith angles as the irradiance above.
+
+bands = np.linspace(500, 900, 21)   # cm-1
+if BAND_MODEL == 'factory':
+    # ... each layer is broadened, reduced to its k-distributions, and discarded:
+    # ... 20 bands x 16 points per layer are kept instead of the 166k-point spectra.
+    # ... A band-model run needs only this (not the line-by-line layers above)
+    ck = CorrelatedK.from_factory(sf, Tgas=atm.T_K,
+                                  pressure=atm.P_Pa*1e-5, # bar
+                                  path_length=atm.path_length*1e5, # cm
+                                  mole_fraction=x_CO2,
+                                  bands=bands)
+elif BAND_MODEL == 'slabs':
+    # ... validated against the line-by-line SerialSlabs() line-of-sight
+    ck = CorrelatedK.from_slabs(slabs, bands=bands)
+    df_bands = ck.compare_lbl(slabs, source=s_earth_0, n_angles=N_ANGLES)
+    print(df_bands)
+    print('Band model: max. error in a band {0:.1%}, line-by-line: {1:.1f} W/m2'.format(
+          df_bands.error.abs().max(), df_bands.irradiance_lbl.sum()))
+elif BAND_MODEL is not None:
+    raise ValueError('Unknown BAND_MODEL: {0}'.format(BAND_MODEL))
+
+if BAND_MODEL is not None:
+    print('Band model: upward radiation @400 ppm: {0:.1f} W/m2'.format(
+          ck.band_irradiance(source=s_earth_0, n_angles=N_ANGLES).sum()))
+    print('Band model: upward radiation @278 ppm: {0:.1f} W/m2'.format(
+          ck.band_irradiance(source=s_earth_0, scale=x_CO2_ref/x_CO2, n_angles=N_ANGLES).sum()))
+
+# %% Radiative forcing for a sweep of CO2 concentrations
+# ... lines are broadened at both ends of the range only, and interpolated in
+# ... between. Unlike rescale_mole_fraction() above, self-broadening is updated.
+# ... Costs about three more line-by-line calculations of the atmosphere (RUN_SWEEP)
+
+if RUN_SWEEP:
+    sweep = ConcentrationSweep(sf, Tgas=atm.T_K,
+                               pressure=atm.P_Pa*1e-5, # bar
+                               path_length=atm.path_length*1e5, # cm
+                               mole_fraction_range=(200e-6, 1200e-6),
+                               source=s_earth_0, n_angles=N_ANGLES)
+    print('Concentration sweep: max. interpolation error {0:.1e}'.format(sweep.error.max()))
+    df_forcing = sweep.run(np.linspace(200e-6, 1200e-6, 26), x_ref=x_CO2_ref,
+                           wavelength_min=11100, wavelength_max=20000)
+
+    plt.figure()
+    plt.plot(df_forcing.mole_fraction*1e6, df_forcing.forcing, '-ok')
+    plt.xlabel('CO2 mole fraction (ppm)')
+    plt.ylabel('Radiative forcing vs {0:.0f} ppm (W/m2)'.format(x_CO2_ref*1e6))
+    plt.tight_layout()
+
+    if SAVE_OUTPUT:
+        df_forcing.to_csv('out/co2_forcing_sweep.csv', index=False)
@@ -7,47 +7,67 @@ Created on Tue Jan  7 11:04:35 2020
 
 Plot all HITRAN spectraat 300 K for the first isotope
 
+Molecules are calculated in parallel processes. The status of each of them
+(calculation time, number of lines, errors) is kept in ``out/manifest.json``:
+run the script again to resume an interrupted sweep, or to retry the molecules
+that failed. Molecules whose figure already exists in ``out/`` are not
+calculated again.
 
 """
 
 from radis import calc_spectrum, MOLECULES_LIST_EQUILIBRIUM
-from radis.misc import ProgressBar, make_folders
+from radis.misc import make_folders
+import matplotlib
+matplotlib.use('Agg')       # figures are only saved, from the worker processes
 import matplotlib.pyplot as plt
+import sys
+sys.path.append('..')   # to import radis_tools from the repository root
+from radis_tools import run_sweep, plot_envelope
 
-make_folders('.', 'out')
-pb = ProgressBar(len(MOLECULES_LIST_EQUILIBRIUM))
-for i, M in enumerate(MOLECULES_LIST_EQUILIBRIUM):
-    pb.update(i)
-    filename = 'out/{0} - {1} infrared spectrum.png'.format(i, M)
-    
-    # To skip the existing ones 
-    from os.path import exists
-    if exists(filename):
-        continue
-    
-    try:
-        # Calculate RADIS spectrum
-        s = calc_spectrum(wavelength_min=1000, 
-                          wavelength_max=20000,
-                          Tgas=300,
-                          pressure=1,
-                          molecule=M,
-                          lineshape_optimization=None,
-                          cutoff=1e-23,
-                          isotope='1',
-                          verbose=0)
-        
-        # Plot and save it
-        s.name=M.replace('2', '$_{2}$').replace('3', '$_{3}$').replace('4', '$_{4}$')
-        s.name += ' ({0:.1f}s)'.format(s.conditions['calculation_time'])
-        s.plot('abscoeff', wunit='nm')  # TODO: switch to µm after it's possible
-        plt.yscale('log')
-        plt.legend(loc='upper right')
-        plt.savefig(filename)
-        plt.close()
-    except Exception as err:
-        # Errors can occur: isotopes not defined, no lines in the range, etc... Here we just 
-        # proceed to the next molecule 
-        print('Error with {0}:'.format(M))
-        print(err)
-pb.done()
\ No newline at end of file
+N_WORKERS = None        # None: all processors
+RETRY_FAILED = True     # errors can occur: isotopes not defined, no lines in the range, etc.
+
+
+def output_file(M):
+    ''' Figure of molecule ``M`` '''
+    i = MOLECULES_LIST_EQUILIBRIUM.index(M)
+    return 'out/{0} - {1} infrared spectrum.png'.format(i, M)
+
+
+def plot_molecule(M):
+    ''' Calculate and plot the spectrum of molecule ``M``, return its manifest entry '''
+
+    filename = output_file(M)
+
+    # Calculate RADIS spectrum
+    s = calc_spectrum(wavelength_min=1000,
+                      wavelength_max=20000,
+                      Tgas=300,
+                      pressure=1,
+                      molecule=M,
+                      lineshape_optimization=None,
+                      cutoff=1e-23,
+                      isotope='1',
+                      verbose=0)
+
+    # Plot and save it
+    s.name=M.replace('2', '$_{2}$').replace('3', '$_{3}$').replace('4', '$_{4}$')
+    s.name += ' ({0:.1f}s)'.format(s.conditions['calculation_time'])
+    plt.figure()
+    plot_envelope(s, 'abscoeff', wunit='nm')  # min/max per pixel. TODO: switch to µm after it's possible
+    plt.yscale('log')
+    plt.legend(loc='upper right')
+    plt.savefig(filename)
+    plt.close()
+
+    return {'calculation_time': s.conditions['calculation_time'],
+            'lines': s.conditions.get('lines_calculated'),
+            'output': filename}
+
+
+if __name__ == '__main__':
+    make_folders('.', 'out')
+    manifest = run_sweep(plot_molecule, MOLECULES_LIST_EQUILIBRIUM, 'out/manifest.json',
+                         max_workers=N_WORKERS, retry_failed=RETRY_FAILED,
+                         output=output_file)    # to skip the existing figures
+    print(manifest.summary())
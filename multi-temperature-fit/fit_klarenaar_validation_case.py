@@ -18,6 +18,12 @@ The example is based on one of `RADIS validation cases <https://github.com/radis
 It makes use of the RADIS `Spectrum <file:///D:/GitHub/radis/docs/_build/html/index.html#the-spectrum-class>`_
 class and the associated compare and load functions
 
+Spectra are calculated by RADIS ``non_eq_spectrum``. With ``COMPILED_MODEL = True``
+they are calculated by :class:`~radis_tools.noneq.NonEqModel` instead, a separate
+implementation of the nonequilibrium spectrum: the script then stops at start-up
+if its transmittance differs from RADIS by more than 1% of the maximum
+(``COMPILED_MODEL_TOL``) at the initial temperatures.
+
 
 References
 ----------
@@ -38,6 +44,10 @@ import numpy as np
 import matplotlib.pyplot as plt
 from scipy.optimize import minimize
 from os.path import join
+import sys
+sys.path.append('..')   # to import radis_tools from the repository root
+from radis_tools import ParallelJacobian, ModelCache, multistart, NonEqModel, SpectralEmulator, FitMonitor
+from radis_tools.xsec import factory_key
 
 # -----------------------------------------------------------------------------
 # -----------------------------------------------------------------------------
@@ -81,6 +91,27 @@ model_input = {'T12':517,
                'Trot':491,
                }
 
+# Precompute everything that does not depend on temperatures (line energies,
+# degeneracies, positions on the spectral grid, etc.). Only the fitted quantity
+# is calculated, directly on the experimental grid (no resampling).
+# The compiled model is its own implementation of the nonequilibrium spectrum
+# (populations, Voigt lineshapes): this validation case fits RADIS
+# non_eq_spectrum() unless COMPILED_MODEL = True, and the compiled model must
+# then agree with RADIS within COMPILED_MODEL_TOL at the initial values.
+COMPILED_MODEL = False
+COMPILED_MODEL_TOL = 1e-2   # max. transmittance difference, relative to the max.
+if COMPILED_MODEL:
+    noneq_model = NonEqModel(sf, vib_distribution='treanor',
+                             wavenumber=w_exp,
+                             quantities=['transmittance_noslit'],   # fitted variable
+                             )
+    error = noneq_model.compare((model_input['T12'], model_input['T12'], model_input['T3']),
+                                model_input['Trot'], Ttrans=model_input['Trot'])
+    print('Compiled model vs RADIS: max. error on transmittance {0:.2%}'.format(error))
+    if error > COMPILED_MODEL_TOL:
+        raise AssertionError('Compiled model differs from RADIS non_eq_spectrum by {0:.2%} '.format(error) +
+                             '(tolerance {0:.2%}). Use COMPILED_MODEL = False'.format(COMPILED_MODEL_TOL))
+
 # Calculate a new spectrum for given parameters:
 def theoretical_model(model_input):
     ''' Returns a Spectrum for given inputs T
@@ -109,9 +140,14 @@ def theoretical_model(model_input):
 
     # >>> This is where the RADIS calculation is done!
 
-    s = sf.non_eq_spectrum((T12, T12, T3), Trot, Ttrans=Trot,
-                           vib_distribution='treanor',
-                           name='treanor. fit')
+    if COMPILED_MODEL:
+        # only populations, intensities and lineshapes are recalculated
+        s = noneq_model((T12, T12, T3), Trot, Ttrans=Trot,
+                        name='treanor. fit')
+    else:
+        s = sf.non_eq_spectrum((T12, T12, T3), Trot, Ttrans=Trot,
+                               vib_distribution='treanor',
+                               name='treanor. fit')
 
     # <<<
 
@@ -136,6 +172,20 @@ bounds = np.array([[300, 2000],
                    [300, 2000]])
 fit_units = ['K', 'K', 'K']
 fit_variable = 'transmittance_noslit'
+PARALLEL_JACOBIAN = True    # if True, calculate the finite-difference gradient in parallel processes
+N_WORKERS = len(fit_params) # one process per stencil point
+CACHE_SIZE = 256            # model evaluations kept in memory
+CACHE_QUANTIZE = 0.1        # K: parameters closer than this share the same evaluation
+CACHE_FILE = None           # e.g. 'fit_cache.npz', to reuse evaluations across sessions
+EMULATOR_FILE = None        # e.g. 'fit_emulator.npz': fit a model tabulated within the bounds,
+                            # ... calculated once and reused for all spectra of the same setup
+EMULATOR_POINTS = 9         # initial grid points per fitted parameter
+EMULATOR_TOL = 1e-3         # refine the grid until the interpolation error is below this
+LIVE_MONITOR = True         # if True, plot the fit in a separate process (the fit does not wait
+                            # ... for the figures), and log it in MONITOR_FILE for a later replay
+MONITOR_FILE = 'fit_monitor.jsonl'
+MULTISTART = 0              # if > 0, number of Latin-hypercube starting points of a global fit,
+                            # ... run in parallel processes (else, one fit from the center of the bounds)
 
 
 
@@ -161,6 +211,32 @@ def print_fit_values(fit_values):
                 fit_params[i], np.round(fit_values[i], 0), fit_units[i])
                 for i in range(len(fit_params))])
 
+model_config = dict(factory_key(sf),
+                    pressure_mbar=sf.input.pressure_mbar,
+                    path_length=sf.input.path_length,
+                    mole_fraction=sf.input.mole_fraction,
+                    compiled_model=COMPILED_MODEL)
+
+# Tabulate the model within the bounds (or load it), and interpolate it during the fit
+if EMULATOR_FILE is not None:
+    emulator = SpectralEmulator.load_or_build(EMULATOR_FILE, theoretical_model,
+                    {k: np.linspace(b[0], b[1], EMULATOR_POINTS) for k, b in zip(fit_params, bounds)},
+                    fit_variable,
+                    inputs={k: v for k, v in model_input.items() if k not in fit_params},
+                    config=model_config, tol=EMULATOR_TOL, max_workers=N_WORKERS)
+    print(emulator.info())
+    fit_model = emulator
+else:
+    fit_model = theoretical_model
+
+# Model evaluations are cached, with the fitted variable only (revisited parameters
+# are not calculated again)
+model = ModelCache(fit_model, fit_variable,
+                   maxsize=CACHE_SIZE, quantize=CACHE_QUANTIZE,
+                   config=dict(model_config, model_input=model_input,
+                               emulator=EMULATOR_FILE),
+                   filename=CACHE_FILE)
+
 def generate_spectrum(fit_values):
 
 
@@ -170,7 +246,7 @@ def generate_spectrum(fit_values):
             inputs[k] = v
 
         # Calculate the theoretical model
-        s = theoretical_model(inputs)
+        s = model(inputs)
 
         return s
 
@@ -180,15 +256,18 @@ def cost_function(fit_values, plot=None):
 
     s = generate_spectrum(fit_values)
 
-    # Delete unecessary variables (for a faster resampling)
-    for var in [k for k in s._q.keys() if k not in [fit_variable, 'wavespace']]:
-        del s._q[var]
+    if not COMPILED_MODEL:
+        # Delete unecessary variables (for a faster resampling)
+        for var in [k for k in s._q.keys() if k not in [fit_variable, 'wavespace']]:
+            del s._q[var]
 
     if plot is not None:
         plt.figure(plot).clear()
         plot_diff(s_exp, s, var=fit_variable, nfig=plot, title=print_fit_values(fit_values))
 
-    s.resample(w_exp, energy_threshold=2e-2)
+    if not COMPILED_MODEL:
+        s.resample(w_exp, energy_threshold=2e-2)
+    # ... else: already calculated on the experimental grid
 
     return get_residual(s, s_exp, fit_variable, ignore_nan=True, norm='L2')
 
@@ -203,32 +282,44 @@ def log_cost_function(fit_values, plot=None):
 
     return res
 
-# Graph with plot diff
-figSpec, axSpec = plt.subplots(num='diffspectra')
-
-
-# Graph with residual
-# ... unlike 1D we cant plot the temperature here. Just plot the iteration
-
-plt.close('residual')
-figRes, axRes = plt.subplots(num='residual', figsize=(13.25, 6))
-axValues = axRes.twinx()
-#ax = fig.gca()
-#ax.set_ylim((bounds[0]))
+def log_monitor(fit_values, res):
+    ''' Send the iteration to the monitor process (a line in the log file) '''
+    # ... model evaluations are cached: the spectrum is not calculated again
+    s = generate_spectrum(fit_values)
+    monitor.log(fit_values, res, *s.get(fit_variable, wunit='cm-1', copy=False))
 
 fit_values_min, fit_values_max = bounds.T
-res0 = log_cost_function(fit_values_min)
-res1 = log_cost_function(fit_values_max, plot=figSpec.get_label())
-lineRes, = axRes.plot((1, 2), (res0, res1), '-ko')
-lineLast, = axRes.plot(2, res0, 'or')          # last iteration in red
-lineValues = {}
-for i, k in enumerate(fit_params):
-    lineValues[k] = axValues.plot((1, 2), (fit_values_min[i], fit_values_max[i]), '-', label=k)[0]
-axRes.set_xlim((0, maxiter))
-axRes.set_ylim(ymin=0)
-axRes.set_xlabel('Iteration')
-axRes.set_ylabel('Residual')
-figRes.legend()
+
+if LIVE_MONITOR:
+    # ... closed in the `finally` of the fitting loop: the viewer stops even if the fit fails
+    monitor = FitMonitor(MONITOR_FILE, fit_params, fit_units, w_exp, T_exp,
+                         variable=fit_variable)
+else:
+    # Graph with plot diff
+    figSpec, axSpec = plt.subplots(num='diffspectra')
+
+
+    # Graph with residual
+    # ... unlike 1D we cant plot the temperature here. Just plot the iteration
+
+    plt.close('residual')
+    figRes, axRes = plt.subplots(num='residual', figsize=(13.25, 6))
+    axValues = axRes.twinx()
+    #ax = fig.gca()
+    #ax.set_ylim((bounds[0]))
+
+    res0 = log_cost_function(fit_values_min)
+    res1 = log_cost_function(fit_values_max, plot=figSpec.get_label())
+    lineRes, = axRes.plot((1, 2), (res0, res1), '-ko')
+    lineLast, = axRes.plot(2, res0, 'or')          # last iteration in red
+    lineValues = {}
+    for i, k in enumerate(fit_params):
+        lineValues[k] = axValues.plot((1, 2), (fit_values_min[i], fit_values_max[i]), '-', label=k)[0]
+    axRes.set_xlim((0, maxiter))
+    axRes.set_ylim(ymin=0)
+    axRes.set_xlabel('Iteration')
+    axRes.set_ylabel('Residual')
+    figRes.legend()
 sf.verbose = False
 sf.warnings['NegativeEnergiesWarning'] = 'ignore'
 
@@ -241,6 +332,13 @@ def cost_and_plot_function(fit_values):
     This is the function that is called by minimize() '''
     global ite
     ite += 1
+
+    if LIVE_MONITOR:
+        res = log_cost_function(fit_values)
+        log_monitor(fit_values, res)
+        print('{0}, Residual: {1:.4f}'.format(print_fit_values(fit_values), res), flush=True)
+        return res
+
     # Plot one spectrum every 10 ites
     plot = None
     if not ite % plot_every:
@@ -267,37 +365,83 @@ def cost_and_plot_function(fit_values):
 
     return res
 
+eps = 20      # finite-difference step (K)
+
+def local_fit(x0):
+    ''' Fit from ``x0``, without plots (run by the worker processes of a global fit) '''
+    return minimize(cost_function, x0, method='TNC', bounds=bounds,
+                    options={'maxiter': maxiter, 'eps': eps})
+
 # >>> This is where the fitting loop happens
 print('\nNow starting the fitting process:')
 print('---------------------------------\n')
-best = minimize(cost_and_plot_function, (fit_values_max+fit_values_min)/2,
-#                method='L-BFGS-B',
-                method='TNC',
-                jac=None,
-                bounds=bounds,
-                options={'maxiter' : maxiter,
-                         'eps':20,
-#                         'ftol':1e-10,
-#                         'gtol':1e-10,
-                         'disp':True})
+try:
+    if LIVE_MONITOR:
+        for fit_values in [fit_values_min, fit_values_max]:
+            log_monitor(fit_values, log_cost_function(fit_values))
+    if MULTISTART:
+        # ... local fits from several starting points, in parallel. Stops when 3 of
+        # ... them converged to the same best solution
+        solutions = multistart(local_fit, bounds, n_starts=MULTISTART,
+                               x0=(fit_values_max+fit_values_min)/2, max_workers=N_WORKERS)
+        for r in solutions:
+            print('{0}, Residual: {1:.4f} (start {2}, basin {3})'.format(
+                  print_fit_values(r.x), r.fun, r.start, r.basin))
+        best = solutions[0]
+        if LIVE_MONITOR:
+            log_monitor(best.x, best.fun)
+    elif PARALLEL_JACOBIAN:
+        # ... the central point is calculated (and plotted) here, the gradient stencil in
+        # ... worker processes that share the loaded line database
+        objective = ParallelJacobian(cost_function, eps=eps, bounds=bounds,
+                                     max_workers=N_WORKERS,
+                                     fun_main=cost_and_plot_function)
+        jac = True
+    else:
+        objective = cost_and_plot_function
+        jac = None
+    if not MULTISTART:
+        best = minimize(objective, (fit_values_max+fit_values_min)/2,
+#                       method='L-BFGS-B',
+                        method='TNC',
+                        jac=jac,
+                        bounds=bounds,
+                        options={'maxiter' : maxiter,
+                                 'eps':eps,
+#                                 'ftol':1e-10,
+#                                 'gtol':1e-10,
+                                 'disp':True})
+    if PARALLEL_JACOBIAN and not MULTISTART:
+        objective.close()
+    if LIVE_MONITOR:
+        monitor.close(best=best.x.tolist(), success=bool(best.success))
+finally:
+    if LIVE_MONITOR:
+        monitor.close()     # if the fit failed: logs the end, so the viewer stops
 # <<<
 
 s_best = generate_spectrum(best.x)
 
+print(model.info())
+if CACHE_FILE is not None:
+    model.save()
+
 if best.success:
     print('Final {0}: {1}{2}'.format(fit_params, np.round(best.x), fit_units))
 
 # Res history
 
-# ... what does history say:
-print('Best: {0}: {1}{2} reached at iteration {3}/{4}'.format(
-                    fit_params,
-                    history_x[np.argmin(history_res)],
-                    fit_units,
-                    np.argmin(history_res),
-                    best.nfev))
+# ... what does history say (fits of the worker processes are not in the history):
+if not MULTISTART:
+    print('Best: {0}: {1}{2} reached at iteration {3}/{4}'.format(
+                        fit_params,
+                        history_x[np.argmin(history_res)],
+                        fit_units,
+                        np.argmin(history_res),
+                        best.nfev))
 
 # ... note that there are more function evaluations (best.nfev) that actual solver
 # ... iterations (best.nit) because the Jacobian is calculated numerically with
-# ... internal function calls
+# ... internal function calls. With PARALLEL_JACOBIAN, best.nfev counts the calls
+# ... to the objective, each of them calculating the gradient (see objective.nfev)
 
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+
+Summary
+-------
+
+Batch version of :py:mod:`fit_klarenaar_validation_case`: a time series of
+transmittance spectra is fitted with the same 1 rotational temperature +
+3 vibrational temperature (Treanor distributions) model.
+
+Spectra are fitted in parallel processes, each fit starting from the solution
+of the previous spectrum of the series. Results (fitted temperatures,
+residual, number of spectra calculated, fit time) are written to
+``out/fit_results.csv`` as they come: run the script again to resume an
+interrupted batch.
+
+If the ``SPECTRA`` folder does not exist, a synthetic time series is generated
+with the model (with noise), around the Klarenaar 2017 conditions.
+
+The model is :class:`~radis_tools.noneq.NonEqModel`, a separate implementation
+of the nonequilibrium spectrum: before the batch starts, it is compared with
+RADIS ``non_eq_spectrum`` at the initial guess, and the script stops if they
+differ by more than ``COMPILED_MODEL_TOL`` (1% of the maximum transmittance).
+
+"""
+
+from radis.test.utils import setup_test_line_databases
+from radis import SpectrumFactory, Spectrum
+from radis.spectrum.compare import get_residual
+import numpy as np
+from scipy.optimize import minimize
+from os import listdir, makedirs
+from os.path import exists, join
+import sys
+sys.path.append('..')   # to import radis_tools from the repository root
+from radis_tools import NonEqModel, fit_series
+
+# -----------------------------------------------------------------------------
+#                 USER SECTION    (change this as you want)
+# -----------------------------------------------------------------------------
+
+SPECTRA = 'out/series'                  # folder of the spectra (.txt, cm-1 / transmittance)
+RESULTS = 'out/fit_results.csv'
+fit_params = ['T12', 'T3', 'Trot']
+x0 = [517, 2641, 491]                   # initial guess for the first spectrum (K)
+bounds = np.array([[300, 2000],
+                   [300, 5000],
+                   [300, 2000]])
+fit_variable = 'transmittance_noslit'
+eps = 20                                # finite-difference step (K)
+CHUNKSIZE = 8                           # consecutive spectra fitted by each task
+N_WORKERS = None                        # None: all processors
+COMPILED_MODEL_TOL = 1e-2               # max. transmittance difference with RADIS, relative to the max.
+
+# -----------------------------------------------------------------------------
+
+sf = SpectrumFactory(2284.2, 2284.6,
+                     wstep=0.001,                # cm-1
+                     pressure=20*1e-3,           # bar
+                     db_use_cached=True,
+                     lvl_use_cached=True,
+                     cutoff=1e-25,
+                     isotope='1,2',
+                     path_length=10,             # cm-1
+                     mole_fraction=0.1*28.97/44.07,
+                     broadening_max_width=1,     # cm-1
+                     medium='vacuum',
+                     verbose=0,
+                     )
+sf.warnings['MissingSelfBroadeningWarning'] = 'ignore'
+sf.warnings['NegativeEnergiesWarning'] = 'ignore'
+setup_test_line_databases()
+sf.load_databank('HITEMP-CO2-TEST')
+
+# All spectra of the series are on the same experimental grid: the model is
+# calculated directly there. Worker processes share it.
+w_exp = np.linspace(2284.2, 2284.6, 401)
+if exists(SPECTRA):
+    w_exp = Spectrum.from_txt(join(SPECTRA, sorted(listdir(SPECTRA))[0]),
+                              fit_variable, waveunit='cm-1', unit='').get_wavenumber()
+noneq_model = NonEqModel(sf, vib_distribution='treanor', wavenumber=w_exp,
+                         quantities=[fit_variable])
+
+
+def load_spectrum(filename):
+    return Spectrum.from_txt(filename, fit_variable, waveunit='cm-1', unit='')
+
+
+def fit_spectrum(s_exp, x0):
+    ''' Fit the temperatures of one experimental spectrum, starting from ``x0`` '''
+
+    def cost_function(fit_values):
+        T12, T3, Trot = fit_values
+        s = noneq_model((T12, T12, T3), Trot, Ttrans=Trot)
+        return get_residual(s, s_exp, fit_variable, ignore_nan=True, norm='L2')
+
+    return minimize(cost_function, np.clip(x0, *bounds.T), method='TNC', bounds=bounds,
+                    options={'eps': eps, 'maxiter': 300})
+
+
+def generate_series(n=48, noise=2e-3):
+    ''' Synthetic discharge: T3 rises then relaxes, T12 and Trot heat slowly '''
+    makedirs(SPECTRA, exist_ok=True)
+    t = np.linspace(0, 1, n)
+    rng = np.random.RandomState(0)
+    for i, ti in enumerate(t):
+        T12 = 450 + 150 * ti
+        T3 = 900 + 1800 * np.sin(np.pi * ti)
+        Trot = 420 + 120 * ti
+        s = noneq_model((T12, T12, T3), Trot, Ttrans=Trot)
+        w, T = s.get(fit_variable, wunit='cm-1')
+        s = Spectrum.from_array(w, T + noise * rng.randn(len(T)), fit_variable,
+                                waveunit='cm-1', unit='')
+        s.savetxt(join(SPECTRA, 'spectrum_{0:04d}.txt'.format(i)), fit_variable, wunit='cm-1')
+
+
+if __name__ == '__main__':
+    error = noneq_model.compare((x0[0], x0[0], x0[1]), x0[2], Ttrans=x0[2])
+    print('Compiled model vs RADIS: max. error on transmittance {0:.2%}'.format(error))
+    if error > COMPILED_MODEL_TOL:
+        raise AssertionError('Compiled model differs from RADIS non_eq_spectrum by {0:.2%} '.format(error) +
+                             '(tolerance {0:.2%})'.format(COMPILED_MODEL_TOL))
+
+    if not exists(SPECTRA):
+        generate_series()
+
+    results = fit_series(fit_spectrum, SPECTRA, x0, RESULTS, params=fit_params,
+                         load=load_spectrum, chunksize=CHUNKSIZE, max_workers=N_WORKERS)
+    print(results)
+    print('Mean fit time: {0:.1f}s ({1:.1f}s with a warm start)'.format(
+          results.fit_time.mean(), results.fit_time[results.warm_start].mean()))
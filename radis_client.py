@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+"""
+Thin client of the RADIS spectrum service (:py:mod:`radis_tools.service`).
+
+``calc_spectrum()`` in a new Python kernel pays the RADIS import, the
+databank fetch or load, and the SpectrumFactory setup before the first
+spectrum (seconds, at every kernel restart). The spectrum service is a
+long-running local process that keeps them in memory: this client only sends
+the calculation parameters, and receives the spectral arrays.
+
+The client imports the standard library and numpy only. RADIS is imported
+when the first Spectrum object is created (``as_spectrum=True``), and the
+service is started in the background if it is not running yet::
+
+    from radis_client import calc_spectrum
+    s = calc_spectrum(1900, 2300, molecule='CO', isotope='1,2,3',
+                      pressure=1.01325, Tgas=1000, mole_fraction=0.1, path_length=1)
+
+The service stays up after the kernel ends: the next ``calc_spectrum()`` with
+the same molecule, range and databank is calculated by a warm SpectrumFactory.
+
+Spectra are received in the binary format of :py:mod:`radis_tools.wire`.
+
+"""
+
+from __future__ import print_function, absolute_import, division
+
+import builtins
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from time import time, sleep
+from urllib.error import HTTPError, URLError
+from urllib.request import build_opener, ProxyHandler, Request
+
+
+def _load_wire():
+    ''' The :py:mod:`radis_tools.wire` module, loaded from its file: the
+    repository root does not need to be on the Python path '''
+    if 'radis_tools.wire' in sys.modules:
+        return sys.modules['radis_tools.wire']
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'radis_tools', 'wire.py')
+    spec = importlib.util.spec_from_file_location('radis_client_wire', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+_wire = _load_wire()
+MAGIC, DEFAULT_HOST, DEFAULT_PORT = _wire.MAGIC, _wire.DEFAULT_HOST, _wire.DEFAULT_PORT
+pack, unpack, _to_json = _wire.pack, _wire.unpack, _wire.to_json
+
+#: arguments of :py:func:`~radis.lbl.calc.calc_spectrum`, in order (for positional arguments)
+CALC_SPECTRUM_ARGS = ['wavenum_min', 'wavenum_max', 'wavelength_min', 'wavelength_max',
+                      'Tgas', 'Tvib', 'Trot', 'pressure', 'molecule', 'isotope',
+                      'mole_fraction', 'path_length', 'medium', 'databank', 'wstep',
+                      'broadening_max_width', 'optimization', 'overpopulation', 'name',
+                      'use_cached', 'verbose', 'mode']
+#: units of the arguments that can be given as astropy quantities
+ARG_UNITS = {'wavenum_min': 'cm-1', 'wavenum_max': 'cm-1', 'wstep': 'cm-1',
+             'wavelength_min': 'nm', 'wavelength_max': 'nm',
+             'Tgas': 'K', 'Tvib': 'K', 'Trot': 'K',
+             'pressure': 'bar', 'path_length': 'cm'}
+
+
+def decode_spectrum(payload, as_spectrum=True):
+    ''' Spectrum of a ``/calc_spectrum`` payload
+
+    Returns
+    -------
+
+    s: :class:`~radis.spectrum.spectrum.Spectrum`
+        if ``as_spectrum``. Else ``(quantities, units, conditions)``, with
+        ``quantities`` a dict of ``(w, I)`` as in the Spectrum constructor
+        (without importing RADIS)
+    '''
+    header, arrays = unpack(payload)
+    quantities = {}
+    for name, I in arrays.items():
+        group, var = name.split('/')
+        if var != 'wavespace':
+            quantities[var] = (arrays[group + '/wavespace'], I)
+    if not as_spectrum:
+        return quantities, header['units'], header['conditions']
+    from radis import Spectrum
+    return Spectrum(quantities, header['units'], conditions=header['conditions'],
+                    cond_units=header['cond_units'], waveunit=header['waveunit'],
+                    name=header['name'], warnings=False)
+
+
+def _strip_unit(k, v):
+    ''' Value of an astropy quantity in the unit of argument ``k`` '''
+    if not hasattr(v, 'unit'):
+        return v
+    import astropy.units as u
+    return v.to_value(u.Unit(ARG_UNITS[k]), equivalencies=u.spectral())
+
+
+def start_service(host=DEFAULT_HOST, port=DEFAULT_PORT, timeout=120, log=None):
+    ''' Start the spectrum service in a background process, and wait until it
+    answers. The process is not stopped with the current Python session.
+
+    Parameters
+    ----------
+
+    log: str, or ``None``
+        output of the service. If ``None``, ``radis_service_<port>.log`` in the
+        temporary folder.
+    '''
+    if log is None:
+        log = os.path.join(tempfile.gettempdir(), 'radis_service_{0}.log'.format(port))
+    root = os.path.dirname(os.path.abspath(__file__))
+    with open(log, 'a') as f:
+        process = subprocess.Popen([sys.executable, '-m', 'radis_tools.service',
+                                    '--host', host, '--port', str(port)],
+                                   cwd=root, stdout=f, stderr=subprocess.STDOUT,
+                                   start_new_session=True)   # survives the kernel
+    client = RadisClient(host, port, start=False)
+    t0 = time()
+    while not client.ping():
+        if process.poll() is not None:
+            raise RuntimeError('Spectrum service stopped. See {0}'.format(log))
+        if time() - t0 > timeout:
+            raise TimeoutError('Spectrum service not answering after {0}s. See {1}'.format(
+                               timeout, log))
+        sleep(0.1)
+    return client
+
+
+class RadisClient(object):
+    ''' Client of a spectrum service running on ``host:port``
+
+    Parameters
+    ----------
+
+    host, port: str, int
+        address of the service (local)
+
+    start: bool
+        if ``True``, start the service if it is not running, see
+        :func:`~radis_client.start_service`
+
+    Examples
+    --------
+
+    ::
+
+        client = RadisClient()
+        s = client.calc_spectrum(1900, 2300, molecule='CO', Tgas=1000, mole_fraction=0.1)
+        print(client.status())
+
+    '''
+
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT, start=True):
+        self.url = 'http://{0}:{1}'.format(host, port)
+        self._opener = build_opener(ProxyHandler({}))    # local: no HTTP proxy
+        if start and not self.ping():
+            start_service(host, port)
+
+    def _request(self, path, body=None):
+        request = Request(self.url + path, data=body,
+                          headers={'Content-Type': 'application/json'})
+        try:
+            with self._opener.open(request) as response:
+                return response.read()
+        except HTTPError as err:
+            body = err.read().decode(errors='replace')
+            try:
+                error = json.loads(body)
+            except ValueError:
+                error = None
+            if not (isinstance(error, dict) and 'error' in error and 'message' in error):
+                # ... not an error of the service (e.g. a proxy page)
+                raise RuntimeError(err.code, body)
+            # ... same exception as in the service, if built-in
+            cls = getattr(builtins, error['error'], None)
+            if not (isinstance(cls, type) and issubclass(cls, Exception)):
+                cls = RuntimeError
+            raise cls('{0} (in the spectrum service)'.format(error['message']))
+
+    def ping(self):
+        ''' ``True`` if the service answers '''
+        try:
+            self.status()
+            return True
+        except (URLError, ConnectionError):
+            return False
+
+    def status(self):
+        ''' Factories in memory, and number of requests of the service '''
+        return json.loads(self._request('/status').decode())
+
+    def shutdown(self):
+        ''' Stop the service '''
+        self._request('/shutdown', b'{}')
+
+    def calc_spectrum(self, *args, **kwargs):
+        ''' Same as :py:func:`~radis.lbl.calc.calc_spectrum`, calculated by the service
+
+        Other Parameters
+        ----------------
+
+        dtype: ``'float64'``, ``'float32'``
+            precision of the transferred quantities (the wavespace stays in float64)
+
+        quantities: list of str, or ``None``
+            quantities to transfer, e.g. ``['transmittance_noslit']``. If ``None``, all.
+
+        as_spectrum: bool
+            if ``False``, return ``(quantities, units, conditions)`` without importing RADIS,
+            see :func:`~radis_client.decode_spectrum`
+
+        '''
+        as_spectrum = kwargs.pop('as_spectrum', True)
+        if len(args) > len(CALC_SPECTRUM_ARGS):
+            raise TypeError('Too many positional arguments')
+        for k, v in zip(CALC_SPECTRUM_ARGS, args):
+            if k in kwargs:
+                raise TypeError('calc_spectrum() got multiple values for argument {0}'.format(k))
+            kwargs[k] = v
+        kwargs = {k: _strip_unit(k, v) for k, v in kwargs.items()}
+        payload = self._request('/calc_spectrum', json.dumps(kwargs, default=_to_json).encode())
+        return decode_spectrum(payload, as_spectrum=as_spectrum)
+
+
+_client = None
+
+
+def calc_spectrum(*args, **kwargs):
+    ''' Same as :py:func:`~radis.lbl.calc.calc_spectrum`, calculated by the
+    spectrum service on the default port (started if needed). See
+    :meth:`~radis_client.RadisClient.calc_spectrum` '''
+    global _client
+    if _client is None:
+        _client = RadisClient()
+    return _client.calc_spectrum(*args, **kwargs)
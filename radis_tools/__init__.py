@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""
+Tools built around RADIS for the examples of this repository.
+
+Run the examples from their own folder: the scripts add the repository root
+to the Python path to import ``radis_tools``.
+
+Notes
+-----
+
+The tools are imported from their module on first use: importing
+``radis_tools``, or a module that does not need RADIS (e.g.
+:py:mod:`radis_tools.wire`), does not import RADIS.
+
+"""
+
+import importlib
+
+#: public names, and the module that defines them
+_EXPORTS = {'calc_layers': 'layers',
+            'calc_layers_parallel': 'parallel',
+            'LOSAccumulator': 'los', 'calc_irradiance': 'los', 'make_irradiance': 'los',
+            'SerialLOS': 'los', 'MergeLOS': 'los',
+            'ConcentrationSweep': 'concentration',
+            'CrossSectionTable': 'xsec',
+            'CorrelatedK': 'bands',
+            'calc_sharded': 'sharding',
+            'SweepManifest': 'sweep', 'run_sweep': 'sweep',
+            'plot_envelope': 'plot',
+            'ParallelJacobian': 'fitting', 'ModelCache': 'fitting', 'multistart': 'fitting',
+            'NonEqModel': 'noneq',
+            'SpectralEmulator': 'emulator',
+            'fit_series': 'batch',
+            'FitMonitor': 'monitor', 'replay_fit': 'monitor',
+            'LineDatabaseCache': 'linedb', 'load_databank': 'linedb',
+            'open_databank_cache': 'linedb',
+            'calc_streamed': 'streaming',
+            'apply_slit': 'slit', 'compare_convolution': 'slit',
+            'store_spec': 'specfile', 'load_spec': 'specfile',
+            'compact': 'storage', 'copy_view': 'storage', 'compare_precision': 'storage',
+            'memory_usage': 'storage',
+            }
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError("module 'radis_tools' has no attribute '{0}'".format(name))
+    return getattr(importlib.import_module('.' + _EXPORTS[name], __name__), name)
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
@@ -0,0 +1,304 @@
+# -*- coding: utf-8 -*-
+"""
+Correlated-k band model for integrated irradiance.
+
+In each spectral band, the absorption coefficient of a layer is replaced by its
+distribution ``k(g)``, the absorption coefficient sorted in increasing order as
+a function of the cumulative fraction ``g`` of the band. Radiative transfer is
+then solved for a few quadrature points in ``g`` instead of every point of the
+spectral grid, assuming the spectral positions of strong and weak absorption
+are the same in all layers (correlated-k approximation).
+
+:class:`~radis_tools.bands.CorrelatedK` is built from layer absorption
+coefficients (line-by-line spectra, or directly from a SpectrumFactory one
+layer at a time, with the steps of
+:py:meth:`~radis.lbl.factory.SpectrumFactory.eq_spectrum`). The band
+irradiance is integrated over zenith angles as
+:func:`~radis_tools.los.calc_irradiance` (``n_angles=0``: ``pi * radiance``
+along the vertical), and validated against the line-by-line
+:py:func:`~radis.los.slabs.SerialSlabs` line-of-sight with
+:meth:`~radis_tools.bands.CorrelatedK.compare_lbl`.
+
+"""
+
+from __future__ import print_function, absolute_import, division
+
+import numpy as np
+import pandas as pd
+from radis import SerialSlabs
+from radis.misc.progress_bar import ProgressBar
+from radis.phys.blackbody import planck
+from radis.phys.convert import cm2nm
+from .layers import get_wavenumber_grid, broadcast_layers, calc_abscoeff
+from .los import get_on_grid, angle_quadrature
+
+
+def gauss_quadrature(n_g, g_split=0.9):
+    ''' Quadrature points and weights on ``g`` in [0, 1]
+
+    Half of the Gauss-Legendre points are in [0, g_split], half in [g_split, 1],
+    where ``k(g)`` increases steeply (line centers).
+
+    Returns
+    -------
+
+    g, weights: arrays
+
+    '''
+    n1 = n_g // 2
+    n2 = n_g - n1
+    g, weights = [], []
+    for (a, b), n in zip([(0, g_split), (g_split, 1)], [n1, n2]):
+        if n == 0:
+            continue
+        x, wq = np.polynomial.legendre.leggauss(n)
+        g.append(a + (b - a) * (x + 1) / 2)
+        weights.append((b - a) * wq / 2)
+    return np.hstack(g), np.hstack(weights)
+
+
+class CorrelatedK(object):
+    ''' Correlated-k distributions of a stack of layers, in spectral bands
+
+    Parameters
+    ----------
+
+    w: array
+        wavenumber grid (cm-1) of the layer absorption coefficients
+
+    bands: array
+        band edges (cm-1), e.g. ``np.linspace(500, 900, 21)``
+
+    n_g: int
+        number of quadrature points per band. Default 16.
+
+    g_split: float
+        see :func:`~radis_tools.bands.gauss_quadrature`
+
+    Examples
+    --------
+
+    ::
+
+        ck = CorrelatedK.from_slabs(slabs, bands=np.linspace(500, 900, 21))
+        P = ck.band_irradiance(source=s_earth_0)      # W/m2 in each band
+        print(ck.compare_lbl(slabs, source=s_earth_0))
+
+    Attributes
+    ----------
+
+    k_g: 3D array, shape ``(layer, band, n_g)``
+        absorption coefficient (cm-1) at each quadrature point
+
+    planck: 2D array, shape ``(layer, band)``
+        Planck radiance of each layer, averaged over each band (mW/cm2/sr/nm)
+
+    '''
+
+    def __init__(self, w, bands, n_g=16, g_split=0.9):
+
+        self.w = np.asarray(w)
+        self.bands = np.asarray(bands, dtype=np.float64)
+        self.g, self.g_weights = gauss_quadrature(n_g, g_split)
+
+        #: index of the band of each spectral point (-1 if outside all bands)
+        band = np.digitize(self.w, self.bands) - 1
+        band[self.w == self.bands[-1]] = len(self.bands) - 2
+        band[(self.w < self.bands[0]) | (self.w > self.bands[-1])] = -1
+        self._band = band
+        empty = [b for b in range(len(self.bands) - 1) if not (band == b).any()]
+        if empty:
+            raise ValueError('Band {0:.4f}-{1:.4f} cm-1 has no point on the spectral grid '.format(
+                             self.bands[empty[0]], self.bands[empty[0] + 1]) +
+                             '({0:.4f}-{1:.4f} cm-1, {2} points): use bands within the grid, '.format(
+                             self.w.min(), self.w.max(), len(self.w)) +
+                             'wider than the wavenumber step')
+
+        # Bands are integrated in wavelength, as Spectrum.get_integral(wunit='nm')
+        self._dl = np.abs(np.gradient(cm2nm(self.w)))
+        self.band_width = np.array([self._dl[band == b].sum() for b in range(len(self.bands) - 1)])
+
+        self.Tgas = []
+        self.path_length = []
+        self._k_g = []
+        self._planck = []
+
+    @property
+    def k_g(self):
+        return np.array(self._k_g)
+
+    @property
+    def planck(self):
+        return np.array(self._planck)
+
+    def _band_average(self, I):
+        return np.array([np.sum(I[self._band == b] * self._dl[self._band == b]) / self.band_width[b]
+                         for b in range(len(self.bands) - 1)])
+
+    def add_layer(self, abscoeff, Tgas, path_length):
+        ''' Add a layer on top of the previous ones
+
+        Parameters
+        ----------
+
+        abscoeff: array
+            absorption coefficient (cm-1) on the grid ``w``
+
+        Tgas, path_length: float
+            temperature (K) and thickness (cm) of the layer
+
+        '''
+        k_g = np.empty((len(self.bands) - 1, len(self.g)))
+        for b in range(len(self.bands) - 1):
+            inband = self._band == b
+            order = np.argsort(abscoeff[inband])
+            k_sorted = abscoeff[inband][order]
+            dl = self._dl[inband][order]
+            G = (np.cumsum(dl) - dl / 2) / dl.sum()     # cumulative fraction of the band
+            k_g[b] = np.interp(self.g, G, k_sorted)
+
+        self._k_g.append(k_g)
+        self._planck.append(self._band_average(planck(cm2nm(self.w), Tgas, unit='mW/sr/cm2/nm')))
+        self.Tgas.append(Tgas)
+        self.path_length.append(path_length)
+
+    @classmethod
+    def from_slabs(cls, slabs, bands, n_g=16, g_split=0.9):
+        ''' Build the k-distributions from the spectra of each layer, ordered from
+        the source (e.g. the ground) to the observer
+
+        Slabs must have ``abscoeff``, and ``Tgas`` and ``path_length`` in their conditions '''
+        w = slabs[0].get_wavenumber()
+        ck = cls(w, bands, n_g=n_g, g_split=g_split)
+        for s in slabs:
+            ck.add_layer(get_on_grid(s, 'abscoeff', ck.w, Iunit='cm-1'),
+                         s.conditions['Tgas'], s.conditions['path_length'])
+        return ck
+
+    @classmethod
+    def from_factory(cls, sf, Tgas, pressure, path_length, mole_fraction, bands,
+                     n_g=16, g_split=0.9, verbose=True):
+        ''' Build the k-distributions line-by-line, one layer at a time: only the
+        k-distributions are kept in memory, not the layer spectra. Absorption
+        coefficients are those of :py:meth:`~radis.lbl.factory.SpectrumFactory.eq_spectrum`,
+        see :func:`~radis_tools.layers.calc_abscoeff`
+
+        Parameters
+        ----------
+
+        sf: :class:`~radis.lbl.factory.SpectrumFactory`
+            with a line database already loaded
+
+        Tgas, pressure, path_length, mole_fraction: arrays
+            conditions of each layer (K, bar, cm, --), from the source to the observer
+
+        bands: array
+            band edges (cm-1)
+
+        '''
+        Tgas, pressure, path_length, mole_fraction = broadcast_layers(Tgas, pressure,
+                                                                      path_length,
+                                                                      mole_fraction)
+        ck = cls(get_wavenumber_grid(sf), bands, n_g=n_g, g_split=g_split)
+        if verbose:
+            pb = ProgressBar(len(Tgas))
+        for i in range(len(Tgas)):
+            if verbose:
+                pb.update(i)
+            _, abscoeff, _ = calc_abscoeff(sf, Tgas[i], pressure[i], mole_fraction[i],
+                                           verbose=False)
+            ck.add_layer(abscoeff[0], Tgas[i], path_length[i])
+        if verbose:
+            pb.done()
+        return ck
+
+    def band_irradiance(self, source=None, scale=1, n_angles=4):
+        ''' Upward hemispheric irradiance integrated over each band
+
+        Parameters
+        ----------
+
+        source: :class:`~radis.spectrum.spectrum.Spectrum`, or ``None``
+            radiance at the start of the line-of-sight, e.g. the ground emission
+
+        scale: float
+            multiply all absorption coefficients, e.g. ``278/400`` for a 278 ppm
+            scenario from a 400 ppm model. As with
+            :py:meth:`~radis.spectrum.spectrum.Spectrum.rescale_mole_fraction`,
+            the change of broadening is neglected.
+
+        n_angles: int
+            number of zenith angles, see :func:`~radis_tools.los.angle_quadrature`.
+            If 0, ``pi * radiance`` along the vertical.
+
+        Returns
+        -------
+
+        P: array
+            irradiance in each band (W/m2)
+
+        '''
+        mu, weights = angle_quadrature(n_angles)
+        I = np.zeros((len(mu), len(self.bands) - 1, len(self.g)))
+        if source is not None:
+            I_source = get_on_grid(source, 'radiance_noslit', self.w, Iunit='mW/cm2/sr/nm')
+            I[:] = self._band_average(I_source)[:, None]
+
+        for k_g, B, L in zip(self._k_g, self._planck, self.path_length):
+            T = np.exp(-scale * k_g * L / mu[:, None, None])
+            I = I * T + B[:, None] * (1 - T)
+
+        # mW/cm2/sr/nm -> W/m2/nm, and integrate over angles, g and wavelength
+        return 10 * (weights @ (I @ self.g_weights)) * self.band_width
+
+    def compare_lbl(self, slabs, source=None, n_angles=4):
+        ''' Validate the band model against the line-by-line line-of-sight
+
+        The reference is the radiance of
+        ``SerialSlabs(source, *slabs)`` (:py:func:`~radis.los.slabs.SerialSlabs`)
+        at each zenith angle of :func:`~radis_tools.los.angle_quadrature`, the
+        path length of each slab divided by the cosine of the angle. It does not
+        use the solvers of :py:mod:`radis_tools.los`.
+
+        Parameters
+        ----------
+
+        slabs: list of :class:`~radis.spectrum.spectrum.Spectrum`
+            the layers the model was built from
+
+        source: :class:`~radis.spectrum.spectrum.Spectrum`, or ``None``
+            radiance at the start of the line-of-sight
+
+        n_angles: int
+            number of zenith angles, in both models
+
+        Returns
+        -------
+
+        df: pandas DataFrame
+            for each band: edges (cm-1), irradiance of the band model and of
+            the line-by-line line-of-sight (W/m2), relative error
+
+        '''
+        mu, weights = angle_quadrature(n_angles)
+        I_lbl = np.zeros(len(self.w))
+        for m, weight in zip(mu, weights):
+            layers = []
+            for s in slabs:
+                if m != 1:
+                    s = s.copy()
+                    s.rescale_path_length(s.conditions['path_length'] / m)
+                layers.append(s)
+            if source is not None:
+                layers.insert(0, source)
+            s_los = SerialSlabs(*layers, resample='intersect')
+            I_lbl += weight * get_on_grid(s_los, 'radiance_noslit', self.w,
+                                          Iunit='mW/cm2/sr/nm')
+        P_lbl = 10 * self._band_average(I_lbl) * self.band_width
+        P_ck = self.band_irradiance(source=source, n_angles=n_angles)
+
+        return pd.DataFrame({'wavenum_min': self.bands[:-1],
+                             'wavenum_max': self.bands[1:],
+                             'irradiance_ck': P_ck,
+                             'irradiance_lbl': P_lbl,
+                             'error': (P_ck - P_lbl) / P_lbl})
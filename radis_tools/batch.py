@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+"""
+Fit a time series of experimental spectra in a process pool.
+
+The series is split in ``max_workers`` contiguous blocks, one per process.
+Each block is fitted spectrum after spectrum, and each fit starts from the
+solution of the previous spectrum (warm start): consecutive spectra of a time
+series have close parameters, and the fits converge in a few iterations.
+Blocks are sent to the workers in chunks of consecutive spectra: a chunk is
+submitted when the previous chunk of its block is done, and starts from its
+last solution. Only the first spectrum of each block starts cold, from the
+initial guess (or, when a batch is resumed, from the closest preceding
+spectrum already fitted).
+
+Notes
+-----
+
+The first ``max_workers`` spectra of the blocks start cold: for a series much
+longer than the number of processes, almost all fits are warm-started. Chunks
+only set how often results are written, and how much work is lost when a batch
+is interrupted.
+
+Spectra are loaded in the worker processes, one at a time: only file names (or
+whatever ``load`` expects) are sent to the workers, and only the fitted
+parameters come back. Results are appended to a ``.csv`` table as chunks
+complete: an interrupted batch is resumed where it stopped.
+
+"""
+
+from __future__ import print_function, absolute_import, division
+
+import csv
+import glob
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from os.path import exists, basename
+from time import time
+import numpy as np
+import pandas as pd
+from .fitting import get_fork_context
+
+
+def _fit_chunk(fit, load, chunk, x0, warm_start=False):
+    ''' Fit consecutive spectra, each of them starting from the solution of
+    the previous one. ``warm_start``: whether ``x0`` is the solution of
+    another chunk
+
+    Returns
+    -------
+
+    rows: list of dict
+    '''
+    rows = []
+    x = np.asarray(x0, dtype=np.float64)
+    for i, (index, item) in enumerate(chunk):
+        t0 = time()
+        s = load(item) if load is not None else item
+        name = basename(item) if isinstance(item, str) else s.get_name()
+        best = fit(s, x)
+        rows.append({'index': index,
+                     'name': name,
+                     'x': np.asarray(best.x, dtype=np.float64).tolist(),
+                     'residual': float(best.fun),
+                     'nfev': int(best.nfev),
+                     'success': bool(best.success),
+                     'fit_time': time() - t0,
+                     'warm_start': i > 0 or warm_start,
+                     })
+        del s
+        if best.success:
+            x = np.asarray(best.x, dtype=np.float64)
+    return rows
+
+
+def fit_series(fit, spectra, x0, filename, params=None, load=None, chunksize=8,
+               max_workers=None, resume=True, verbose=True):
+    ''' Fit all spectra of a time series, in parallel, with warm starts
+
+    Parameters
+    ----------
+
+    fit: function
+        ``fit(s_exp, x0) -> OptimizeResult``, e.g. a call to
+        :py:func:`scipy.optimize.minimize`. Must be defined at the module level.
+        Only ``x``, ``fun``, ``nfev`` and ``success`` of the result are used.
+
+    spectra: str, or iterable
+        folder or glob pattern of the spectrum files (sorted by name, e.g.
+        ``'data/*.txt'``), or iterable of items passed to ``load``, or of
+        :class:`~radis.spectrum.spectrum.Spectrum`. Iterables are read at the
+        start, to split the series in blocks: pass file names and ``load``
+        rather than a generator of spectra.
+
+    x0: array
+        initial guess of the first spectrum of the series
+
+    filename: str
+        ``.csv`` table of the results, one row per spectrum: index in the series,
+        name, fitted parameters, residual, number of function evaluations,
+        success, fit time, and whether the fit was warm-started (from the
+        solution of another spectrum)
+
+    Other Parameters
+    ----------------
+
+    params: list of str, or ``None``
+        names of the fitted parameters, used as column names. If ``None``,
+        ``x0``, ``x1``, etc.
+
+    load: function, or ``None``
+        ``load(item) -> Spectrum``, called in the worker processes, e.g. a
+        function returning ``Spectrum.from_txt(item, 'transmittance_noslit', 'cm-1', '')``.
+        Must be defined at the module level. If ``None``, items are Spectrum
+        objects.
+
+    chunksize: int
+        number of consecutive spectra fitted in each task. Results are written
+        after each chunk. Chunks do not start cold: each of them starts from the
+        last solution of the previous chunk of its block, see
+        :py:mod:`radis_tools.batch`.
+
+    max_workers: int, or ``None``
+        number of processes, and of blocks of the series. If ``None``, use all
+        processors. Processes are forked from the main process, and share its
+        loaded line database.
+
+    resume: bool
+        if ``True`` and ``filename`` exists, spectra already in the table
+        (same index in the series) are skipped. Else the table is overwritten.
+
+    Returns
+    -------
+
+    results: pandas DataFrame
+        the content of the table ``filename``, sorted by index in the series
+
+    Examples
+    --------
+
+    ::
+
+        results = fit_series(fit_spectrum, 'data/*.txt', x0=[517, 2641, 491],
+                             filename='out/fit_results.csv',
+                             params=['T12', 'T3', 'Trot'], load=load_spectrum)
+
+    '''
+
+    t0 = time()
+    if isinstance(spectra, str):
+        pattern = spectra if any(c in spectra for c in '*?[') else spectra.rstrip('/') + '/*'
+        spectra = sorted(glob.glob(pattern))
+    x0 = np.asarray(x0, dtype=np.float64)
+    if params is None:
+        params = ['x{0}'.format(i) for i in range(len(x0))]
+    columns = ['index', 'name'] + list(params) + ['residual', 'nfev', 'success',
+                                                  'fit_time', 'warm_start']
+
+    previous = None
+    if resume and exists(filename):
+        previous = pd.read_csv(filename)
+    else:
+        with open(filename, 'w') as f:
+            csv.writer(f).writerow(columns)
+    done = set() if previous is None else set(previous['index'])
+    if verbose and done:
+        print('fit_series: {0} spectra already fitted in {1}'.format(len(done), filename))
+
+    def start(index):
+        # last successful solution before ``index`` in the table, or x0
+        if previous is not None:
+            fitted = previous[(previous['index'] < index) & previous['success']]
+            if len(fitted):
+                row = fitted.loc[fitted['index'].idxmax()]
+                return row[list(params)].values.astype(np.float64), True
+        return x0, False
+
+    # Contiguous blocks, one per process, fitted chunk after chunk
+    pending = [(i, item) for i, item in enumerate(spectra) if i not in done]
+    n_blocks = min(max_workers or multiprocessing.cpu_count(), len(pending))
+    blocks = []
+    for block in np.array_split(np.arange(len(pending)), max(n_blocks, 1)):
+        if len(block):
+            items = [pending[i] for i in block]
+            blocks.append([items[j:j + chunksize] for j in range(0, len(items), chunksize)])
+
+    def write(rows):
+        with open(filename, 'a') as f:
+            writer = csv.writer(f)
+            for r in rows:
+                writer.writerow([r['index'], r['name']] + r['x'] +
+                                [r['residual'], r['nfev'], r['success'],
+                                 '{0:.3f}'.format(r['fit_time']), r['warm_start']])
+
+    n_fitted = 0
+    running = {}
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=get_fork_context()) as pool:
+
+        def submit(b, x_start, warm_start):
+            future = pool.submit(_fit_chunk, fit, load, blocks[b].pop(0), x_start, warm_start)
+            running[future] = (b, x_start, warm_start)
+
+        for b in range(len(blocks)):
+            submit(b, *start(blocks[b][0][0][0]))
+        while running:
+            completed, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in completed:
+                b, x_start, warm_start = running.pop(future)
+                rows = future.result()
+                write(rows)
+                n_fitted += len(rows)
+                successful = [r['x'] for r in rows if r['success']]
+                if successful:
+                    x_start, warm_start = np.array(successful[-1]), True
+                if blocks[b]:
+                    submit(b, x_start, warm_start)
+            if verbose:
+                print('fit_series: {0} spectra fitted ({1:.1f}s)'.format(n_fitted, time() - t0),
+                      flush=True)
+
+    return pd.read_csv(filename).sort_values('index').reset_index(drop=True)
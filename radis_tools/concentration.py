@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+"""
+Sweeps over the mole fraction of the absorbing molecule, for radiative forcing
+curves.
+
+Rescaling a precomputed spectrum with
+:py:meth:`~radis.spectrum.spectrum.Spectrum.rescale_mole_fraction` neglects
+the change of self-broadening, while recomputing every layer for every mole
+fraction is expensive. :class:`~radis_tools.concentration.ConcentrationSweep`
+calculates the layers line-by-line only at both ends of the sweep, with the
+steps of :py:meth:`~radis.lbl.factory.SpectrumFactory.eq_spectrum` (see
+:func:`~radis_tools.layers.calc_abscoeff`). In between, the absorption
+cross-section is linearly interpolated in mole fraction, since collisional
+widths are linear in mole fraction. The Planck function of each layer is
+also cached.
+The upward irradiance is integrated over zenith angles as
+:func:`~radis_tools.los.calc_irradiance` (``n_angles=0``: ``pi * radiance``
+along the vertical).
+
+"""
+
+from __future__ import print_function, absolute_import, division
+
+from time import time
+from warnings import warn
+import numpy as np
+import pandas as pd
+from radis.phys.blackbody import planck
+from radis.phys.convert import cm2nm
+from .layers import (broadcast_layers, calc_abscoeff, factory_conditions,
+                     make_layer_spectra)
+from .los import get_on_grid, angle_quadrature
+
+
+def integrate_irradiance(w, irradiance, wavelength_min=None, wavelength_max=None):
+    ''' Integrate a spectral irradiance over wavelength
+
+    Parameters
+    ----------
+
+    w: array
+        wavenumber (cm-1)
+
+    irradiance: array
+        spectral irradiance (mW/cm2/nm)
+
+    wavelength_min, wavelength_max: float, or ``None``
+        integration range (nm, vacuum). If ``None``, use the full range.
+
+    Returns
+    -------
+
+    P: float
+        irradiance (W/m2)
+
+    '''
+    wl = cm2nm(np.asarray(w))
+    I = irradiance * 10    # mW/cm2/nm -> W/m2/nm
+    b = np.ones(len(wl), dtype=bool)
+    if wavelength_min is not None:
+        b &= wl >= wavelength_min
+    if wavelength_max is not None:
+        b &= wl <= wavelength_max
+    wl, I = wl[b], I[b]
+    return abs(np.sum((I[1:] + I[:-1]) / 2 * np.diff(wl)))
+
+
+class ConcentrationSweep(object):
+    ''' Upward radiation of an atmosphere for many mole fractions
+
+    Parameters
+    ----------
+
+    sf: :class:`~radis.lbl.factory.SpectrumFactory`
+        with a line database already loaded
+
+    Tgas, pressure, path_length: arrays
+        conditions of each layer (K, bar, cm), from the ground up
+
+    mole_fraction_range: (float, float)
+        smallest and largest mole fractions of the sweep. The layers are
+        calculated line-by-line at these two mole fractions only.
+
+    source: :class:`~radis.spectrum.spectrum.Spectrum`, or ``None``
+        ground emission, e.g. :py:func:`~radis.phys.blackbody.sPlanck`
+
+    Other Parameters
+    ----------------
+
+    n_angles: int
+        number of zenith angles of the irradiance, see
+        :func:`~radis_tools.los.angle_quadrature`. If 0, ``pi * radiance``
+        along the vertical. Default 4.
+
+    error_estimate: bool
+        if ``True``, also calculate the layers at the middle of the range, and
+        store the error of the linear interpolation in ``self.error``. Default ``True``.
+
+    Examples
+    --------
+
+    ::
+
+        sweep = ConcentrationSweep(sf, atm.T_K, atm.P_Pa*1e-5, atm.path_length*1e5,
+                                   mole_fraction_range=(200e-6, 1000e-6),
+                                   source=s_earth_0)
+        df = sweep.run(np.linspace(200e-6, 1000e-6, 41), x_ref=278e-6,
+                       wavelength_min=11100, wavelength_max=20000)
+        df.plot('mole_fraction', 'forcing')
+
+    Attributes
+    ----------
+
+    error: array
+        for each layer, maximum error of the interpolated absorption coefficient,
+        relative to its maximum. ``None`` if ``error_estimate=False``.
+
+    '''
+
+    def __init__(self, sf, Tgas, pressure, path_length, mole_fraction_range,
+                 source=None, n_angles=4, error_estimate=True, verbose=True):
+
+        t0 = time()
+        self.mu, self.mu_weights = angle_quadrature(n_angles)
+
+        Tgas, pressure, path_length = broadcast_layers(Tgas, pressure, path_length)
+        self.Tgas, self.pressure, self.path_length = Tgas, pressure, path_length
+
+        self.x_min, self.x_max = x_min, x_max = min(mole_fraction_range), max(mole_fraction_range)
+        anchors = [x_min, x_max] if x_max > x_min else [x_min]
+        if error_estimate and len(anchors) == 2:
+            anchors.append((x_min + x_max) / 2)
+
+        # Absorption cross-sections per unit mole fraction (cm-1), at each anchor
+        sigma = []
+        for n, x in enumerate(anchors):
+            if verbose:
+                print('Calculating {0} layers at mole fraction {1:.3g} ({2}/{3})'.format(
+                      len(Tgas), x, n + 1, len(anchors)))
+            w, abscoeff, _ = calc_abscoeff(sf, Tgas, pressure, x, verbose=verbose)
+            sigma.append(abscoeff / x)
+        self.w = w
+        self.conditions = factory_conditions(sf)
+        self.sigma = sigma[0]                           # at x_min
+        self.dsigma = (np.zeros_like(sigma[0]) if len(anchors) == 1 else
+                       (sigma[1] - sigma[0]) / (x_max - x_min))    # d(sigma)/dx
+        self.error = None
+        if len(anchors) == 3:
+            self.error = (np.abs(sigma[2] - (sigma[0] + sigma[1]) / 2).max(axis=1)
+                          / sigma[2].max(axis=1))
+
+        self.planck = np.array([planck(cm2nm(w), T, unit='mW/sr/cm2/nm') for T in Tgas])
+        self.source = (np.zeros(len(w)) if source is None else
+                       get_on_grid(source, 'radiance_noslit', w, Iunit='mW/cm2/sr/nm'))
+
+        self.conditions['calculation_time'] = time() - t0
+
+    def abscoeff(self, mole_fraction):
+        ''' Absorption coefficient of all layers (cm-1), shape ``(layer, len(w))`` '''
+
+        x = mole_fraction
+        if not (self.x_min <= x <= self.x_max):
+            warn('Mole fraction {0} is outside the precomputed range [{1}, {2}]: '.format(
+                 x, self.x_min, self.x_max) + 'collisional broadening is extrapolated')
+        return x * (self.sigma + (x - self.x_min) * self.dsigma)
+
+    def layers(self, mole_fraction):
+        ''' Return the Spectrum of each layer at ``mole_fraction``
+
+        More accurate than :py:meth:`~radis.spectrum.spectrum.Spectrum.rescale_mole_fraction`,
+        as self-broadening is updated. Against ``eq_spectrum`` at 700 ppm, on
+        ``HITEMP-CO2-TEST`` and the layers of the 1976 Standard Atmosphere: 1e-7 of
+        the maximum absorption coefficient with a (200, 1200) ppm sweep, vs 1e-4 for
+        a 400 ppm spectrum rescaled to 700 ppm (0.6% vs 7.6% at 30% with a
+        (1%, 50%) sweep, rescaled from 10%).
+        '''
+        return make_layer_spectra(self.w, self.abscoeff(mole_fraction),
+                                  self.Tgas, self.pressure, self.path_length,
+                                  np.full(len(self.Tgas), mole_fraction),
+                                  conditions=self.conditions)
+
+    def upward_radiance(self, mole_fraction, mu=1):
+        ''' Radiance (mW/cm2/sr/nm) at the top of the atmosphere, from the source
+        through all layers, at the zenith-angle cosines ``mu`` (float, or array:
+        then shape ``(len(mu), len(w))``) '''
+
+        mu = np.asarray(mu, dtype=np.float64)[..., None]
+        radiance = np.zeros(mu.shape[:-1] + (len(self.w),))
+        radiance += self.source
+        abscoeff = self.abscoeff(mole_fraction)
+        for i in range(len(self.Tgas)):
+            transmittance = np.exp(-abscoeff[i] * self.path_length[i] / mu)
+            radiance *= transmittance
+            radiance += self.planck[i] * (1 - transmittance)
+        return radiance
+
+    def upward_irradiance(self, mole_fraction):
+        ''' Hemispheric irradiance (mW/cm2/nm) at the top of the atmosphere '''
+        return self.mu_weights @ self.upward_radiance(mole_fraction, self.mu)
+
+    def run(self, mole_fractions, x_ref=None, wavelength_min=None, wavelength_max=None):
+        ''' Upward irradiance and radiative forcing for all ``mole_fractions``
+
+        Parameters
+        ----------
+
+        mole_fractions: array
+            mole fractions of the sweep
+
+        x_ref: float, or ``None``
+            reference mole fraction for the radiative forcing (e.g. 278e-6, the
+            1750 reference). If ``None``, use the first mole fraction.
+
+        wavelength_min, wavelength_max: float, or ``None``
+            integration range (nm)
+
+        Returns
+        -------
+
+        df: pandas DataFrame
+            columns ``mole_fraction``, ``irradiance`` (W/m2) and ``forcing`` (W/m2),
+            the decrease of upward irradiance compared to ``x_ref``
+
+        '''
+        if x_ref is None:
+            x_ref = mole_fractions[0]
+
+        def irradiance(x):
+            return integrate_irradiance(self.w, self.upward_irradiance(x),
+                                        wavelength_min, wavelength_max)
+
+        P_ref = irradiance(x_ref)
+        P = np.array([irradiance(x) for x in mole_fractions])
+
+        return pd.DataFrame({'mole_fraction': mole_fractions,
+                             'irradiance': P,
+                             'forcing': P_ref - P})
@@ -0,0 +1,374 @@
+# -*- coding: utf-8 -*-
+"""
+Spectral emulator: a model tabulated once on a grid of its parameters, then
+interpolated.
+
+When thousands of spectra are fitted against the same setup (e.g. the
+time-resolved spectra of a discharge, fitted with the Treanor ``T12``, ``T3``,
+``Trot`` model of the Klarenaar example), the fitted quantity can be
+precomputed on a regular grid of the fit parameters. A
+:class:`~radis_tools.emulator.SpectralEmulator` then returns spectra
+interpolated (multilinearly) in this grid, in a fraction of the time of a
+single spectrum calculation.
+
+The interpolation error is estimated against the model at the center of every
+grid cell, where linear interpolation is the least accurate. Cells where the
+error exceeds a tolerance can be refined adaptively: midpoints are inserted in
+the grid, along all parameters, for the intervals of these cells. Every
+interpolated spectrum carries the error estimate of its cell.
+
+Emulators are stored in a compressed ``.npz`` file, with the setup of the model
+(e.g. :func:`~radis_tools.xsec.factory_key` of the SpectrumFactory): a file
+calculated with a different setup is not used.
+
+"""
+
+from __future__ import print_function, absolute_import, division
+
+import itertools
+import json
+from concurrent.futures import ProcessPoolExecutor
+from os.path import exists
+from time import time
+import numpy as np
+from radis import Spectrum
+from radis.misc.progress_bar import ProgressBar
+from .fitting import get_fork_context
+
+
+def _evaluate(model, variable, inputs):
+    s = model(inputs)
+    w, I = s.get(variable, wunit='cm-1', copy=True)
+    return w, I, s.units[variable]
+
+
+class SpectralEmulator(object):
+    ''' A spectral quantity tabulated on a regular grid of model parameters,
+    and interpolated multilinearly
+
+    Use :meth:`~radis_tools.emulator.SpectralEmulator.build` to tabulate a
+    model, :meth:`~radis_tools.emulator.SpectralEmulator.open` to open an
+    existing emulator, or :meth:`~radis_tools.emulator.SpectralEmulator.load_or_build`.
+
+    An emulator is called like the model it replaces: ``emulator(inputs)``
+    returns a Spectrum.
+
+    Parameters
+    ----------
+
+    grid: dict
+        ``{parameter: values}``, sorted values of each parameter
+
+    w: array
+        wavenumbers (cm-1) of the spectral quantity
+
+    I: array, shape ``(len(values_1), ..., len(values_n), len(w))``
+        spectral quantity at every grid point
+
+    variable: str
+        tabulated quantity, e.g. ``'transmittance_noslit'``
+
+    unit: str
+        unit of ``variable``
+
+    Other Parameters
+    ----------------
+
+    cell_error: array, shape ``(len(values_1)-1, ..., len(values_n)-1)``, or ``None``
+        maximum absolute error of the interpolation at the center of each cell
+
+    inputs: dict
+        fixed inputs of the model, added to the interpolated parameters in the
+        conditions of the spectra
+
+    config: dict, or ``None``
+        setup of the model
+
+    filename: str, or ``None``
+
+    Examples
+    --------
+
+    ::
+
+        emulator = SpectralEmulator.load_or_build('out/emulator.npz', theoretical_model,
+                                                  {'T12': np.linspace(300, 2000, 18),
+                                                   'T3': np.linspace(300, 5000, 24),
+                                                   'Trot': np.linspace(300, 2000, 18)},
+                                                  'transmittance_noslit',
+                                                  config=factory_key(sf), tol=1e-3)
+        s = emulator({'T12': 517, 'T3': 2641, 'Trot': 491})
+        print(s.conditions['emulator_error'])
+
+    See Also
+    --------
+
+    :class:`~radis_tools.xsec.CrossSectionTable`
+
+    '''
+
+    def __init__(self, grid, w, I, variable, unit, cell_error=None, inputs={},
+                 config=None, filename=None):
+
+        self.params = list(grid.keys())
+        self.grid = [np.asarray(grid[k], dtype=np.float64) for k in self.params]
+        self.w = w
+        self.I = I
+        self.variable = variable
+        self.unit = unit
+        self.cell_error = cell_error
+        self.inputs = dict(inputs)
+        self.config = json.dumps(config or {}, sort_keys=True, default=str)
+        self.filename = filename
+        self.metadata = {}
+
+    @property
+    def error(self):
+        ''' Maximum estimated interpolation error (absolute, in the unit of the
+        quantity) over all cells, or ``None`` if not validated '''
+        if self.cell_error is None:
+            return None
+        return float(self.cell_error.max())
+
+    @property
+    def shape(self):
+        return tuple(len(g) for g in self.grid)
+
+    # %% Building
+
+    @classmethod
+    def build(cls, filename, model, grid, variable, inputs={}, config=None, tol=None,
+              max_refine=3, max_workers=1, verbose=True):
+        ''' Tabulate ``model`` on ``grid``, estimate the interpolation error,
+        refine the grid where it exceeds ``tol``, and store the emulator
+
+        Parameters
+        ----------
+
+        filename: str, or ``None``
+            ``.npz`` file. If ``None``, the emulator is not stored.
+
+        model: function
+            ``model(inputs) -> Spectrum``, e.g. ``theoretical_model``. Spectra must
+            all be on the same spectral grid.
+
+        grid: dict
+            ``{parameter: values}``: initial grid of each interpolated parameter
+
+        variable: str
+            tabulated quantity, e.g. ``'transmittance_noslit'``
+
+        Other Parameters
+        ----------------
+
+        inputs: dict
+            fixed inputs of the model
+
+        config: dict, or ``None``
+            setup of the model, e.g. :func:`~radis_tools.xsec.factory_key` of the
+            SpectrumFactory. Stored with the emulator.
+
+        tol: float, or ``None``
+            if not ``None``, refine the grid until the interpolation error
+            (absolute, in the unit of the quantity) is below ``tol`` in every cell,
+            or ``max_refine`` refinements were done. If ``None``, the error is
+            estimated but the grid is not refined.
+
+        max_refine: int
+            maximum number of refinements. Each of them can double the number of
+            grid points along every parameter.
+
+        max_workers: int, or ``None``
+            number of processes evaluating the model. Default 1 (no process pool).
+            If ``None``, use all processors. Processes are forked from the main
+            process, and share its loaded line database.
+
+        '''
+
+        t0 = time()
+        params = list(grid.keys())
+        axes = [np.unique(np.asarray(grid[k], dtype=np.float64)) for k in params]
+        evaluations = {}     # point -> spectral quantity, reused after refinement
+        spectral = {}        # wavenumbers and unit of the model
+
+        def evaluate(points):
+            ''' Evaluate the model at all new points '''
+            points = [p for p in points if p not in evaluations]
+            if not points:
+                return
+            jobs = [dict(inputs, **dict(zip(params, p))) for p in points]
+            if verbose:
+                print('Evaluating the model at {0} points'.format(len(points)))
+            if max_workers == 1:
+                if verbose:
+                    pb = ProgressBar(len(jobs))
+                results = []
+                for i, job in enumerate(jobs):
+                    if verbose:
+                        pb.update(i)
+                    results.append(_evaluate(model, variable, job))
+                if verbose:
+                    pb.done()
+            else:
+                with ProcessPoolExecutor(max_workers=max_workers,
+                                         mp_context=get_fork_context()) as pool:
+                    results = list(pool.map(_evaluate, [model] * len(jobs),
+                                            [variable] * len(jobs), jobs))
+            for p, (w, I, unit) in zip(points, results):
+                if not spectral:
+                    spectral.update(w=w, unit=unit)
+                elif len(w) != len(spectral['w']) or not np.allclose(w, spectral['w']):
+                    raise ValueError('Spectral grid of the model changed at {0}. '.format(
+                                     dict(zip(params, p))) +
+                                     'Evaluate the model on a fixed grid (e.g. the '+
+                                     'experimental one)')
+                evaluations[p] = I
+
+        for n_refine in itertools.count():
+            # Tabulate the grid
+            evaluate(list(itertools.product(*axes)))
+            I = np.array([evaluations[p] for p in itertools.product(*axes)])
+            emulator = cls(dict(zip(params, axes)),
+                           spectral['w'], I.reshape(tuple(len(a) for a in axes) + (-1,)),
+                           variable, spectral['unit'], inputs=inputs, config=config,
+                           filename=filename)
+
+            # Estimate the error at the cell centers
+            centers = [(a[1:] + a[:-1]) / 2 for a in axes]
+            evaluate(list(itertools.product(*centers)))
+            cell_error = np.array([np.abs(emulator.interpolate(p) - evaluations[p]).max()
+                                   for p in itertools.product(*centers)])
+            emulator.cell_error = cell_error.reshape(tuple(len(c) for c in centers))
+            if verbose:
+                print('Emulator {0}: max. interpolation error {1:.2e} {2}'.format(
+                      'x'.join(str(len(a)) for a in axes), emulator.error, spectral['unit']))
+
+            if tol is None or emulator.error <= tol or n_refine >= max_refine:
+                break
+
+            # Refine: insert the midpoints of the intervals of all cells above tolerance
+            bad = emulator.cell_error > tol
+            for k, a in enumerate(axes):
+                other = tuple(i for i in range(len(axes)) if i != k)
+                split = bad.any(axis=other) if other else bad
+                axes[k] = np.sort(np.hstack((a, centers[k][split])))
+
+        emulator.metadata = {'initial_grid': {k: np.unique(grid[k]).tolist() for k in params},
+                             'evaluations': len(evaluations),
+                             'refinements': n_refine,
+                             'tol': tol,
+                             'calculation_time': time() - t0,
+                             }
+        if filename is not None:
+            emulator.save()
+        return emulator
+
+    @classmethod
+    def open(cls, filename):
+        ''' Open an existing emulator '''
+        with np.load(filename) as data:
+            metadata = json.loads(str(data['metadata']))
+            grid = {k: data['grid_{0}'.format(k)] for k in metadata['params']}
+            emulator = cls(grid, data['w'], data['I'], metadata['variable'],
+                           metadata['unit'], cell_error=data['cell_error'],
+                           inputs=metadata['inputs'], filename=filename)
+        emulator.config = metadata['config']
+        emulator.metadata = metadata['build']
+        return emulator
+
+    @classmethod
+    def load_or_build(cls, filename, model, grid, variable, inputs={}, config=None,
+                      **kwargs):
+        ''' Open the emulator ``filename`` if it exists and was built from the
+        same initial grid and setup, else build it. See
+        :meth:`~radis_tools.emulator.SpectralEmulator.build` '''
+        if exists(filename):
+            emulator = cls.open(filename)
+            initial_grid = {k: np.unique(grid[k]).tolist() for k in grid}
+            if (emulator.config == json.dumps(config or {}, sort_keys=True, default=str) and
+                    emulator.variable == variable and
+                    emulator.inputs == dict(inputs) and
+                    emulator.metadata['initial_grid'] == initial_grid and
+                    (kwargs.get('tol') is None or
+                     emulator.metadata['tol'] == kwargs['tol'])):
+                return emulator
+            print('SpectralEmulator: {0} was built with a different setup. Rebuilding'.format(
+                  filename))
+        return cls.build(filename, model, grid, variable, inputs=inputs, config=config,
+                         **kwargs)
+
+    def save(self, filename=None):
+        ''' Write the emulator to ``filename`` (compressed ``.npz``) '''
+        filename = filename or self.filename
+        metadata = {'params': self.params,
+                    'variable': self.variable,
+                    'unit': self.unit,
+                    'inputs': self.inputs,
+                    'config': self.config,
+                    'build': self.metadata,
+                    }
+        arrays = {'grid_{0}'.format(k): g for k, g in zip(self.params, self.grid)}
+        np.savez_compressed(filename, metadata=json.dumps(metadata, default=str),
+                            w=self.w, I=self.I, cell_error=self.cell_error, **arrays)
+
+    # %% Interpolation
+
+    def locate(self, point):
+        ''' Cell of ``point`` and its position in the cell
+
+        Returns
+        -------
+
+        index, t: tuples
+            lower grid index along each parameter, and normalized position in
+            ``[0, 1]`` in the interval
+        '''
+        index = []
+        t = []
+        for k, g, x in zip(self.params, self.grid, point):
+            if not g[0] <= x <= g[-1]:
+                raise ValueError('{0}={1} outside of the emulator grid [{2}, {3}]'.format(
+                                 k, x, g[0], g[-1]))
+            i = int(np.clip(np.searchsorted(g, x) - 1, 0, len(g) - 2))
+            index.append(i)
+            t.append((x - g[i]) / (g[i + 1] - g[i]))
+        return tuple(index), tuple(t)
+
+    def interpolate(self, point):
+        ''' Spectral quantity interpolated multilinearly at ``point`` (values of
+        the parameters, in the order of ``self.params``) '''
+        index, t = self.locate(point)
+        I = np.zeros(self.I.shape[-1])
+        for corner in itertools.product((0, 1), repeat=len(index)):
+            weight = np.prod([ti if c else 1 - ti for c, ti in zip(corner, t)])
+            if weight:
+                I += weight * self.I[tuple(i + c for i, c in zip(index, corner))]
+        return I
+
+    def error_at(self, point):
+        ''' Estimated interpolation error in the cell of ``point`` '''
+        if self.cell_error is None:
+            return None
+        index, _ = self.locate(point)
+        return float(self.cell_error[index])
+
+    def __call__(self, inputs, name=None):
+        ''' Return the interpolated Spectrum at ``inputs`` (dict), with the
+        estimated error of its cell in ``conditions['emulator_error']`` '''
+
+        point = [inputs[k] for k in self.params]
+        conditions = dict(self.inputs, **inputs)
+        conditions['emulator_error'] = self.error_at(point)
+        return Spectrum({self.variable: (self.w.copy(), self.interpolate(point))},
+                        {self.variable: self.unit}, conditions=conditions,
+                        cond_units={'emulator_error': self.unit},
+                        waveunit='cm-1', name=name)
+
+    def info(self):
+        ''' Grid size and error estimate '''
+        ranges = ', '.join('{0}=[{1:g}, {2:g}]'.format(k, g[0], g[-1])
+                           for k, g in zip(self.params, self.grid))
+        error = 'not validated' if self.error is None else '{0:.2e} {1}'.format(self.error,
+                                                                               self.unit)
+        return 'SpectralEmulator: {0} grid ({1}), max. error {2}'.format(
+               'x'.join(str(n) for n in self.shape), ranges, error)
@@ -0,0 +1,439 @@
+# -*- coding: utf-8 -*-
+"""
+Tools to fit spectra with :py:func:`scipy.optimize.minimize`.
+
+With ``jac=None``, :py:func:`~scipy.optimize.minimize` estimates the gradient
+with finite differences: for ``n`` fitted parameters, every iteration costs
+``n + 1`` sequential spectrum calculations. :class:`~radis_tools.fitting.ParallelJacobian`
+evaluates the finite-difference stencil in a process pool, while the central
+point is calculated in the main process: the wall time of each call is about
+the one of a single spectrum calculation.
+
+:class:`~radis_tools.fitting.ModelCache` memoizes the model: parameters
+revisited by the optimizer (bounds, line search, final evaluation of the best
+fit) are not calculated again.
+
+:func:`~radis_tools.fitting.multistart` runs local fits from Latin-hypercube
+starting points in a process pool, to find the global minimum of models with
+several local minima. It stops as soon as enough starts converged to the same
+best solution.
+
+Worker processes are forked from the main process, so they share the
+SpectrumFactory and its line database already loaded in memory.
+
+"""
+
+from __future__ import print_function, absolute_import, division
+
+import hashlib
+import json
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from os.path import exists
+import numpy as np
+from radis import Spectrum
+
+
+def get_fork_context():
+    ''' Multiprocessing context where workers inherit the memory of the main
+    process (``'fork'``), if available (not on Windows) '''
+    if 'fork' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('fork')
+    return None
+
+
+def _call(fun, x):
+    return fun(x)
+
+
+def _start(args):
+    fun, i, x0 = args
+    return i, x0, fun(x0)
+
+
+def latin_hypercube(bounds, n, seed=0):
+    ''' ``n`` points in ``bounds``, one in each of ``n`` equal intervals of
+    every parameter
+
+    Parameters
+    ----------
+
+    bounds: array, shape ``(n_params, 2)``
+
+    n: int
+
+    Returns
+    -------
+
+    x: array, shape ``(n, n_params)``
+    '''
+    bounds = np.asarray(bounds, dtype=np.float64)
+    rng = np.random.RandomState(seed)
+    u = (np.array([rng.permutation(n) for _ in bounds]).T + rng.rand(n, len(bounds))) / n
+    return bounds[:, 0] + u * (bounds[:, 1] - bounds[:, 0])
+
+
+class ParallelJacobian(object):
+    ''' Cost function and its forward-difference gradient, evaluated in parallel
+
+    To be used with ``minimize(..., jac=True)``.
+
+    Parameters
+    ----------
+
+    fun: function
+        cost function ``fun(x) -> float``, evaluated in the worker processes.
+        Must be defined at the module level.
+
+    eps: float, or array
+        finite-difference step of each parameter, e.g. the ``eps`` option of the
+        ``'TNC'`` method.
+
+    bounds: array, shape ``(n, 2)``, or ``None``
+        if a step would cross the upper bound, it is made backward
+
+    Other Parameters
+    ----------------
+
+    max_workers: int, or ``None``
+        number of processes. ``n`` processes are enough for ``n`` parameters.
+        If ``None``, use all processors.
+
+    fun_main: function, or ``None``
+        cost function evaluated in the main process at the central point, e.g. one
+        that also logs and plots the fit. If ``None``, use ``fun``.
+
+    Examples
+    --------
+
+    ::
+
+        with ParallelJacobian(cost_function, eps=20, bounds=bounds,
+                              fun_main=cost_and_plot_function) as objective:
+            best = minimize(objective, x0, method='TNC', jac=True, bounds=bounds)
+
+    Notes
+    -----
+
+    Worker processes are started at the first call: the SpectrumFactory must be
+    set up by then. On Windows (no ``fork``), ``fun`` and the SpectrumFactory
+    must be defined at the import of the main module.
+
+    '''
+
+    def __init__(self, fun, eps, bounds=None, max_workers=None, fun_main=None):
+
+        self.fun = fun
+        self.fun_main = fun_main if fun_main is not None else fun
+        self.eps = eps
+        self.bounds = None if bounds is None else np.asarray(bounds, dtype=np.float64)
+        self.max_workers = max_workers
+        self.nfev = 0
+        self._pool = None
+        self._last = None
+
+    @property
+    def pool(self):
+        ''' Process pool, started at the first use '''
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.max_workers,
+                                             mp_context=get_fork_context())
+        return self._pool
+
+    def steps(self, x):
+        ''' Finite-difference step of each parameter, backward at the upper bound '''
+        h = np.broadcast_to(np.asarray(self.eps, dtype=np.float64), x.shape).copy()
+        if self.bounds is not None:
+            b = x + h > self.bounds[:, 1]
+            h[b] *= -1
+        return h
+
+    def __call__(self, x):
+
+        x = np.asarray(x, dtype=np.float64)
+        if self._last is not None and np.array_equal(self._last[0], x):
+            return self._last[1], self._last[2]
+
+        h = self.steps(x)
+        stencil = [x + h[i] * np.eye(len(x))[i] for i in range(len(x))]
+        futures = [self.pool.submit(_call, self.fun, xi) for xi in stencil]
+        f = self.fun_main(x)
+        grad = np.array([(fi.result() - f) / h[i] for i, fi in enumerate(futures)])
+        self.nfev += len(x) + 1
+
+        self._last = (x.copy(), f, grad)
+        return f, grad
+
+    def map(self, xs):
+        ''' Evaluate ``fun`` at all points ``xs`` in parallel, e.g. the candidates
+        of a line search or of a grid search
+
+        Returns
+        -------
+
+        f: array
+        '''
+        f = np.array(list(self.pool.map(_call, [self.fun] * len(xs), xs)))
+        self.nfev += len(xs)
+        return f
+
+    def close(self):
+        ''' Stop the worker processes '''
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class ModelCache(object):
+    ''' Least-recently-used cache of model evaluations
+
+    Only the fitted quantity of each Spectrum is stored.
+
+    Parameters
+    ----------
+
+    model: function
+        ``model(inputs) -> Spectrum``, with ``inputs`` a dict of parameters
+        (e.g. ``theoretical_model``)
+
+    variable: str
+        fitted quantity, e.g. ``'transmittance_noslit'``
+
+    Other Parameters
+    ----------------
+
+    maxsize: int
+        maximum number of spectra in the cache. Default 128.
+
+    quantize: float, dict, or ``None``
+        if not ``None``, parameters are rounded to a multiple of ``quantize`` (one
+        value per parameter if dict) before the model is evaluated, so that
+        close parameters share the same cache entry.
+
+    config: dict, or ``None``
+        setup of the model, e.g. :func:`~radis_tools.xsec.factory_key` of the
+        SpectrumFactory. Part of the key of every entry: a cache file saved with
+        a different setup is not loaded.
+
+    filename: str, or ``None``
+        if given, the cache is loaded from ``filename`` (``.npz``) if it exists,
+        and written there by :meth:`~radis_tools.fitting.ModelCache.save`
+
+    Examples
+    --------
+
+    ::
+
+        model = ModelCache(theoretical_model, 'transmittance_noslit', quantize=0.1,
+                           config=factory_key(sf), filename='out/fit_cache.npz')
+        s = model({'T12': 517, 'T3': 2641, 'Trot': 491})
+        ...
+        print(model.info())
+        model.save()
+
+    '''
+
+    def __init__(self, model, variable, maxsize=128, quantize=None, config=None,
+                 filename=None):
+
+        self.model = model
+        self.variable = variable
+        self.maxsize = maxsize
+        self.quantize = quantize
+        self.config = json.dumps(config or {}, sort_keys=True, default=str)
+        self._config_hash = hashlib.md5(self.config.encode()).hexdigest()
+        self.filename = filename
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+        if filename is not None and exists(filename):
+            self.load(filename)
+
+    def round(self, inputs):
+        ''' Parameters rounded to the ``quantize`` resolution '''
+        if self.quantize is None:
+            return dict(inputs)
+        out = {}
+        for k, v in inputs.items():
+            q = self.quantize.get(k) if isinstance(self.quantize, dict) else self.quantize
+            out[k] = v if q is None else float(np.round(v / q) * q)
+        return out
+
+    def key(self, inputs):
+        return (self._config_hash,) + tuple(sorted((k, float(v)) for k, v in inputs.items()))
+
+    def __call__(self, inputs):
+        ''' Return the Spectrum of the model at ``inputs``, with the fitted quantity only '''
+
+        inputs = self.round(inputs)
+        key = self.key(inputs)
+        if key in self._cache:
+            self.hits += 1
+            self._cache.move_to_end(key)
+        else:
+            self.misses += 1
+            s = self.model(inputs)
+            w, I = s.get(self.variable, wunit='cm-1', copy=True)
+            self._cache[key] = (w, I, s.units[self.variable], s.get_name())
+            if len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+        w, I, unit, name = self._cache[key]
+        return Spectrum({self.variable: (w.copy(), I.copy())}, {self.variable: unit},
+                        conditions=dict(inputs), waveunit='cm-1', name=name)
+
+    @property
+    def hit_rate(self):
+        ''' Fraction of calls served from the cache '''
+        calls = self.hits + self.misses
+        return self.hits / calls if calls else 0
+
+    def info(self):
+        ''' Cache statistics '''
+        return 'ModelCache: {0} hits, {1} misses ({2:.0%} hit rate), {3}/{4} spectra'.format(
+               self.hits, self.misses, self.hit_rate, len(self._cache), self.maxsize)
+
+    def clear(self):
+        self._cache.clear()
+        self.hits = self.misses = 0
+
+    def save(self, filename=None):
+        ''' Write the cache to ``filename`` (``.npz``) '''
+        filename = filename or self.filename
+        arrays = {}
+        index = []
+        for n, (key, (w, I, unit, name)) in enumerate(self._cache.items()):
+            arrays['w_{0}'.format(n)] = w
+            arrays['I_{0}'.format(n)] = I
+            index.append({'inputs': dict(key[1:]), 'unit': unit, 'name': name})
+        metadata = {'config': self.config, 'variable': self.variable, 'index': index}
+        np.savez_compressed(filename, metadata=json.dumps(metadata), **arrays)
+
+    def load(self, filename):
+        ''' Add the entries of a cache file, if it was saved with the same setup '''
+        with np.load(filename) as data:
+            metadata = json.loads(str(data['metadata']))
+            if metadata['config'] != self.config or metadata['variable'] != self.variable:
+                print('ModelCache: {0} was saved with a different setup. Not loaded'.format(
+                      filename))
+                return
+            for n, entry in enumerate(metadata['index']):
+                self._cache[self.key(entry['inputs'])] = (data['w_{0}'.format(n)],
+                                                           data['I_{0}'.format(n)],
+                                                           entry['unit'], entry['name'])
+        while len(self._cache) > self.maxsize:
+            self._cache.popitem(last=False)
+
+
+def multistart(fit, bounds, n_starts=8, x0=None, max_workers=None, basin_tol=0.02,
+               n_agree=3, seed=0, verbose=True):
+    ''' Run local fits from Latin-hypercube starting points, in parallel, and
+    return the solutions ranked by residual
+
+    Parameters
+    ----------
+
+    fit: function
+        ``fit(x0) -> OptimizeResult``, a local fit from ``x0``, e.g. a call to
+        :py:func:`scipy.optimize.minimize`. Must be defined at the module level.
+
+    bounds: array, shape ``(n_params, 2)``
+
+    n_starts: int
+        number of starting points
+
+    Other Parameters
+    ----------------
+
+    x0: array, or ``None``
+        if given, an additional starting point (e.g. the center of the bounds),
+        fitted first
+
+    max_workers: int, or ``None``
+        number of processes. If ``None``, use all processors. Processes are
+        forked from the main process, and share its loaded line database.
+
+    basin_tol: float
+        two solutions are in the same basin if all their parameters differ by
+        less than ``basin_tol`` times the width of the bounds
+
+    n_agree: int
+        stop the remaining fits when ``n_agree`` solutions are in the basin of
+        the best solution found so far. If ``None``, run all starts.
+
+    seed: int
+        seed of the Latin-hypercube sampling
+
+    Returns
+    -------
+
+    solutions: list of OptimizeResult
+        sorted by residual ``fun``, with the additional fields ``x0`` (starting
+        point), ``start`` (index of the starting point) and ``basin`` (index of
+        the basin, 0 for the best one)
+
+    Examples
+    --------
+
+    ::
+
+        def local_fit(x0):
+            return minimize(cost_function, x0, method='TNC', bounds=bounds)
+
+        solutions = multistart(local_fit, bounds, n_starts=16)
+        best = solutions[0]
+
+    '''
+
+    bounds = np.asarray(bounds, dtype=np.float64)
+    starts = latin_hypercube(bounds, n_starts, seed=seed)
+    if x0 is not None:
+        starts = np.vstack((x0, starts))
+    width = bounds[:, 1] - bounds[:, 0]
+
+    def rank(solutions):
+        ''' Sort by residual and label the basins '''
+        solutions.sort(key=lambda r: r.fun)
+        centers = []
+        for r in solutions:
+            for b, c in enumerate(centers):
+                if np.all(np.abs(r.x - c) < basin_tol * width):
+                    r.basin = b
+                    break
+            else:
+                r.basin = len(centers)
+                centers.append(r.x)
+        return solutions
+
+    solutions = []
+    context = get_fork_context() or multiprocessing
+    pool = context.Pool(max_workers)
+    try:
+        for i, x_start, r in pool.imap_unordered(_start, [(fit, i, x) for i, x in
+                                                          enumerate(starts)]):
+            r.x0 = x_start
+            r.start = i
+            solutions.append(r)
+            rank(solutions)
+            if verbose:
+                print('multistart: start {0}/{1} converged to {2} (residual {3:.4g}). '.format(
+                      len(solutions), len(starts), np.round(r.x, 1), r.fun) +
+                      'Best so far: {0:.4g}'.format(solutions[0].fun), flush=True)
+            n_best = sum(s.basin == 0 for s in solutions)
+            if n_agree is not None and n_best >= n_agree and len(solutions) < len(starts):
+                if verbose:
+                    print('multistart: {0} starts converged to the best solution. '.format(
+                          n_best) + 'Stopping the {0} others'.format(
+                          len(starts) - len(solutions)))
+                break
+    finally:
+        pool.terminate()
+        pool.join()
+
+    return solutions
@@ -0,0 +1,372 @@
+# -*- coding: utf-8 -*-
+"""
+Batched calculation of equilibrium spectra for a stack of gas layers.
+
+:func:`~radis_tools.layers.calc_layers` replaces calling
+:py:meth:`~radis.lbl.factory.SpectrumFactory.eq_spectrum` once per layer, as
+done in the Standard Atmosphere example (``ex_radiative_forcing_co2``).
+Each layer runs the same RADIS steps as ``eq_spectrum`` (line intensities,
+cutoff, pressure shift, broadening widths, lineshapes, pseudo-continuum), and
+the spectra are the same. What is shared between layers:
+
+- the line table: ``eq_spectrum`` copies the whole line database of the
+  SpectrumFactory (``sf.df0``) before every spectrum; here every layer adds
+  its columns to a shallow copy, and the line database is never copied
+- the wavenumber grid: the absorption coefficients of all layers are
+  returned in a single 2D ``(layer, wavenumber)`` array by
+  :func:`~radis_tools.layers.calc_abscoeff`, also used to build cross-section
+  tables and band models from the line database
+
+Notes
+-----
+
+Lineshapes are still calculated layer by layer: they depend on the temperature
+and pressure of each layer, and are most of the calculation time. On the
+``HITEMP-CO2-TEST`` fragment (4096 lines) and the 87 layers of the 1976
+Standard Atmosphere, :func:`~radis_tools.layers.calc_layers` takes 78%
+(``optimization='min-RMS'``) to 93% (``optimization=None``) of the time of the
+``eq_spectrum`` loop, for identical spectra. The copies saved grow with the
+size of the line database.
+Use :func:`~radis_tools.parallel.calc_layers_parallel` to distribute the layers
+over several processes.
+
+"""
+
+from __future__ import print_function, absolute_import, division
+
+from time import time
+import numpy as np
+from radis import Spectrum, get_version
+from radis.misc.progress_bar import ProgressBar
+from radis.phys.blackbody import planck
+from radis.phys.constants import k_b
+from radis.phys.convert import cm2nm
+from radis.spectrum.equations import calc_radiance
+
+#: conditions of :py:meth:`~radis.lbl.factory.SpectrumFactory.eq_spectrum`
+#: that change from one layer to another
+LAYER_CONDITIONS = ['Tgas', 'Tvib', 'Trot', 'pressure_mbar', 'mole_fraction',
+                    'path_length']
+
+
+def get_wavenumber_grid(sf):
+    ''' Spectral grid (cm-1) of a SpectrumFactory '''
+    return sf.wavenumber
+
+
+def broadcast_layers(Tgas, *conditions):
+    ''' Return ``Tgas`` as a 1D array, and the other layer ``conditions`` broadcast
+    to the same shape (a scalar mole fraction applies to all layers, etc.) '''
+    Tgas = np.atleast_1d(np.asarray(Tgas, dtype=np.float64))
+    return (Tgas,) + tuple(np.broadcast_to(np.asarray(x, dtype=np.float64), Tgas.shape)
+                           for x in conditions)
+
+
+def number_density(Tgas, pressure, mole_fraction):
+    ''' Number density (molecules/cm3) of the absorbing molecule, as in
+    :py:meth:`~radis.lbl.factory.SpectrumFactory.eq_spectrum`
+
+    Parameters
+    ----------
+
+    Tgas: K;  pressure: bar;  mole_fraction: --
+    '''
+    pressure_mbar = np.asarray(pressure) * 1e3
+    return mole_fraction * ((pressure_mbar * 100) / (k_b * np.asarray(Tgas))) * 1e-6
+
+
+#%% Absorption coefficients
+
+def _set_layer(sf, Tgas, pressure, mole_fraction):
+    ''' Set the conditions of a layer in the SpectrumFactory, as
+    :py:meth:`~radis.lbl.factory.SpectrumFactory.eq_spectrum` does '''
+    sf.input.mole_fraction = mole_fraction
+    sf.input.pressure_mbar = pressure * 1e3
+    sf.input.rot_distribution = 'boltzmann'
+    sf.input.vib_distribution = 'boltzmann'
+    sf.input.Tgas = Tgas
+    sf.input.Tvib = Tgas
+    sf.input.Trot = Tgas
+    sf._check_inputs(mole_fraction, Tgas)
+
+
+def _calc_layer_abscoeff(sf, Tgas):
+    ''' Run the steps of :py:meth:`~radis.lbl.factory.SpectrumFactory.eq_spectrum`
+    on the lines of the SpectrumFactory, for the conditions of ``sf.input``
+
+    Returns
+    -------
+
+    wavenumber, abscoeff_v: arrays
+        absorption coefficient divided by the number density (cm2/molecule)
+
+    '''
+    # eq_spectrum starts from a copy of the line database (sf._reinitialize());
+    # the steps below only add columns to it, or select lines: a shallow copy
+    # shares the columns of sf.df0, which are never modified
+    sf.df1 = sf.df0.copy(deep=False)
+    sf._calc_linestrength_eq(Tgas)
+    sf._cutoff_linestrength()
+    sf._calc_lineshift()
+    sf._calc_broadening_HWHM()
+    I_continuum = sf._calculate_pseudo_continuum()
+    wavenumber, abscoeff_v = sf._calc_broadening()
+    abscoeff_v = sf._add_pseudo_continuum(abscoeff_v, I_continuum)
+    return wavenumber, abscoeff_v
+
+
+def calc_abscoeff(sf, Tgas, pressure, mole_fraction, verbose=True):
+    ''' Absorption coefficient of all layers, on the grid of the SpectrumFactory
+
+    Same absorption coefficients as
+    :py:meth:`~radis.lbl.factory.SpectrumFactory.eq_spectrum`, see
+    :py:mod:`radis_tools.layers`. As after ``eq_spectrum``, the conditions of
+    the last layer remain in ``sf.input``.
+
+    Parameters
+    ----------
+
+    sf: :class:`~radis.lbl.factory.SpectrumFactory`
+        with a line database already loaded (``sf.fetch_databank()`` or
+        ``sf.load_databank()``)
+
+    Tgas, pressure, mole_fraction: arrays
+        conditions of each layer (K, bar, --)
+
+    Returns
+    -------
+
+    w: array
+        wavenumber (cm-1)
+
+    abscoeff: 2D array, shape ``(layer, len(w))``
+        absorption coefficient (cm-1)
+
+    layer_conditions: list of dict
+        ``calculation_time``, ``lines_calculated``, ``lines_cutoff`` and
+        ``lines_in_continuum`` of each layer
+
+    '''
+
+    Tgas, pressure, mole_fraction = broadcast_layers(Tgas, pressure, mole_fraction)
+    if not sf.input.self_absorption:
+        raise ValueError('Layers are calculated with self_absorption. Use '+
+                         'non_eq_spectrum(Tgas, Tgas) without self_absorption')
+    sf._check_line_databank()
+
+    w = None
+    abscoeff = None
+    layer_conditions = []
+    if verbose:
+        pb = ProgressBar(len(Tgas))
+    for i in range(len(Tgas)):
+        if verbose:
+            pb.update(i)
+        t0 = time()
+        T = float(Tgas[i])
+        _set_layer(sf, T, float(pressure[i]), float(mole_fraction[i]))
+        wavenumber, abscoeff_v = _calc_layer_abscoeff(sf, T)
+        if abscoeff is None:
+            w = wavenumber
+            abscoeff = np.empty((len(Tgas), len(w)))
+        abscoeff[i] = abscoeff_v
+        layer_conditions.append({'calculation_time': time() - t0,
+                                 'lines_calculated': sf._Nlines_calculated,
+                                 'lines_cutoff': sf._Nlines_cutoff,
+                                 'lines_in_continuum': sf._Nlines_in_continuum,
+                                 })
+    if verbose:
+        pb.done()
+
+    abscoeff *= number_density(Tgas, pressure, mole_fraction)[:, None]   # cm-1
+
+    return w, abscoeff, layer_conditions
+
+
+#%% Spectra
+
+def make_layer_spectrum(w, abscoeff, Tgas, pressure, mole_fraction, path_length,
+                        conditions={}, name=None):
+    ''' Build an equilibrium Spectrum from its absorption coefficient
+
+    Spectral quantities are calculated as in
+    :py:meth:`~radis.lbl.factory.SpectrumFactory.eq_spectrum` (emission with
+    Kirchhoff's law). The emission coefficient is also added, for
+    :class:`~radis_tools.los.MergeLOS`.
+
+    Parameters
+    ----------
+
+    w: array
+        wavenumber (cm-1)
+
+    abscoeff: array
+        absorption coefficient (cm-1)
+
+    Tgas: K;  pressure: bar;  mole_fraction: --;  path_length: cm
+
+    conditions: dict
+        other conditions to store in the Spectrum
+
+    Returns
+    -------
+
+    s: :class:`~radis.spectrum.spectrum.Spectrum`
+        with ``abscoeff``, ``emisscoeff``, ``absorbance``, ``emissivity_noslit``,
+        ``transmittance_noslit`` and ``radiance_noslit``
+
+    '''
+
+    absorbance = abscoeff * path_length
+    transmittance_noslit = np.exp(-absorbance)
+    emissivity_noslit = 1 - transmittance_noslit
+    radiance_noslit = calc_radiance(w, emissivity_noslit, Tgas, unit='mW/cm2/sr/nm')
+
+    quantities = {'abscoeff': (w, abscoeff),
+                  'emisscoeff': (w, abscoeff * planck(cm2nm(w), Tgas, unit='mW/sr/cm2/nm')),
+                  'absorbance': (w, absorbance),
+                  'emissivity_noslit': (w, emissivity_noslit),
+                  'transmittance_noslit': (w, transmittance_noslit),
+                  'radiance_noslit': (w, radiance_noslit),
+                  }
+    units = {'abscoeff': 'cm-1',
+             'emisscoeff': 'mW/cm3/sr/nm',
+             'absorbance': '',
+             'emissivity_noslit': '',
+             'transmittance_noslit': '',
+             'radiance_noslit': 'mW/cm2/sr/nm',
+             }
+
+    cond = {'wavenum_min': w[0], 'wavenum_max': w[-1],
+            'rot_distribution': 'boltzmann',
+            'vib_distribution': 'boltzmann',
+            'thermal_equilibrium': True,
+            'self_absorption': True,
+            }
+    cond.update(conditions)
+    cond.update({'Tgas': Tgas, 'Tvib': Tgas, 'Trot': Tgas,
+                 'pressure_mbar': pressure * 1e3,
+                 'mole_fraction': mole_fraction,
+                 'path_length': path_length})
+    cond_units = {'Tgas': 'K', 'Trot': 'K', 'Tvib': 'K', 'Tref': 'K',
+                  'pressure_mbar': 'mbar', 'path_length': 'cm',
+                  'wavenum_min': 'cm-1', 'wavenum_max': 'cm-1',
+                  'wavenum_min_calc': 'cm-1', 'wavenum_max_calc': 'cm-1',
+                  'wstep': 'cm-1', 'broadening_max_width': 'cm-1',
+                  'cutoff': 'cm-1/(#.cm-2)',
+                  'calculation_time': 's'}
+
+    return Spectrum(quantities, units, conditions=cond, cond_units=cond_units,
+                    waveunit='cm-1', warnings=False, name=name)
+
+
+def make_layer_spectra(w, abscoeff, Tgas, pressure, path_length, mole_fraction,
+                       conditions={}, layer_conditions=None):
+    ''' Build the equilibrium Spectrum of each layer, see
+    :func:`~radis_tools.layers.make_layer_spectrum`
+
+    Parameters
+    ----------
+
+    w: array
+        wavenumber grid shared by all layers (cm-1)
+
+    abscoeff: 2D array, shape ``(layer, len(w))``
+        absorption coefficient of each layer (cm-1)
+
+    Tgas, pressure, path_length, mole_fraction: arrays
+        conditions of each layer (K, bar, cm, --)
+
+    conditions: dict
+        conditions shared by all layers
+
+    layer_conditions: list of dict, or ``None``
+        other conditions of each layer (e.g. ``lines_calculated``)
+
+    Returns
+    -------
+
+    slabs: list of :class:`~radis.spectrum.spectrum.Spectrum`
+
+    '''
+
+    slabs = []
+    for i in range(len(abscoeff)):
+        cond = dict(conditions)
+        if layer_conditions is not None:
+            cond.update(layer_conditions[i])
+        slabs.append(make_layer_spectrum(w, abscoeff[i], Tgas[i], pressure[i],
+                                         mole_fraction[i], path_length[i],
+                                         conditions=cond,
+                                         name='layer {0}'.format(i)))
+    return slabs
+
+
+def factory_conditions(sf):
+    ''' Conditions of a SpectrumFactory shared by all layer spectra '''
+    conditions = {k: v for k, v in sf.get_conditions().items()
+                  if k not in LAYER_CONDITIONS}
+    conditions['radis_version'] = get_version(add_git_number=False)
+    return conditions
+
+
+def calc_layers(sf, Tgas, pressure, path_length, mole_fraction, verbose=True):
+    ''' Calculate the equilibrium spectra of all layers
+
+    Same spectra as::
+
+        [sf.eq_spectrum(Tgas=T, pressure=p, path_length=L, mole_fraction=x)
+         for (T, p, L, x) in zip(Tgas, pressure, path_length, mole_fraction)]
+
+    where the line table and the wavenumber grid are shared between all layers,
+    see :py:mod:`radis_tools.layers`.
+
+    Parameters
+    ----------
+
+    sf: :class:`~radis.lbl.factory.SpectrumFactory`
+        with a line database already loaded (``sf.fetch_databank()`` or
+        ``sf.load_databank()``)
+
+    Tgas: array
+        temperature of each layer (K)
+
+    pressure: array
+        pressure of each layer (bar)
+
+    path_length: array
+        thickness of each layer (cm)
+
+    mole_fraction: float, or array
+        mole fraction of the absorbing molecule
+
+    Returns
+    -------
+
+    slabs: list of :class:`~radis.spectrum.spectrum.Spectrum`
+        one equilibrium spectrum per layer, on the same wavenumber grid
+
+    Examples
+    --------
+
+    ::
+
+        slabs = calc_layers(sf, Tgas=atm.T_K,
+                            pressure=atm.P_Pa*1e-5,          # bar
+                            path_length=atm.path_length*1e5, # cm
+                            mole_fraction=400e-6)
+        s_atm = SerialSlabs(*slabs)
+
+    '''
+
+    Tgas, pressure, path_length, mole_fraction = broadcast_layers(Tgas, pressure,
+                                                                  path_length,
+                                                                  mole_fraction)
+
+    w, abscoeff, layer_conditions = calc_abscoeff(sf, Tgas, pressure, mole_fraction,
+                                                  verbose=verbose)
+
+    return make_layer_spectra(w, abscoeff, Tgas, pressure, path_length, mole_fraction,
+                              conditions=factory_conditions(sf),
+                              layer_conditions=layer_conditions)
+
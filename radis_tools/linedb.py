@@ -0,0 +1,374 @@
+# -*- coding: utf-8 -*-
+"""
+Memory-mapped, columnar cache of line databases.
+
+:py:meth:`~radis.lbl.factory.SpectrumFactory.load_databank` parses every file
+of a databank (or its HDF5 cache) entirely, then crops it to the spectral range
+of the calculation: start-up time and peak memory scale with the size of the
+database (about 10 GB for HITEMP CO2), not with the requested range.
+
+A :class:`~radis_tools.linedb.LineDatabaseCache` stores the lines once as one
+``.npy`` file per column, in partitions of a single database file and a single
+isotope, sorted by wavenumber. A query opens the columns as memory maps,
+finds the requested range with a binary search on the wavenumbers, and returns
+views of the memory maps: only the pages of the lines in the range are ever
+read from disk. If the range lies in a single partition (one file, one
+isotope), no line is copied.
+
+:func:`~radis_tools.linedb.load_databank` loads a databank in a SpectrumFactory
+through the cache: the cache is built at the first use (or when the database
+files change), and the rest of
+:py:meth:`~radis.lbl.factory.SpectrumFactory.load_databank` (partition
+functions, energy levels, database parameters) is unchanged.
+
+"""
+
+from __future__ import print_function, absolute_import, division
+
+import json
+import os
+from os.path import exists, join, dirname, getmtime, getsize, abspath
+from time import time
+import numpy as np
+import pandas as pd
+from radis.io.hitran import hit2df, get_molecule
+from radis.io.cdsd import cdsd2df
+from radis.lbl.loader import (drop_auto_columns_for_dbformat, drop_auto_columns_for_levelsfmt,
+                              drop_all_but_these)
+from radis.misc.cache_files import cache_file_name
+from radis.misc.config import getDatabankEntries
+from radis.misc.utils import get_files_from_regex
+
+#: version of the cache format. Caches of another version are rebuilt
+CACHE_VERSION = 1
+
+
+def _read_file(filename, dbformat, verbose=True):
+    ''' Parse a database file with the RADIS parsers (numeric columns only) '''
+    if dbformat == 'hitran':
+        return hit2df(filename, cache=True, verbose=verbose, drop_non_numeric=True)
+    elif dbformat == 'cdsd-hitemp':
+        return cdsd2df(filename, version='hitemp', cache=True, verbose=verbose,
+                       drop_non_numeric=True)
+    elif dbformat == 'cdsd-4000':
+        return cdsd2df(filename, version='4000', cache=True, verbose=verbose,
+                       drop_non_numeric=True)
+    raise ValueError('Unknown dbformat: {0}'.format(dbformat))
+
+
+def _fingerprint(files):
+    ''' Size and modification time of the database files '''
+    return [[abspath(f), getsize(f), getmtime(f)] for f in files]
+
+
+class LineDatabaseCache(object):
+    ''' Lines of a database stored as memory-mapped columns, partitioned by
+    file and isotope, and sorted by wavenumber
+
+    Use :meth:`~radis_tools.linedb.LineDatabaseCache.build` to create a cache
+    from database files, :meth:`~radis_tools.linedb.LineDatabaseCache.load_or_build`
+    to reuse it while the files are unchanged, and
+    :meth:`~radis_tools.linedb.LineDatabaseCache.query` to read a spectral range.
+
+    Parameters
+    ----------
+
+    folder: str
+        cache folder. The index of the partitions is in ``folder/index.json``
+
+    Examples
+    --------
+
+    ::
+
+        cache = LineDatabaseCache.load_or_build('HITEMP-CO2.linedb', files, 'hitran')
+        df = cache.query(2270, 2400, isotopes=[1])
+
+    '''
+
+    def __init__(self, folder):
+
+        with open(join(folder, 'index.json')) as f:
+            self.index = json.load(f)
+        self.folder = folder
+        self.columns = self.index['columns']
+        self.partitions = self.index['partitions']
+        self._wav = {}
+
+    def __len__(self):
+        return sum(p['lines'] for p in self.partitions)
+
+    @classmethod
+    def build(cls, folder, files, dbformat, verbose=True):
+        ''' Parse the database ``files`` one at a time, and write their lines
+        to the cache ``folder``
+
+        Parameters
+        ----------
+
+        folder: str
+            cache folder, created if needed
+
+        files: list of str
+            database files
+
+        dbformat: ``'hitran'``, ``'cdsd-hitemp'``, ``'cdsd-4000'``
+            format of the files, as in the RADIS configuration file
+
+        '''
+        t0 = time()
+        if not exists(folder):
+            os.makedirs(folder)
+        partitions = []
+        columns = None
+        for i, filename in enumerate(files):
+            if verbose:
+                print('Building line cache: {0}/{1} {2}'.format(i + 1, len(files), filename))
+            df = _read_file(filename, dbformat, verbose=verbose)
+            if columns is None:
+                columns = list(df.columns)
+            for iso in np.unique(df['iso']):
+                lines = df[df['iso'] == iso].sort_values('wav', kind='mergesort')
+                path = 'p{0:03d}_iso{1}'.format(i, int(iso))
+                if not exists(join(folder, path)):
+                    os.makedirs(join(folder, path))
+                for k in columns:
+                    np.save(join(folder, path, k + '.npy'), np.ascontiguousarray(lines[k].values))
+                partitions.append({'path': path,
+                                   'file': abspath(filename),
+                                   'iso': int(iso),
+                                   'lines': len(lines),
+                                   'wav_min': float(lines['wav'].iloc[0]),
+                                   'wav_max': float(lines['wav'].iloc[-1]),
+                                   })
+            del df
+
+        index = {'version': CACHE_VERSION,
+                 'dbformat': dbformat,
+                 'files': _fingerprint(files),
+                 'columns': columns,
+                 'partitions': partitions,
+                 'build_time': time() - t0}
+        with open(join(folder, 'index.json'), 'w') as f:
+            json.dump(index, f, indent=2)
+        return cls(folder)
+
+    @classmethod
+    def load_or_build(cls, folder, files, dbformat, verbose=True):
+        ''' Open the cache ``folder`` if it was built from the same, unchanged
+        database files, else build it. See :meth:`~radis_tools.linedb.LineDatabaseCache.build` '''
+        if exists(join(folder, 'index.json')):
+            cache = cls(folder)
+            if (cache.index.get('version') == CACHE_VERSION and
+                    cache.index['dbformat'] == dbformat and
+                    cache.index['files'] == _fingerprint(files)):
+                return cache
+            if verbose:
+                print('Line cache {0} is outdated. Rebuilding'.format(folder))
+        return cls.build(folder, files, dbformat, verbose=verbose)
+
+    def column(self, partition, name):
+        ''' Memory-mapped column of a partition. Copy-on-write: the cache files
+        are never modified '''
+        return np.load(join(self.folder, partition['path'], name + '.npy'), mmap_mode='c')
+
+    def spans(self, wavenum_min, wavenum_max, isotopes=None):
+        ''' Lines with ``wavenum_min <= wav <= wavenum_max`` (cm-1) in each partition
+
+        Returns
+        -------
+
+        spans: list of (dict, int, int)
+            partition, index of the first line and index after the last line
+            in the range
+        '''
+        spans = []
+        for p in self.partitions:
+            if isotopes is not None and p['iso'] not in isotopes:
+                continue
+            if p['wav_max'] < wavenum_min or p['wav_min'] > wavenum_max:
+                continue
+            if p['path'] not in self._wav:
+                self._wav[p['path']] = self.column(p, 'wav')
+            wav = self._wav[p['path']]
+            i = np.searchsorted(wav, wavenum_min, side='left')
+            j = np.searchsorted(wav, wavenum_max, side='right')
+            if j > i:
+                spans.append((p, int(i), int(j)))
+        return spans
+
+    def read(self, partition, start, stop, columns=None):
+        ''' Lines ``start`` to ``stop`` of a partition, copied in memory. The
+        memory maps are closed: the pages read do not stay mapped.
+
+        Returns
+        -------
+
+        df: pandas DataFrame
+        '''
+        columns = self.columns if columns is None else [k for k in self.columns if k in columns]
+        return pd.DataFrame({k: np.array(self.column(partition, k)[start:stop])
+                             for k in columns}, copy=False)
+
+    def query(self, wavenum_min, wavenum_max, isotopes=None, columns=None):
+        ''' Lines with ``wavenum_min <= wav <= wavenum_max`` (cm-1)
+
+        Parameters
+        ----------
+
+        wavenum_min, wavenum_max: float
+            spectral range (cm-1)
+
+        isotopes: list of int, or ``None``
+            if ``None``, all isotopes
+
+        columns: list of str, or ``None``
+            if ``None``, all columns
+
+        Returns
+        -------
+
+        df: pandas DataFrame
+            if the lines come from a single partition, its columns are views of
+            the memory-mapped cache files (nothing is read before it is used).
+            Lines of several partitions are concatenated and sorted by wavenumber.
+
+        '''
+        columns = self.columns if columns is None else [k for k in self.columns if k in columns]
+        selected = [{k: self.column(p, k)[i:j] for k in columns}
+                    for (p, i, j) in self.spans(wavenum_min, wavenum_max, isotopes)]
+
+        if len(selected) == 0:
+            return pd.DataFrame({k: [] for k in columns})
+        if len(selected) == 1:
+            # ... zero copy: one block per column, on the memory maps
+            return pd.DataFrame(selected[0], copy=False)
+        data = {k: np.concatenate([s[k] for s in selected]) for k in columns}
+        order = np.argsort(data['wav'], kind='mergesort')
+        return pd.DataFrame({k: v[order] for k, v in data.items()}, copy=False)
+
+
+def _default_folder(name, files):
+    return join(dirname(abspath(files[0])), name + '.linedb')
+
+
+def open_databank_cache(name, folder=None, verbose=True):
+    ''' Line cache of a databank of the RADIS configuration file (``~/.radis``),
+    built if needed. See :meth:`~radis_tools.linedb.LineDatabaseCache.load_or_build`
+
+    Use it to build the cache once before it is used by several processes.
+
+    Parameters
+    ----------
+
+    name: str
+        databank name, e.g. ``'HITEMP-CO2'``
+
+    folder: str, or ``None``
+        cache folder. If ``None``, ``name.linedb`` next to the first database file.
+
+    '''
+    entries = getDatabankEntries(name)
+    files = entries['path']
+    if isinstance(files, str):
+        files = get_files_from_regex(files)
+        # ... as RADIS: skip the RADIS cache files matched by a wildcard
+        files = [f for f in files if cache_file_name(f) == f or cache_file_name(f) not in files]
+    files = [f for f in files if f != '']
+    return LineDatabaseCache.load_or_build(folder or _default_folder(name, files), files,
+                                           entries['format'], verbose=verbose)
+
+
+def load_databank(sf, name, folder=None, lines=None, verbose=True, **kwargs):
+    ''' Load a databank in a SpectrumFactory through a
+    :class:`~radis_tools.linedb.LineDatabaseCache`
+
+    Replaces ``sf.load_databank(name, **kwargs)``. Only the lines of the
+    calculation range (including the neighbouring lines within
+    ``broadening_max_width``, as RADIS) and of the requested isotopes are read.
+
+    Parameters
+    ----------
+
+    sf: :class:`~radis.lbl.factory.SpectrumFactory`
+
+    name: str, or ``None``
+        databank name in the RADIS configuration file (``~/.radis``), e.g.
+        ``'HITEMP-CO2'``. May be ``None`` if ``lines`` are given, with the
+        ``path`` and ``format`` of ``load_databank`` in ``kwargs``.
+
+    folder: str, or ``None``
+        cache folder. If ``None``, ``name.linedb`` next to the first database file.
+
+    lines: pandas DataFrame, or ``None``
+        lines to load instead of all the lines of the calculation range, e.g. a
+        chunk read with :meth:`~radis_tools.linedb.LineDatabaseCache.read`, or
+        lines fetched from HITRAN. Columns are dropped as for the lines of the
+        cache. The cache is not opened.
+
+    kwargs: dict
+        forwarded to :py:meth:`~radis.lbl.factory.SpectrumFactory.load_databank`
+
+    Examples
+    --------
+
+    ::
+
+        sf = SpectrumFactory(wavelength_min=4000, wavelength_max=5000, isotope='1')
+        load_databank(sf, 'HITEMP-CO2')
+        s = sf.eq_spectrum(Tgas=4000)
+
+    '''
+
+    def _load_databank(database, dbformat, levelsfmt=None, db_use_cached=True,
+                       db_assumed_sorted=True, buffer='RAM', drop_columns='auto',
+                       include_neighbouring_lines=True):
+        # Same inputs and outputs as SpectrumFactory._load_databank
+        if lines is None:
+            cache = LineDatabaseCache.load_or_build(
+                        folder or _default_folder(name, database),
+                        database, dbformat, verbose=verbose)
+            all_columns = cache.columns
+        else:
+            all_columns = lines.columns
+        if include_neighbouring_lines:
+            wavenum_min, wavenum_max = sf.params.wavenum_min_calc, sf.params.wavenum_max_calc
+        else:
+            wavenum_min, wavenum_max = sf.input.wavenum_min, sf.input.wavenum_max
+        if drop_columns == 'auto':
+            drop_columns = (drop_auto_columns_for_dbformat[dbformat]
+                            + drop_auto_columns_for_levelsfmt[levelsfmt])
+        if drop_columns == 'all':
+            columns = [k for k in all_columns if k in drop_all_but_these]
+        else:
+            columns = [k for k in all_columns if k not in drop_columns]
+        isotopes = None
+        if sf.input.isotope != 'all':
+            isotopes = [int(k) for k in sf.input.isotope.split(',')]
+
+        t0 = time()
+        if lines is None:
+            df = cache.query(wavenum_min, wavenum_max, isotopes=isotopes, columns=columns)
+        else:
+            df = lines[[k for k in lines.columns if k in columns]]
+        if len(df) == 0:
+            raise ValueError('Reference databank has 0 lines in range ' +
+                             '{0:.2f}-{1:.2f}cm-1. Check your range !'.format(
+                              wavenum_min, wavenum_max))
+        if sf.input.molecule in [None, '']:
+            sf.input.molecule = get_molecule(int(df['id'].iloc[0]))
+        if sf.input.isotope == 'all':
+            sf.input.isotope = ','.join(str(int(k)) for k in np.unique(df['iso']))
+        # ... abundance and molar mass, as at the end of SpectrumFactory._load_databank
+        sf._fetch_molecular_parameters(df)
+        if verbose and lines is None:
+            print('Loaded {0} lines of {1} from the line cache ({2:.2f}s)'.format(
+                  len(df), len(cache), time() - t0))
+        return df
+
+    sf._load_databank = _load_databank     # instance attribute: only for this call
+    try:
+        sf.load_databank(name, **kwargs)
+    finally:
+        del sf._load_databank
+    return sf
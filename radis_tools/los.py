@@ -0,0 +1,522 @@
+# -*- coding: utf-8 -*-
+"""
+Line-of-sight solvers that complement :py:func:`~radis.los.slabs.SerialSlabs`.
+
+:class:`~radis_tools.los.LOSAccumulator` adds slabs one by one and keeps the
+radiance and transmittance after each of them, in preallocated arrays. For an
+atmosphere this gives the upward radiance at the top of every layer in a
+single pass, instead of calling ``SerialSlabs(s_earth, *slabs[:k])`` for each
+altitude ``k``, which is quadratic in the number of layers.
+
+:func:`~radis_tools.los.calc_irradiance` calculates the hemispheric
+irradiance of a plane-parallel stack of slabs, with a Gaussian quadrature over
+zenith angles. The absorption coefficients of the slabs are used for all
+angles: only the transfer step depends on the angle.
+
+:class:`~radis_tools.los.SerialLOS` and :class:`~radis_tools.los.MergeLOS`
+describe a line-of-sight as an expression, e.g.
+``SerialLOS(s1, MergeLOS(s2, s3), s1)`` for ``SerialSlabs(s1, s2 // s3, s1)``,
+evaluated at once: the spectral arrays of every distinct slab are read once
+(a slab used twice is not read or copied again), are only interpolated if
+their grid differs from the one of the line-of-sight, and each serial group
+is solved in one vectorized pass over the stacked arrays of its slabs.
+
+"""
+
+from __future__ import print_function, absolute_import, division
+
+import numpy as np
+from radis import Spectrum
+from radis.phys.blackbody import planck
+from radis.phys.convert import cm2nm
+from radis.los.slabs import intersect
+
+
+def get_on_grid(s, var, w, Iunit='default'):
+    ''' Get quantity ``var`` of Spectrum ``s`` on the wavenumber grid ``w``
+
+    The quantity is interpolated only if the grids differ
+
+    Parameters
+    ----------
+
+    s: :class:`~radis.spectrum.spectrum.Spectrum`
+        spectrum
+
+    var: str
+        spectral quantity, e.g. ``'radiance_noslit'``
+
+    w: array
+        wavenumber grid (cm-1), increasing
+
+    Iunit: str
+        unit of the returned quantity
+
+    '''
+    ws, I = s.get(var, wunit='cm-1', Iunit=Iunit, copy=False)
+    if len(ws) == len(w) and np.allclose(ws, w, rtol=0, atol=1e-6 * (w[1] - w[0])):
+        return I
+    if ws[0] > ws[-1]:
+        ws, I = ws[::-1], I[::-1]
+    return np.interp(w, ws, I)
+
+
+def slab_quantities(abscoeff, emisscoeff, path_length):
+    ''' Transmittance and radiance of a homogeneous slab
+
+    Parameters
+    ----------
+
+    abscoeff, emisscoeff: arrays
+        absorption (cm-1) and emission coefficients
+
+    path_length: float
+        slab length (cm)
+
+    Returns
+    -------
+
+    transmittance, radiance: arrays
+        radiance in the unit of ``emisscoeff`` x cm. Optically thin limit where
+        ``abscoeff = 0``
+    '''
+    transmittance = np.exp(-abscoeff * path_length)
+    b = abscoeff == 0
+    radiance = np.empty_like(emisscoeff)
+    radiance[~b] = emisscoeff[~b] / abscoeff[~b] * (1 - transmittance[~b])
+    radiance[b] = emisscoeff[b] * path_length
+    return transmittance, radiance
+
+
+class LOSAccumulator(object):
+    ''' Streaming line-of-sight solver
+
+    Light goes from the ``source`` through the slabs in the order they are
+    added, as in ``SerialSlabs(source, s1, s2, ...)``. After ``k`` slabs::
+
+        I[k] = I[k-1] * T_k + I_k          (radiance)
+        T[k] = T[k-1] * T_k                (transmittance)
+
+    Results after every slab are written in preallocated arrays, so that the
+    radiance at each intermediate position is available in one O(n) pass.
+
+    Parameters
+    ----------
+
+    w: array
+        wavenumber grid (cm-1) of the slabs
+
+    n_slabs: int
+        maximum number of slabs, used to preallocate the arrays
+
+    source: :class:`~radis.spectrum.spectrum.Spectrum`, or ``None``
+        radiance at the start of the line-of-sight (e.g. the ground emission
+        from :py:func:`~radis.phys.blackbody.sPlanck`). If ``None``, start with
+        no radiance.
+
+    transmittance: bool
+        if ``True``, also keep the transmittance after every slab. Default ``True``.
+
+    Examples
+    --------
+
+    Upward radiance at every altitude of an atmosphere::
+
+        los = LOSAccumulator(slabs[0].get_wavenumber(), len(slabs), source=s_earth_0)
+        for s in slabs:
+            los.add(s)
+        los.radiance[10]    # radiance at the top of the 10th layer
+        los.spectrum(10).plot('radiance_noslit')
+
+    Attributes
+    ----------
+
+    radiance: 2D array, shape ``(n_slabs + 1, len(w))``
+        ``radiance[k]`` is the radiance after ``k`` slabs (mW/cm2/sr/nm); ``radiance[0]``
+        is the source
+
+    transmittance: 2D array, shape ``(n_slabs + 1, len(w))``, or ``None``
+        ``transmittance[k]`` is the transmittance of the first ``k`` slabs
+
+    '''
+
+    radiance_unit = 'mW/cm2/sr/nm'
+
+    def __init__(self, w, n_slabs, source=None, transmittance=True):
+
+        self.w = np.asarray(w)
+        self.radiance = np.empty((n_slabs + 1, len(w)))
+        if source is None:
+            self.radiance[0] = 0
+        else:
+            self.radiance[0] = get_on_grid(source, 'radiance_noslit', self.w,
+                                           Iunit=self.radiance_unit)
+        if transmittance:
+            self.transmittance = np.empty((n_slabs + 1, len(w)))
+            self.transmittance[0] = 1
+        else:
+            self.transmittance = None
+        self.n = 0    # number of slabs added
+
+    def add(self, s):
+        ''' Add a slab at the end of the line-of-sight
+
+        Parameters
+        ----------
+
+        s: :class:`~radis.spectrum.spectrum.Spectrum`
+            must have ``radiance_noslit`` and ``transmittance_noslit``
+
+        '''
+        self.add_arrays(get_on_grid(s, 'radiance_noslit', self.w, Iunit=self.radiance_unit),
+                        get_on_grid(s, 'transmittance_noslit', self.w))
+
+    def add_arrays(self, radiance, transmittance):
+        ''' Add a slab from its radiance (mW/cm2/sr/nm) and transmittance arrays,
+        on the grid ``w`` '''
+
+        if self.n + 1 >= len(self.radiance):
+            raise IndexError('LOSAccumulator is full ({0} slabs). Increase n_slabs'.format(
+                             len(self.radiance) - 1))
+        k = self.n + 1
+        np.multiply(self.radiance[k - 1], transmittance, out=self.radiance[k])
+        self.radiance[k] += radiance
+        if self.transmittance is not None:
+            np.multiply(self.transmittance[k - 1], transmittance, out=self.transmittance[k])
+        self.n = k
+
+    def spectrum(self, k=None, name=None):
+        ''' Return the line-of-sight Spectrum after ``k`` slabs
+
+        Parameters
+        ----------
+
+        k: int, or ``None``
+            number of slabs. If ``None``, use all slabs added so far.
+
+        Returns
+        -------
+
+        s: :class:`~radis.spectrum.spectrum.Spectrum`
+            with ``radiance_noslit`` (and ``transmittance_noslit``). Equivalent to
+            ``SerialSlabs(source, *slabs[:k])``
+
+        '''
+        if k is None:
+            k = self.n
+        if k > self.n:
+            raise IndexError('Only {0} slabs were added'.format(self.n))
+        quantities = {'radiance_noslit': (self.w, self.radiance[k].copy())}
+        units = {'radiance_noslit': self.radiance_unit}
+        if self.transmittance is not None:
+            quantities['transmittance_noslit'] = (self.w, self.transmittance[k].copy())
+            units['transmittance_noslit'] = ''
+        return Spectrum(quantities, units, conditions={'slabs': k}, waveunit='cm-1',
+                        name=name)
+
+
+def make_irradiance(s, irradiance=None, name=None):
+    ''' Irradiance of Spectrum ``s``, as a new Spectrum
+
+    RADIS has no irradiance quantity: the irradiance is the ``radiance_noslit``
+    of the new Spectrum, in the units of ``radiance_noslit`` without ``/sr``, so
+    it can be used with :py:meth:`~radis.spectrum.spectrum.Spectrum.get`,
+    :py:meth:`~radis.spectrum.spectrum.Spectrum.get_integral`,
+    :py:meth:`~radis.spectrum.spectrum.Spectrum.plot` or
+    :py:meth:`~radis.spectrum.spectrum.Spectrum.crop`. ``s`` is not modified.
+
+    Parameters
+    ----------
+
+    s: :class:`~radis.spectrum.spectrum.Spectrum`
+        spectrum, with ``radiance_noslit``
+
+    irradiance: array, or ``None``
+        irradiance on the spectral grid of ``s``, in the units of
+        ``radiance_noslit`` times sr. If ``None``, assume an isotropic radiance:
+        ``irradiance = pi * radiance_noslit``
+
+    name: str, or ``None``
+        name of the new Spectrum. If ``None``, that of ``s``
+
+    Returns
+    -------
+
+    s_irradiance: :class:`~radis.spectrum.spectrum.Spectrum`
+        with the irradiance as ``radiance_noslit``, and the conditions of ``s``
+
+    Examples
+    --------
+
+    ::
+
+        s_irradiance = make_irradiance(SerialSlabs(s_earth_0, *slabs))
+        s_irradiance.get_integral('radiance_noslit', wunit='nm', Iunit='W/m2/nm')
+
+    '''
+    w = s.get_wavenumber()
+    if irradiance is None:
+        irradiance = s.get('radiance_noslit')[1] * np.pi
+    return Spectrum.from_array(w, irradiance, 'radiance_noslit', waveunit='cm-1',
+                               unit=s.units['radiance_noslit'].replace('/sr', ''),
+                               conditions=dict(s.conditions), cond_units=dict(s.cond_units),
+                               name=name if name is not None else s.name)
+
+
+def angle_quadrature(n_angles=4):
+    ''' Zenith-angle cosines ``mu`` and weights of the hemispheric irradiance
+    of a radiance ``I(mu)``::
+
+        irradiance = 2 pi integral(I(mu) mu dmu, 0, 1) = sum(weights * I(mu))
+
+    Gauss-Legendre quadrature on ``mu``. If ``n_angles=0``, the vertical
+    approximation ``irradiance = pi * I(1)``: ``mu = [1]``, ``weights = [pi]``
+
+    Returns
+    -------
+
+    mu, weights: arrays
+
+    '''
+    if n_angles == 0:
+        return np.array([1.]), np.array([np.pi])
+    x, weights = np.polynomial.legendre.leggauss(n_angles)
+    mu = (x + 1) / 2
+    return mu, np.pi * weights * mu
+
+
+def calc_irradiance(slabs, source=None, n_angles=4, name=None):
+    ''' Hemispheric irradiance at the end of a plane-parallel line-of-sight
+
+    The radiance is calculated along ``n_angles`` zenith angles at once, by
+    scaling the optical depth of every slab by ``1/mu``, and integrated over the
+    hemisphere with a Gauss-Legendre quadrature::
+
+        irradiance = 2 pi integral(I(mu) mu dmu, 0, 1)
+
+    Parameters
+    ----------
+
+    slabs: list of :class:`~radis.spectrum.spectrum.Spectrum`
+        slabs at equilibrium, from the source to the observer (e.g. from the
+        ground up). Must have ``abscoeff``, and ``Tgas`` and ``path_length`` in
+        their conditions.
+
+    source: :class:`~radis.spectrum.spectrum.Spectrum`, or ``None``
+        isotropic radiance at the start of the line-of-sight (e.g. the ground
+        emission from :py:func:`~radis.phys.blackbody.sPlanck`)
+
+    n_angles: int
+        number of quadrature points, see :func:`~radis_tools.los.angle_quadrature`.
+        Default 4. If 0, ``irradiance = pi * radiance`` along the normal.
+
+    Returns
+    -------
+
+    s_irradiance: :class:`~radis.spectrum.spectrum.Spectrum`
+        with the irradiance as ``radiance_noslit`` (mW/cm2/nm), see
+        :func:`~radis_tools.los.make_irradiance`. The radiance along the normal
+        to the slabs is that of ``SerialSlabs(source, *slabs)``
+
+    Examples
+    --------
+
+    ::
+
+        s_irradiance = calc_irradiance(slabs, source=s_earth_0)
+        s_irradiance.get_integral('radiance_noslit', wunit='nm', Iunit='W/m2/nm')
+
+    '''
+
+    w = slabs[0].get_wavenumber()
+    mu, weights = angle_quadrature(n_angles)
+
+    I = np.zeros((len(mu), len(w)))
+    if source is not None:
+        I[:] = get_on_grid(source, 'radiance_noslit', w, Iunit='mW/cm2/sr/nm')
+    for s in slabs:
+        abscoeff = get_on_grid(s, 'abscoeff', w, Iunit='cm-1')
+        B = planck(cm2nm(w), s.conditions['Tgas'], unit='mW/sr/cm2/nm')
+        optical_depth = abscoeff * s.conditions['path_length']
+        T = np.exp(-optical_depth[None, :] / mu[:, None])
+        I *= T
+        I += B * (1 - T)
+
+    irradiance = weights @ I
+
+    return Spectrum({'radiance_noslit': (w, irradiance)},
+                    {'radiance_noslit': 'mW/cm2/nm'},
+                    conditions={'slabs': len(slabs), 'n_angles': n_angles},
+                    waveunit='cm-1', name=name)
+
+
+#: units of the arrays of a line-of-sight expression
+LOS_UNITS = {'radiance_noslit': 'mW/cm2/sr/nm',
+             'transmittance_noslit': '',
+             'abscoeff': 'cm-1',
+             'emisscoeff': 'mW/cm3/sr/nm'}
+
+
+class LOSExpression(object):
+    ''' A line-of-sight expression of slabs (Spectrum objects) and other
+    expressions. See :class:`~radis_tools.los.SerialLOS` and
+    :class:`~radis_tools.los.MergeLOS` '''
+
+    def __init__(self, *items):
+        self.items = items
+
+    def slabs(self):
+        ''' Distinct slabs of the expression, in order of appearance '''
+        slabs = []
+        for item in self.items:
+            for s in (item.slabs() if isinstance(item, LOSExpression) else [item]):
+                if not any(s is s2 for s2 in slabs):
+                    slabs.append(s)
+        return slabs
+
+    def evaluate(self, name=None):
+        ''' Solve the line-of-sight
+
+        Returns
+        -------
+
+        s: :class:`~radis.spectrum.spectrum.Spectrum`
+            on the wavenumber grid of the first slab, with the quantities of
+            :py:func:`~radis.los.slabs.SerialSlabs` (``radiance_noslit``,
+            ``transmittance_noslit``) or :py:func:`~radis.los.slabs.MergeSlabs`
+            (also ``abscoeff`` and ``emisscoeff``). The names of the slabs that
+            were interpolated on this grid are in the ``interpolated`` attribute
+            of the expression.
+
+        '''
+        slabs = self.slabs()
+        w = slabs[0].get_wavenumber()
+        if w[0] > w[-1]:
+            w = w[::-1]
+        self.interpolated = [s.get_name() for s in slabs if not _same_grid(s, w)]
+        quantities = self._evaluate(w, {})
+
+        conditions = dict(slabs[0].conditions)
+        for s in slabs[1:]:
+            conditions = intersect(conditions, s.conditions)
+        conditions['path_length'] = self._path_length()
+        conditions['waveunit'] = 'cm-1'
+        return Spectrum({k: (w, v) for k, v in quantities.items()},
+                        {k: LOS_UNITS[k] for k in quantities},
+                        conditions=conditions, waveunit='cm-1',
+                        name=name if name is not None else self.get_name())
+
+
+def _item_quantities(item, w, variables, arrays):
+    ''' Spectral arrays of an expression or a slab on the grid ``w``. Arrays of
+    slabs are read once per evaluation, and kept in ``arrays`` '''
+    if isinstance(item, LOSExpression):
+        return item._evaluate(w, arrays)
+    for var in variables:
+        if (id(item), var) not in arrays:
+            arrays[id(item), var] = get_on_grid(item, var, w, Iunit=LOS_UNITS[var])
+    return {var: arrays[id(item), var] for var in variables}
+
+
+def _same_grid(s, w):
+    ws = s.get_wavenumber()
+    return (len(ws) == len(w) and
+            np.allclose(np.sort(ws), w, rtol=0, atol=1e-6 * abs(w[1] - w[0])))
+
+
+def _path_length(item):
+    if isinstance(item, LOSExpression):
+        return item._path_length()
+    return item.conditions['path_length']
+
+
+class SerialLOS(LOSExpression):
+    ''' Slabs along the line-of-sight, as :py:func:`~radis.los.slabs.SerialSlabs`:
+    light goes from the first item to the last one
+
+    Parameters
+    ----------
+
+    items: :class:`~radis.spectrum.spectrum.Spectrum`, or :class:`~radis_tools.los.MergeLOS`
+        slabs, with ``radiance_noslit`` and ``transmittance_noslit``. A slab can
+        appear several times.
+
+    Examples
+    --------
+
+    Same result as ``SerialSlabs(s_freeflow, s_forebody // s_co, s_freeflow)``::
+
+        s = SerialLOS(s_freeflow, MergeLOS(s_forebody, s_co), s_freeflow).evaluate()
+
+    Notes
+    -----
+
+    With the ``n`` items stacked, the radiance is solved in one pass::
+
+        I = sum_i I_i * prod_{j>i} T_j            T = prod_i T_i
+
+    which is the result of the pairwise ``SerialSlabs`` to the floating-point
+    rounding.
+
+    '''
+
+    def _evaluate(self, w, arrays):
+        items = [_item_quantities(item, w, ['radiance_noslit', 'transmittance_noslit'], arrays)
+                 for item in self.items]
+        I = np.array([q['radiance_noslit'] for q in items])
+        T = np.array([q['transmittance_noslit'] for q in items])
+        # transmittance of all items after the i-th one
+        T_after = np.ones_like(T)
+        T_after[:-1] = np.cumprod(T[:0:-1], axis=0)[::-1]
+        return {'radiance_noslit': np.einsum('ij,ij->j', I, T_after),
+                'transmittance_noslit': T_after[0] * T[0]}
+
+    def _path_length(self):
+        return sum(_path_length(item) for item in self.items)
+
+    def get_name(self):
+        names = []
+        for item in self.items:
+            name = item.get_name()
+            names.append('({0})'.format(name) if '//' in name and '>>' not in name
+                         else name)
+        return '>>'.join(names)
+
+
+class MergeLOS(LOSExpression):
+    ''' Slabs at the same position, as :py:func:`~radis.los.slabs.MergeSlabs`
+    (the ``//`` operator): emission and absorption coefficients are added
+
+    Parameters
+    ----------
+
+    items: :class:`~radis.spectrum.spectrum.Spectrum`, or :class:`~radis_tools.los.MergeLOS`
+        slabs of the same length, with ``abscoeff`` and ``emisscoeff``
+
+    '''
+
+    def _evaluate(self, w, arrays):
+        for item in self.items:
+            if isinstance(item, SerialLOS):
+                raise TypeError('Cannot merge a serial line-of-sight: {0}'.format(
+                                item.get_name()))
+        L = self._path_length()
+        items = [_item_quantities(item, w, ['abscoeff', 'emisscoeff'], arrays)
+                 for item in self.items]
+        abscoeff = np.sum([q['abscoeff'] for q in items], axis=0)
+        emisscoeff = np.sum([q['emisscoeff'] for q in items], axis=0)
+        transmittance, radiance = slab_quantities(abscoeff, emisscoeff, L)
+        return {'abscoeff': abscoeff,
+                'emisscoeff': emisscoeff,
+                'transmittance_noslit': transmittance,
+                'radiance_noslit': radiance}
+
+    def _path_length(self):
+        path_lengths = [_path_length(item) for item in self.items]
+        if not all(L == path_lengths[0] for L in path_lengths[1:]):
+            raise ValueError('path_length must be equal for all merged slabs (got {0})'.format(
+                             path_lengths))
+        return path_lengths[0]
+
+    def get_name(self):
+        return '//'.join(item.get_name() for item in self.items)
@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+"""
+Live monitoring of a fit, out of the optimizer loop.
+
+Redrawing figures at every iteration of a fit (``plt.pause``, ``plot_diff``)
+serializes the GUI rendering with the spectrum calculations, and matplotlib
+cannot be driven from another thread. With a :class:`~radis_tools.monitor.FitMonitor`,
+the optimizer only appends one line per iteration (parameters, residual, and
+optionally the fitted spectrum) to a log file. A viewer running in a separate
+Python process follows the file and redraws the figures at most every
+``min_interval`` seconds, whatever the iteration rate.
+
+The log file is kept: :func:`~radis_tools.monitor.replay_fit` plots a finished (or
+running) fit from it, e.g. on another computer. The viewer can also be started
+by hand::
+
+    python -m radis_tools.monitor fit_monitor.jsonl
+
+"""
+
+from __future__ import print_function, absolute_import, division
+
+import json
+import subprocess
+import sys
+from os.path import abspath, dirname, exists
+from time import time, sleep
+import numpy as np
+
+
+class FitMonitor(object):
+    ''' Log the iterations of a fit, and show them live in a separate process
+
+    Parameters
+    ----------
+
+    filename: str
+        log file (one JSON event per line). Overwritten.
+
+    params: list of str
+        names of the fitted parameters
+
+    Other Parameters
+    ----------------
+
+    units: list of str, or ``None``
+        units of the fitted parameters
+
+    w_exp, I_exp: arrays, or ``None``
+        experimental spectrum, plotted under the fitted spectra
+
+    variable: str, or ``None``
+        fitted quantity, used for the axis label
+
+    live: bool
+        if ``True``, start a viewer process that follows the log file. Default ``True``.
+
+    min_interval: float
+        minimum time (s) between two redraws of the viewer
+
+    timeout: float, or ``None``
+        the viewer stops following the log file if no line is written for
+        ``timeout`` seconds, e.g. if the fit process was killed before
+        :meth:`~radis_tools.monitor.FitMonitor.close`. Default 600 s. If ``None``,
+        follow it until the end of the fit.
+
+    Examples
+    --------
+
+    ::
+
+        with FitMonitor('fit_monitor.jsonl', fit_params, fit_units, w_exp, T_exp) as monitor:
+            def cost_function(x):
+                s = model(x)
+                res = get_residual(s, s_exp, fit_variable)
+                monitor.log(x, res, *s.get(fit_variable))
+                return res
+            minimize(cost_function, x0)
+
+    '''
+
+    def __init__(self, filename, params, units=None, w_exp=None, I_exp=None, variable=None,
+                 live=True, min_interval=0.5, timeout=600):
+
+        self.filename = filename
+        self.ite = 0
+        self._t0 = time()
+        self._w = None
+        self._file = open(filename, 'w', buffering=1)      # line-buffered
+        self._write({'event': 'start',
+                     'params': list(params),
+                     'units': list(units) if units is not None else [''] * len(params),
+                     'variable': variable,
+                     'w_exp': None if w_exp is None else np.asarray(w_exp).tolist(),
+                     'I_exp': None if I_exp is None else np.asarray(I_exp).tolist(),
+                     })
+        self.viewer = None
+        if live:
+            # ... a new Python process: matplotlib state is not shared with the fit
+            root = dirname(dirname(abspath(__file__)))
+            args = [abspath(filename), str(min_interval)]
+            if timeout is not None:
+                args.append(str(timeout))
+            self.viewer = subprocess.Popen([sys.executable, '-m', 'radis_tools.monitor'] + args,
+                                           cwd=root)
+
+    def _write(self, event):
+        self._file.write(json.dumps(event) + '\n')
+
+    def log(self, x, res, w=None, I=None):
+        ''' Log one iteration: parameters ``x``, residual ``res``, and optionally
+        the fitted spectrum ``I(w)``. The spectral grid is only written when it
+        changes. '''
+        self.ite += 1
+        event = {'event': 'iteration',
+                 'ite': self.ite,
+                 'time': time() - self._t0,
+                 'x': np.asarray(x, dtype=np.float64).tolist(),
+                 'res': float(res)}
+        if I is not None:
+            if self._w is None or len(w) != len(self._w) or not np.array_equal(w, self._w):
+                self._w = np.array(w)
+                event['w'] = self._w.tolist()
+            event['I'] = np.asarray(I).tolist()
+        self._write(event)
+
+    def close(self, **info):
+        ''' Log the end of the fit (with optional ``info``, e.g. the best
+        parameters) and close the log file. The viewer stays open. '''
+        if self._file.closed:
+            return
+        self._write(dict({'event': 'end', 'time': time() - self._t0}, **info))
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class _FitHistory(object):
+    ''' Fit state rebuilt from the events of a log file, and its figure '''
+
+    def __init__(self):
+        self.params = []
+        self.units = []
+        self.variable = None
+        self.exp = None
+        self.w = None
+        self.I = None
+        self.ite = []
+        self.res = []
+        self.x = []
+        self.finished = False
+        self.fig = None
+
+    def update(self, event):
+        if event['event'] == 'start':
+            self.__init__()
+            self.params = event['params']
+            self.units = event['units']
+            self.variable = event['variable']
+            if event['w_exp'] is not None:
+                self.exp = (np.array(event['w_exp']), np.array(event['I_exp']))
+        elif event['event'] == 'iteration':
+            self.ite.append(event['ite'])
+            self.res.append(event['res'])
+            self.x.append(event['x'])
+            if 'w' in event:
+                self.w = np.array(event['w'])
+            if 'I' in event:
+                self.I = np.array(event['I'])
+        elif event['event'] == 'end':
+            self.finished = True
+
+    def draw(self):
+        import matplotlib.pyplot as plt
+        if self.fig is None:
+            self.fig, (self.axSpec, self.axRes) = plt.subplots(2, 1, num='fit monitor',
+                                                               figsize=(10, 8), clear=True)
+            self.axValues = self.axRes.twinx()
+        axSpec, axRes, axValues = self.axSpec, self.axRes, self.axValues
+        for ax in (axSpec, axRes, axValues):
+            ax.clear()
+        if self.exp is not None:
+            axSpec.plot(*self.exp, 'k', label='experiment')
+        if self.I is not None:
+            axSpec.plot(self.w, self.I, 'r', label='fit')
+        axSpec.set_xlabel('Wavenumber (cm-1)')
+        axSpec.set_ylabel(self.variable or '')
+        if self.x:
+            axSpec.set_title(', '.join('{0}={1:.0f}{2}'.format(k, v, u) for k, v, u in
+                                       zip(self.params, self.x[-1], self.units)))
+            axSpec.legend(loc='lower left')
+            axRes.plot(self.ite, self.res, '-k.', label='residual')
+            axRes.plot(self.ite[-1], self.res[-1], 'or')          # last iteration in red
+            x = np.array(self.x)
+            for i, k in enumerate(self.params):
+                axValues.plot(self.ite, x[:, i], '-', color='C{0}'.format(i), label=k)
+            axValues.legend(loc='upper right')
+        axRes.set_xlabel('Iteration')
+        axRes.set_ylabel('Residual')
+        axRes.set_ylim(ymin=0)
+        self.fig.canvas.draw_idle()
+
+
+def _read_events(filename):
+    with open(filename) as f:
+        for line in f:
+            if line.endswith('\n'):
+                yield json.loads(line)
+
+
+def replay_fit(filename):
+    ''' Plot the fit logged in ``filename`` by a :class:`~radis_tools.monitor.FitMonitor`
+
+    Returns
+    -------
+
+    fig: matplotlib Figure
+        residual and parameters per iteration, and the last fitted spectrum
+    '''
+    history = _FitHistory()
+    for event in _read_events(filename):
+        history.update(event)
+    history.draw()
+    return history.fig
+
+
+def watch(filename, min_interval=0.5, timeout=None):
+    ''' Follow the log file ``filename`` and redraw the fit at most every
+    ``min_interval`` seconds, until the end of the fit, or until no line was
+    written for ``timeout`` seconds (if not ``None``). Run by the viewer
+    process of :class:`~radis_tools.monitor.FitMonitor`. '''
+    import matplotlib.pyplot as plt
+
+    def timed_out(t):
+        return timeout is not None and time() - t > timeout
+
+    t_start = time()
+    while not exists(filename):
+        if timed_out(t_start):
+            print('No fit log {0} after {1}s: stop watching'.format(filename, timeout))
+            return
+        sleep(min_interval)
+    history = _FitHistory()
+    last_draw = 0
+    last_line = time()
+    changed = False
+    buffer = ''
+    with open(filename) as f:
+        while not history.finished:
+            line = f.readline()
+            if line:
+                last_line = time()
+                buffer += line
+                if buffer.endswith('\n'):     # else, a line being written: wait for the end
+                    history.update(json.loads(buffer))
+                    buffer = ''
+                    changed = True
+                if time() - last_draw < min_interval:
+                    continue
+            if changed:
+                history.draw()
+                last_draw = time()
+                changed = False
+            if not line:
+                if timed_out(last_line):
+                    print('No new iteration in {0} for {1}s: stop watching'.format(
+                          filename, timeout))
+                    break
+                if history.fig is not None:
+                    plt.pause(min_interval)     # also keeps the window responsive
+                else:
+                    sleep(min_interval)
+    history.draw()
+    plt.show()
+
+
+if __name__ == '__main__':
+    watch(sys.argv[1], *[float(a) for a in sys.argv[2:]])
@@ -0,0 +1,447 @@
+# -*- coding: utf-8 -*-
+"""
+Fast re-evaluation of nonequilibrium spectra when only temperatures change.
+
+In a fit loop, every call to :py:meth:`~radis.lbl.factory.SpectrumFactory.non_eq_spectrum`
+copies the line database, maps energies and partition functions, and
+allocates new arrays, although only the temperatures change.
+:class:`~radis_tools.noneq.NonEqModel` is built once from a SpectrumFactory:
+everything that does not depend on temperature (line energies and
+degeneracies, reference intensities, Einstein coefficients, collisional widths
+at the fixed pressure and mole fraction, line positions on the spectral grid)
+is extracted as numpy arrays. Each call then only updates the partition
+functions, populations, line intensities, Doppler and temperature-dependent
+collisional widths, and the spectral arrays, in preallocated buffers.
+
+Populations and intensities follow the 3-vibrational-temperature model of
+RADIS (``Tvib=(T1, T2, T3)``, Boltzmann or Treanor vibrational distributions,
+Boltzmann rotational distribution). The model can be evaluated directly on an arbitrary spectral grid (e.g. the
+grid of an experimental spectrum), for the fitted quantities only: lineshapes
+are then calculated at the experimental points, without resampling, and the
+other quantities are not calculated.
+
+Lineshapes are Voigt profiles truncated at
+``broadening_max_width``: use :meth:`~radis_tools.noneq.NonEqModel.compare` to
+check the agreement with RADIS, whose default lineshape database (DLM) is an
+approximation.
+
+References
+----------
+
+.. [Thompson-Cox-Hastings] Thompson, Cox, Hastings 1987, "Rietveld refinement
+    of Debye-Scherrer synchrotron X-ray data from Al2O3", J. Appl. Cryst. 20, 79-83
+
+"""
+
+from __future__ import print_function, absolute_import, division
+
+from time import time
+import numpy as np
+from scipy.special import wofz
+from radis import Spectrum
+from radis.io.hitran import get_molecule
+from .los import get_on_grid
+
+# Physical constants (SI, unless stated otherwise)
+c2 = 1.4387770              #: cm.K    second radiation constant hc/k
+k_b = 1.380649e-23          #: J/K     Boltzmann constant
+c = 2.99792458e8            #: m/s     speed of light
+amu = 1.66053906660e-27     #: kg      atomic mass unit
+h = 6.62607015e-34          #: J.s     Planck constant
+
+#: all quantities of :py:meth:`~radis.lbl.factory.SpectrumFactory.non_eq_spectrum`
+NONEQ_QUANTITIES = ['abscoeff', 'absorbance', 'emisscoeff', 'transmittance_noslit',
+                    'radiance_noslit']
+
+
+def _column(df, name):
+    ''' Column of the line dataframe, or attribute (RADIS stores the values
+    shared by all lines, e.g. the abundance of a single isotope, as attributes) '''
+    if name in df.columns:
+        return df[name].values.astype(np.float64)
+    return np.full(len(df), float(getattr(df, name)))
+
+
+def pseudo_voigt(dw, hwhm_lorentz, hwhm_gauss):
+    ''' Area-normalized pseudo-Voigt profile (cm), [Thompson-Cox-Hastings]_
+
+    Parameters
+    ----------
+
+    dw: array
+        distance to the line center (cm-1)
+
+    hwhm_lorentz, hwhm_gauss: array
+        Lorentzian and Gaussian half-widths (cm-1). Must broadcast with ``dw``.
+
+    '''
+    fG = 2 * hwhm_gauss
+    fL = 2 * hwhm_lorentz
+    f = (fG**5 + 2.69269 * fG**4 * fL + 2.42843 * fG**3 * fL**2
+         + 4.47163 * fG**2 * fL**3 + 0.07842 * fG * fL**4 + fL**5) ** 0.2
+    r = fL / f
+    eta = 1.36603 * r - 0.47719 * r**2 + 0.11116 * r**3
+    hw = f / 2
+    lorentz = hw / (np.pi * (dw**2 + hw**2))
+    gauss = np.sqrt(np.log(2) / np.pi) / hw * np.exp(-np.log(2) * (dw / hw)**2)
+    return eta * lorentz + (1 - eta) * gauss
+
+
+def line_windows(wav, w, broadening_max_width):
+    ''' All (line, spectral point) pairs within ``broadening_max_width/2`` of
+    the line centers
+
+    Parameters
+    ----------
+
+    wav: array
+        line centers (cm-1)
+
+    w: array
+        spectral grid (cm-1), in any order and with any spacing
+
+    Returns
+    -------
+
+    line, index, dw: arrays
+        line of each pair, index of its spectral point in ``w``, and distance to
+        the line center (cm-1)
+
+    '''
+    order = np.argsort(w)
+    w_sorted = w[order]
+    start = np.searchsorted(w_sorted, wav - broadening_max_width / 2, side='left')
+    end = np.searchsorted(w_sorted, wav + broadening_max_width / 2, side='right')
+    counts = end - start
+    line = np.repeat(np.arange(len(wav)), counts)
+    first = np.cumsum(counts) - counts
+    index = order[np.arange(counts.sum()) - np.repeat(first - start, counts)]
+    return line, index, w[index] - wav[line]
+
+
+def voigt(dw, hwhm_lorentz, hwhm_gauss):
+    ''' Area-normalized Voigt profile (cm), from the Faddeeva function
+
+    Parameters
+    ----------
+
+    dw: array
+        distance to the line center (cm-1)
+
+    hwhm_lorentz, hwhm_gauss: array
+        Lorentzian and Gaussian half-widths (cm-1). Must broadcast with ``dw``.
+
+    '''
+    sigma = hwhm_gauss / np.sqrt(2 * np.log(2))
+    z = (dw + 1j * hwhm_lorentz) / (sigma * np.sqrt(2))
+    return wofz(z).real / (sigma * np.sqrt(2 * np.pi))
+
+
+class NonEqModel(object):
+    ''' Nonequilibrium spectrum of a SpectrumFactory, precomputed for fast
+    re-evaluation at new temperatures
+
+    The pressure, mole fraction, path length and spectral range are the ones of
+    the SpectrumFactory (``sf.input``) when the model is built.
+
+    Parameters
+    ----------
+
+    sf: :class:`~radis.lbl.factory.SpectrumFactory`
+        with a line database already loaded. A first spectrum is calculated by
+        RADIS (without linestrength cutoff) to get the line energies and
+        degeneracies.
+
+    vib_distribution: ``'treanor'``, ``'boltzmann'``
+        vibrational distribution
+
+    Other Parameters
+    ----------------
+
+    lineshape: ``'voigt'``, ``'pseudo-voigt'``
+        ``'voigt'`` (exact) or :func:`~radis_tools.noneq.pseudo_voigt` (faster).
+        Default ``'voigt'``.
+
+    wavenumber: array, or ``None``
+        spectral grid (cm-1) of the output spectra, e.g. the grid of an
+        experimental spectrum. If ``None``, use the grid of the SpectrumFactory.
+
+    quantities: list of str, or ``None``
+        quantities to calculate, among ``NONEQ_QUANTITIES``. If ``None``, all of them.
+
+    reference: tuple
+        ``(Tvib, Trot)`` of the first calculation. Any value works.
+
+    Examples
+    --------
+
+    ::
+
+        model = NonEqModel(sf, vib_distribution='treanor')
+        s = model((T12, T12, T3), Trot, Ttrans=Trot)
+        print(model.compare((T12, T12, T3), Trot, Ttrans=Trot))
+
+    Fit model, with the fitted quantity only, on the experimental grid::
+
+        model = NonEqModel(sf, vib_distribution='treanor', wavenumber=w_exp,
+                           quantities=['transmittance_noslit'])
+
+    '''
+
+    def __init__(self, sf, vib_distribution='treanor', lineshape='voigt',
+                 wavenumber=None, quantities=None, reference=((1000, 1000, 1000), 1000)):
+
+        if vib_distribution not in ['treanor', 'boltzmann']:
+            raise ValueError('Unknown vibrational distribution: {0}'.format(vib_distribution))
+        if lineshape not in ['voigt', 'pseudo-voigt']:
+            raise ValueError('Unknown lineshape: {0}'.format(lineshape))
+        if sf.params.pseudo_continuum_threshold:
+            raise ValueError('Pseudo-continuum is not implemented in NonEqModel: set '+
+                             'pseudo_continuum_threshold=0 in the SpectrumFactory')
+
+        if quantities is None:
+            quantities = NONEQ_QUANTITIES
+        unknown = [k for k in quantities if k not in NONEQ_QUANTITIES]
+        if unknown:
+            raise ValueError('Unknown quantities: {0}. Use {1}'.format(unknown, NONEQ_QUANTITIES))
+
+        self.sf = sf
+        self.vib_distribution = vib_distribution
+        self.lineshape = lineshape
+        self.quantities = list(quantities)
+        # emission is not needed for absorption quantities
+        self._emission = any(k in self.quantities for k in ['emisscoeff', 'radiance_noslit'])
+
+        # First calculation by RADIS, without cutoff, to get all lines with their
+        # energies (the cutoff depends on temperatures: it is applied at each call)
+        cutoff = sf.params.cutoff
+        sf.params.cutoff = 0
+        try:
+            s_ref = sf.non_eq_spectrum(*reference, vib_distribution=vib_distribution)
+        finally:
+            sf.params.cutoff = cutoff
+        self.cutoff = cutoff or 0
+        if wavenumber is None:
+            wavenumber = s_ref.get_wavenumber()
+        self.w = np.asarray(wavenumber, dtype=np.float64)
+        self.units = dict(s_ref.units)
+        self.cond_units = dict(s_ref.cond_units)
+        df = sf.df1
+
+        self.pressure_mbar = sf.input.pressure_mbar
+        self.mole_fraction = sf.input.mole_fraction
+        self.path_length = sf.input.path_length
+        Tref = sf.input.Tref
+        p_atm = self.pressure_mbar / 1013.25
+
+        # Energies (cm-1) multiplied by 1/(T1, T2, T3, Trot) in the exponents
+        if vib_distribution == 'treanor':
+            def energies(suffix):
+                return np.column_stack([_column(df, 'Evib1' + suffix + '_h'),
+                                        _column(df, 'Evib2' + suffix + '_h'),
+                                        _column(df, 'Evib3' + suffix + '_h'),
+                                        _column(df, 'Evib1' + suffix + '_a')
+                                        + _column(df, 'Evib2' + suffix + '_a')
+                                        + _column(df, 'Evib3' + suffix + '_a')
+                                        + _column(df, 'Erot' + suffix)])
+        else:
+            def energies(suffix):
+                return np.column_stack([_column(df, 'Evib1' + suffix),
+                                        _column(df, 'Evib2' + suffix),
+                                        _column(df, 'Evib3' + suffix),
+                                        _column(df, 'Erot' + suffix)])
+        self._Eu = energies('u')
+        self._El = energies('l')
+        # ... RADIS multiplies the three vibrational populations, each with gvib
+        self._gu = _column(df, 'gvibu') ** 3 * _column(df, 'grotu')
+        self._gl = _column(df, 'gvibl') ** 3 * _column(df, 'grotl')
+
+        # Energy levels of each isotope, for the partition functions
+        molecule = get_molecule(int(df['id'].iloc[0]))
+        iso = df['iso'].values
+        self.isotopes = [int(i) for i in np.unique(iso)]
+        self._iso_index = np.searchsorted(self.isotopes, iso)
+        self._levels = []
+        for i in self.isotopes:
+            levels = sf.get_partition_function_calculator(molecule, i, sf.input.state).df
+            if vib_distribution == 'treanor':
+                E = np.column_stack([levels['Evib1_h'], levels['Evib2_h'], levels['Evib3_h'],
+                                     levels['Evib1_a'] + levels['Evib2_a'] + levels['Evib3_a']
+                                     + levels['Erot']])
+            else:
+                E = np.column_stack([levels['Evib1'], levels['Evib2'], levels['Evib3'],
+                                     levels['Erot']])
+            self._levels.append((E.astype(np.float64),
+                                 (levels['gvib'] * levels['grot']).values.astype(np.float64)))
+
+        # Line intensities and emission integrals, without populations:
+        #   S = S0 * (nl - gl/gu * nu);   Ei = E0 * nu
+        wav = _column(df, 'wav')
+        gl, gu = _column(df, 'gl'), _column(df, 'gu')
+        self._S0 = (_column(df, 'int') * _column(df, 'Qref') / (gl * np.exp(-c2 * _column(df, 'El') / Tref))
+                    / (1 - np.exp(-c2 * wav / Tref)))
+        self._g_ratio = gl / gu
+        self._E0 = (_column(df, 'Ia') * _column(df, 'Aul') / 4 / np.pi
+                    * h * c * 100 * wav * 1e3)       # mW/sr
+
+        # Broadening: collisional widths at Tref, Doppler widths at 1 K
+        x = self.mole_fraction
+        self._hwhm_lorentz_ref = ((1 - x) * _column(df, 'airbrd') + x * _column(df, 'selbrd')) * p_atm
+        self._Tdpair = _column(df, 'Tdpair')
+        self._Tdpair_log_Tref = self._Tdpair * np.log(Tref)
+        mass = _column(df, 'molar_mass') * amu
+        self._hwhm_gauss_1K = wav / c * np.sqrt(2 * np.log(2) * k_b / mass)
+
+        # Line positions on the spectral grid (fixed): distance to the line
+        # center of every point within broadening_max_width/2
+        shiftwav = wav + _column(df, 'Pshft') * p_atm if 'Pshft' in df.columns else wav
+        self._line, self._index, self._dw = line_windows(shiftwav, self.w,
+                                                         sf.params.broadening_max_width)
+
+        # Preallocated buffers
+        n = len(df)
+        self._expo_u = np.empty(n)
+        self._expo_l = np.empty(n)
+        self._nu = np.empty(n)
+        self._nl = np.empty(n)
+        self._S = np.empty(n)
+        self._Ei = np.empty(n)
+        self._invT = np.empty(4)
+
+    def __len__(self):
+        return len(self._S0)
+
+    def partition_functions(self, Tvib, Trot):
+        ''' Nonequilibrium partition function of each isotope '''
+        self._set_temperatures(Tvib, Trot)
+        return np.array([np.sum(g * np.exp(-c2 * (E @ self._invT))) for E, g in self._levels])
+
+    def _set_temperatures(self, Tvib, Trot):
+        Tvib = np.broadcast_to(np.asarray(Tvib, dtype=np.float64), (3,))
+        self._invT[:3] = 1 / Tvib
+        self._invT[3] = 1 / Trot
+
+    def populations(self, Tvib, Trot):
+        ''' Upper and lower state populations of every line
+
+        Returns
+        -------
+
+        nu, nl: arrays
+            not corrected for isotopic abundance, as in RADIS. Views on internal
+            buffers: copy them to keep them after the next call.
+        '''
+        Q = self.partition_functions(Tvib, Trot)[self._iso_index]
+        for E, g, expo, n in [(self._Eu, self._gu, self._expo_u, self._nu),
+                              (self._El, self._gl, self._expo_l, self._nl)]:
+            np.dot(E, self._invT, out=expo)
+            expo *= -c2
+            np.exp(expo, out=n)
+            n *= g
+            n /= Q
+        return self._nu, self._nl
+
+    def __call__(self, Tvib, Trot, Ttrans=None, name=None):
+        ''' Calculate the nonequilibrium spectrum
+
+        Parameters
+        ----------
+
+        Tvib: float, or (float, float, float)
+            vibrational temperatures (K) of the 3 vibrational modes
+
+        Trot: float
+            rotational temperature (K)
+
+        Ttrans: float, or ``None``
+            translational temperature (K). If ``None``, use ``Trot``
+
+        Returns
+        -------
+
+        s: :class:`~radis.spectrum.spectrum.Spectrum`
+            with the ``quantities`` of the model, on its ``wavenumber`` grid
+
+        '''
+
+        t0 = time()
+        if Ttrans is None:
+            Ttrans = Trot
+
+        # Populations, line intensities and emission integrals
+        nu, nl = self.populations(Tvib, Trot)
+        S, Ei = self._S, self._Ei
+        np.multiply(nu, self._g_ratio, out=S)
+        np.subtract(nl, S, out=S)
+        S *= self._S0
+        np.multiply(nu, self._E0, out=Ei)
+        if self.cutoff > 0:
+            b = S > self.cutoff
+            S = np.where(b, S, 0)
+            Ei = np.where(b, Ei, 0)
+
+        # Lineshapes
+        hwhm_lorentz = self._hwhm_lorentz_ref * np.exp(self._Tdpair_log_Tref - self._Tdpair * np.log(Ttrans))
+        hwhm_gauss = self._hwhm_gauss_1K * np.sqrt(Ttrans)
+        line = self._line
+        profile = (voigt if self.lineshape == 'voigt' else pseudo_voigt)(
+                        self._dw, hwhm_lorentz[line], hwhm_gauss[line])
+        N = len(self.w)
+        abscoeff_v = np.bincount(self._index, weights=S[line] * profile, minlength=N)
+
+        # Spectral quantities, as in SpectrumFactory.non_eq_spectrum
+        w = self.w
+        density = self.mole_fraction * self.pressure_mbar * 100 / (k_b * Ttrans) * 1e-6  # cm-3
+        q = {}
+        q['abscoeff'] = abscoeff = abscoeff_v * density                 # cm-1
+        q['absorbance'] = absorbance = abscoeff * self.path_length
+        q['transmittance_noslit'] = transmittance_noslit = np.exp(-absorbance)
+        if self._emission:
+            emisscoeff_v = np.bincount(self._index, weights=Ei[line] * profile, minlength=N)
+            emisscoeff = emisscoeff_v * density                         # mW/sr/cm3/cm-1
+            radiance_noslit = emisscoeff * self.path_length             # optically thin
+            b = abscoeff > 0
+            radiance_noslit[b] = emisscoeff[b] / abscoeff[b] * (1 - transmittance_noslit[b])
+            q['radiance_noslit'] = radiance_noslit * w**2 * 1e-7         # mW/sr/cm2/cm-1 -> mW/sr/cm2/nm
+            q['emisscoeff'] = emisscoeff * w**2 * 1e-7                  # mW/sr/cm3/cm-1 -> mW/sr/cm3/nm
+
+        Tvib = tuple(np.broadcast_to(Tvib, (3,)).tolist())
+        conditions = {'Tvib': Tvib, 'Trot': Trot, 'Tgas': Ttrans,
+                      'vib_distribution': self.vib_distribution,
+                      'pressure_mbar': self.pressure_mbar,
+                      'mole_fraction': self.mole_fraction,
+                      'path_length': self.path_length,
+                      'thermal_equilibrium': False,
+                      'lines_calculated': int(np.count_nonzero(S)),
+                      'calculation_time': time() - t0,
+                      }
+        return Spectrum({k: (w, q[k]) for k in self.quantities},
+                        {k: self.units[k] for k in self.quantities},
+                        conditions=conditions,
+                        cond_units={k: v for k, v in self.cond_units.items() if k in conditions},
+                        waveunit='cm-1', name=name)
+
+    def compare(self, Tvib, Trot, Ttrans=None, var=None):
+        ''' Compare the model with :py:meth:`~radis.lbl.factory.SpectrumFactory.non_eq_spectrum`,
+        interpolated on the grid of the model if needed
+
+        Parameters
+        ----------
+
+        var: str, or ``None``
+            quantity to compare. If ``None``, the first quantity of the model.
+
+        Returns
+        -------
+
+        error: float
+            maximum absolute difference of ``var``, relative to the maximum of ``var``
+        '''
+        if var is None:
+            var = self.quantities[0]
+        s = self(Tvib, Trot, Ttrans=Ttrans)
+        s_radis = self.sf.non_eq_spectrum(Tvib, Trot, Ttrans=Ttrans,
+                                          vib_distribution=self.vib_distribution)
+        I = s.get(var, wunit='cm-1')[1]
+        I_radis = get_on_grid(s_radis, var, self.w, Iunit=self.units[var])
+        return np.abs(I - I_radis).max() / np.abs(I_radis).max()
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""
+Parallel calculation of layer spectra over a process pool.
+
+Each worker process calculates its layers with
+:py:meth:`~radis.lbl.factory.SpectrumFactory.eq_spectrum`, on the
+SpectrumFactory of the main process. Workers are forked after the line
+database is loaded: they inherit the SpectrumFactory and its line database
+(``sf.df0``) without pickling them, and the operating system shares the same
+memory pages between all processes (copy-on-write: the line database is only
+read). Workers write the absorption coefficient of each layer in a shared,
+memory-mapped output array: only the layer conditions are pickled.
+
+Notes
+-----
+
+Where new processes cannot be forked (Windows), the SpectrumFactory is pickled
+once to each worker, with its line database: memory usage is then that of one
+line database per worker. New processes re-import the main script: guard the
+calling code with ``if __name__ == '__main__':``
+
+"""
+
+from __future__ import print_function, absolute_import, division
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from os.path import join
+from tempfile import TemporaryDirectory
+import numpy as np
+from radis.misc.progress_bar import ProgressBar
+from .fitting import get_fork_context
+from .layers import (get_wavenumber_grid, broadcast_layers, factory_conditions,
+                     make_layer_spectra)
+
+#: conditions of the layer spectra calculated by the workers
+WORKER_CONDITIONS = ['calculation_time', 'lines_calculated', 'lines_cutoff',
+                     'lines_in_continuum']
+
+
+#%% Workers
+
+_worker = {}    # state of each worker process, set by _init_worker
+
+
+def _init_worker(sf, output_file):
+    _worker['sf'] = sf
+    _worker['abscoeff'] = np.load(output_file, mmap_mode='r+')
+
+
+def _calc_layer(i, Tgas, pressure, mole_fraction):
+    s = _worker['sf'].eq_spectrum(Tgas=Tgas, pressure=pressure,
+                                  mole_fraction=mole_fraction, path_length=1)
+    _worker['abscoeff'][i] = s.get('abscoeff', wunit='cm-1', copy=False)[1]
+    _worker['abscoeff'].flush()
+    return i, {k: s.conditions[k] for k in WORKER_CONDITIONS}
+
+
+#%% Public functions
+
+def calc_layers_parallel(sf, Tgas, pressure, path_length, mole_fraction,
+                         max_workers=None, verbose=True):
+    ''' Calculate the equilibrium spectra of all layers over a process pool
+
+    Same inputs and outputs as :func:`~radis_tools.layers.calc_layers`; each
+    layer is calculated by :py:meth:`~radis.lbl.factory.SpectrumFactory.eq_spectrum`
+    in a worker process that shares the line database of ``sf``, see
+    :py:mod:`radis_tools.parallel`.
+
+    Parameters
+    ----------
+
+    sf: :class:`~radis.lbl.factory.SpectrumFactory`
+        with a line database already loaded
+
+    Tgas, pressure, path_length, mole_fraction: arrays
+        conditions of each layer (K, bar, cm, --)
+
+    Other Parameters
+    ----------------
+
+    max_workers: int, or ``None``
+        number of processes. If ``None``, use all processors.
+
+    Returns
+    -------
+
+    slabs: list of :class:`~radis.spectrum.spectrum.Spectrum`
+        one equilibrium spectrum per layer
+
+    Examples
+    --------
+
+    ::
+
+        sf.fetch_databank()     # before the workers are forked
+        slabs = calc_layers_parallel(sf, Tgas=atm.T_K,
+                                     pressure=atm.P_Pa*1e-5,          # bar
+                                     path_length=atm.path_length*1e5, # cm
+                                     mole_fraction=400e-6,
+                                     max_workers=32)
+
+    '''
+
+    if sf.df0 is None:
+        raise ValueError('Load a line database in the SpectrumFactory first '+
+                         '(fetch_databank or load_databank)')
+    Tgas, pressure, path_length, mole_fraction = broadcast_layers(Tgas, pressure,
+                                                                  path_length,
+                                                                  mole_fraction)
+    w = get_wavenumber_grid(sf)
+    layer_conditions = [None] * len(Tgas)
+
+    with TemporaryDirectory(prefix='radis_layers_') as folder:
+
+        output_file = join(folder, 'abscoeff.npy')
+        np.lib.format.open_memmap(output_file, mode='w+', dtype=np.float64,
+                                  shape=(len(Tgas), len(w))).flush()
+
+        with ProcessPoolExecutor(max_workers=max_workers, mp_context=get_fork_context(),
+                                 initializer=_init_worker,
+                                 initargs=(sf, output_file)) as pool:
+            futures = [pool.submit(_calc_layer, i, Tgas[i], pressure[i], mole_fraction[i])
+                       for i in range(len(Tgas))]
+            if verbose:
+                pb = ProgressBar(len(Tgas))
+            for n, future in enumerate(as_completed(futures)):
+                i, layer_conditions[i] = future.result()
+                if verbose:
+                    pb.update(n)
+            if verbose:
+                pb.done()
+
+        # load in memory before the temporary files are deleted
+        abscoeff = np.array(np.load(output_file, mmap_mode='r'))
+
+    return make_layer_spectra(w, abscoeff, Tgas, pressure, path_length, mole_fraction,
+                              conditions=factory_conditions(sf),
+                              layer_conditions=layer_conditions)
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""
+Plot very wide spectra with a per-pixel min/max envelope.
+
+A spectrum of 10^5 - 10^6 points drawn on a figure a few hundred pixels wide
+wastes most of the plot (and figure saving) time on points that end up on the
+same pixel. :func:`~radis_tools.plot.plot_envelope` keeps only the minimum and
+maximum of the spectrum in each pixel column: the figure looks the same (line
+peaks are preserved), and plot time and memory no longer depend on the
+spectral resolution.
+
+"""
+
+from __future__ import print_function, absolute_import, division
+
+import numpy as np
+import matplotlib.pyplot as plt
+
+
+def minmax_envelope(x, y, n_bins):
+    ''' Decimate ``y(x)`` to its minimum and maximum in ``n_bins`` bins of ``x``
+
+    Parameters
+    ----------
+
+    x: array
+        monotonic (increasing or decreasing) abscissa, e.g. a wavelength grid
+        obtained from a uniform wavenumber grid
+
+    y: array
+
+    n_bins: int
+        number of bins, e.g. the width of the axes in pixels
+
+    Returns
+    -------
+
+    x, y: arrays
+        two points per non-empty bin, at the bin center: the minimum and maximum
+        of ``y`` in the bin, in the order they appear in ``y``. If ``x`` has less
+        than ``2*n_bins`` points, ``x`` and ``y`` are returned unchanged.
+
+    '''
+    x = np.asarray(x)
+    y = np.asarray(y)
+    if len(x) <= 2 * n_bins:
+        return x, y
+    if x[0] > x[-1]:
+        x, y = x[::-1], y[::-1]
+
+    edges = np.linspace(x[0], x[-1], n_bins + 1)
+    start = np.unique(np.searchsorted(x, edges[:-1]))     # first point of each non-empty bin
+    start = start[start < len(x)]
+    end = np.hstack((start[1:], len(x))) - 1               # last point of each bin
+
+    # argmin / argmax of each bin, from sorting by bin then by value
+    b = np.repeat(np.arange(len(start)), end - start + 1)
+    order = np.lexsort((y, b))
+    arg_min = order[start]
+    arg_max = order[end]
+
+    first = np.minimum(arg_min, arg_max)
+    last = np.maximum(arg_min, arg_max)
+    xc = (x[start] + x[end]) / 2
+    return np.repeat(xc, 2), np.column_stack((y[first], y[last])).ravel()
+
+
+def plot_envelope(s, var=None, wunit='default', Iunit='default', n_pixels=None,
+                  ax=None, **kwargs):
+    ''' Plot a spectral quantity decimated to a min/max envelope per pixel
+
+    Same use as :py:meth:`~radis.spectrum.spectrum.Spectrum.plot` with
+    ``nfig='same'``.
+
+    Parameters
+    ----------
+
+    s: :class:`~radis.spectrum.spectrum.Spectrum`
+
+    var: str, or ``None``
+        spectral quantity. If ``None``, use the first quantity of ``s``.
+
+    wunit: ``'nm'``, ``'cm-1'``, ``'nm_vac'``, or ``'default'``
+        wavespace unit. If ``'default'``, use the one of the spectrum.
+
+    Iunit: str
+        unit of the quantity
+
+    n_pixels: int, or ``None``
+        number of bins. If ``None``, use the width of the axes in pixels.
+
+    ax: matplotlib Axes, or ``None``
+        if ``None``, plot in the current axes
+
+    kwargs: dict
+        forwarded to :py:func:`matplotlib.pyplot.plot`. The spectrum name is
+        used as default ``label``.
+
+    Returns
+    -------
+
+    line: matplotlib Line2D
+
+    Examples
+    --------
+
+    ::
+
+        plot_envelope(s, 'abscoeff', wunit='nm')
+        plt.yscale('log')
+
+    '''
+    from radis.spectrum.utils import make_up     # minmax_envelope() works without RADIS
+
+    if var is None:
+        var = s.get_vars()[0]
+    if wunit == 'default':
+        wunit = s.get_waveunit()
+    if Iunit == 'default':
+        Iunit = s.units[var]
+    if ax is None:
+        ax = plt.gca()
+    if n_pixels is None:
+        n_pixels = max(int(ax.bbox.width), 1)
+
+    w, I = s.get(var, wunit=wunit, Iunit=Iunit, copy=False)
+    w, I = minmax_envelope(w, I, n_pixels)
+
+    kwargs.setdefault('label', s.get_name())
+    line, = ax.plot(w, I, **kwargs)
+    ax.set_xlabel('Wavenumber (cm-1)' if wunit == 'cm-1' else 'Wavelength ({0})'.format(wunit))
+    ax.set_ylabel(make_up('{0} ({1})'.format(var, Iunit)))
+    return line
@@ -0,0 +1,299 @@
+# -*- coding: utf-8 -*-
+"""
+A long-running spectrum service, with SpectrumFactories kept warm.
+
+Each ``calc_spectrum()`` creates a SpectrumFactory and fetches or loads its
+line database before calculating. The :class:`~radis_tools.service.SpectrumService`
+keeps the factories (and their lines) in memory, one per molecule, spectral
+range, databank and factory parameters: the next request with the same
+setup only calculates the spectrum. Temperatures, pressure, mole fraction
+and path length change without a new factory.
+
+:func:`~radis_tools.service.serve` runs the service on a local HTTP port,
+and ``radis_client.py`` (repository root) is the client. Requests are handled
+in threads: requests for different factories run concurrently, requests for
+the same factory one after the other. Spectra are returned in the binary
+format of :py:mod:`radis_tools.wire`, optionally in float32. Start the service by
+hand with::
+
+    python -m radis_tools.service --port 8765
+
+or let the client start it in the background at the first request.
+
+Notes
+-----
+
+Factories are created with ``save_memory=False``, so that their line
+database is reused. ``use_cached`` applies when the line database of a new
+factory is loaded, and is not part of the factory setup. At most ``max_factories`` are kept, least recently used
+first out.
+
+"""
+
+from __future__ import print_function, absolute_import, division
+
+import argparse
+import json
+import threading
+import traceback
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from inspect import signature
+from os.path import exists
+from time import time
+import numpy as np
+from radis import SpectrumFactory, MergeSlabs
+from radis.phys.convert import nm2cm
+from .wire import pack, DEFAULT_HOST, DEFAULT_PORT
+
+#: calc_spectrum arguments that can be given per molecule (dict)
+MOLECULE_ARGS = ['isotope', 'mole_fraction', 'databank']
+
+
+def _at_equilibrium(Tgas, Tvib, Trot, overpopulation, self_absorption=True, **kwargs):
+    ''' Same test as :py:func:`~radis.lbl.calc.calc_spectrum` '''
+    return ((Tvib is None or Tvib == Tgas) and (Trot is None or Trot == Tgas)
+            and overpopulation is None and self_absorption)
+
+
+def encode_spectrum(s, dtype='float64', quantities=None):
+    ''' Payload of Spectrum ``s``, see :py:mod:`radis_tools.wire`
+
+    Parameters
+    ----------
+
+    dtype: ``'float64'``, ``'float32'``
+        precision of the quantities. The wavespace stays in float64.
+
+    quantities: list of str, or ``None``
+        quantities to encode. If ``None``, all.
+    '''
+    arrays = OrderedDict()
+    for group, q in [('q', s._q), ('q_conv', s._q_conv)]:
+        names = [k for k in q if k != 'wavespace' and (quantities is None or k in quantities)]
+        if names:
+            arrays[group + '/wavespace'] = q['wavespace']
+        for k in names:
+            arrays[group + '/' + k] = q[k].astype(dtype, copy=False)
+    header = {'conditions': s.conditions,
+              'units': {k: u for k, u in s.units.items() if quantities is None or k in quantities},
+              'cond_units': s.cond_units,
+              'name': s.name,
+              'waveunit': s.get_waveunit()}
+    return pack(header, arrays)
+
+
+class SpectrumService(object):
+    ''' Calculate spectra with SpectrumFactories kept in memory
+
+    Parameters
+    ----------
+
+    max_factories: int
+        maximum number of factories (and line databases) kept in memory
+
+    verbose: bool
+
+    Examples
+    --------
+
+    ::
+
+        service = SpectrumService()
+        s = service.calc_spectrum(1900, 2300, molecule='CO', Tgas=1000, mole_fraction=0.1)
+        s = service.calc_spectrum(1900, 2300, molecule='CO', Tgas=1500, mole_fraction=0.1)   # warm
+
+    '''
+
+    def __init__(self, max_factories=8, verbose=True):
+        self.max_factories = max_factories
+        self.verbose = verbose
+        self.requests = 0
+        self.created = 0
+        self._t0 = time()
+        self._factories = OrderedDict()     # key: {'lock', 'sf', 'requests'}
+        self._lock = threading.Lock()
+
+    def _entry(self, key):
+        with self._lock:
+            if key in self._factories:
+                self._factories.move_to_end(key)
+            else:
+                self._factories[key] = {'lock': threading.Lock(), 'sf': None, 'requests': 0}
+                if len(self._factories) > self.max_factories:
+                    self._factories.popitem(last=False)     # still used by running requests
+            return self._factories[key]
+
+    def _new_factory(self, molecule, isotope, databank, equilibrium, use_cached=True,
+                     **factory_kwargs):
+        t0 = time()
+        sf = SpectrumFactory(molecule=molecule, isotope=isotope, save_memory=False,
+                             verbose=self.verbose, **factory_kwargs)
+        levelsfmt = None if equilibrium else 'radis'    # built-in constants out of equilibrium
+        if databank == 'fetch':
+            cache = {}
+            if 'db_use_cached' in signature(sf.fetch_databank).parameters:   # recent RADIS
+                cache['db_use_cached'] = use_cached
+            sf.fetch_databank(source='astroquery', format='hitran', parfuncfmt='hapi',
+                              levelsfmt=levelsfmt, **cache)
+        elif exists(databank):
+            if not databank.endswith('.par'):
+                raise ValueError('Couldnt infer the format of the line database file: ' +
+                                 '{0}. Use a HITRAN .par file, or a databank name'.format(
+                                     databank))
+            sf.load_databank(path=databank, format='hitran', parfuncfmt='hapi',
+                             levelsfmt=levelsfmt, db_use_cached=use_cached)
+        else:
+            sf.load_databank(databank, load_energies=not equilibrium,
+                             db_use_cached=use_cached)
+        self.created += 1
+        if self.verbose:
+            print('New factory for {0} {1:.1f}-{2:.1f}cm-1 ({3}) in {4:.1f}s'.format(
+                  molecule, factory_kwargs['wavenum_min'], factory_kwargs['wavenum_max'],
+                  databank, time() - t0))
+        return sf
+
+    def calc_spectrum(self, wavenum_min=None, wavenum_max=None, wavelength_min=None,
+                      wavelength_max=None, Tgas=None, Tvib=None, Trot=None, pressure=1.01325,
+                      molecule=None, isotope='all', mole_fraction=1, path_length=1,
+                      medium='air', databank='fetch', wstep=0.01, broadening_max_width=10,
+                      optimization='min-RMS', overpopulation=None, name=None,
+                      use_cached=True, verbose=None, mode='cpu', **kwargs):
+        ''' Same as :py:func:`~radis.lbl.calc.calc_spectrum`, with the factories
+        of previous calls with the same setup. ``verbose`` is that of the service. '''
+
+        with self._lock:
+            self.requests += 1
+        if mode != 'cpu':
+            raise NotImplementedError('Only mode="cpu" in the spectrum service')
+        if wavenum_min is None and wavenum_max is None:
+            if wavelength_min is None or wavelength_max is None:
+                raise ValueError('Give wavenum_min, wavenum_max or wavelength_min, wavelength_max')
+            wavenum_min, wavenum_max = nm2cm(wavelength_max), nm2cm(wavelength_min)
+        elif wavelength_min is not None or wavelength_max is not None:
+            raise ValueError("Wavenumber and Wavelength both given... it's time to choose!")
+        if Tgas is None and Trot is None:
+            raise ValueError('Choose either Tgas (equilibrium) or Tvib / Trot (non equilibrium)')
+        if (Tvib is None) != (Trot is None):
+            raise ValueError('Choose both Tvib and Trot')
+        if isinstance(Tvib, list):
+            Tvib = tuple(Tvib)      # multi-temperature, sent as a JSON list
+
+        # ... one calculation per molecule, as in calc_spectrum()
+        molecules = None
+        args = {'isotope': isotope, 'mole_fraction': mole_fraction, 'databank': databank}
+        for k in MOLECULE_ARGS:
+            if isinstance(args[k], dict):
+                molecules = list(args[k])
+        if molecule is not None:
+            molecules = [molecule] if isinstance(molecule, str) else list(molecule)
+        if molecules is None:
+            raise ValueError('Please enter the molecule(s) to calculate in the `molecule=` argument')
+        equilibrium = _at_equilibrium(Tgas, Tvib, Trot, overpopulation, **kwargs)
+
+        s_list = []
+        for mol in molecules:
+            margs = {k: v[mol] if isinstance(v, dict) else v for k, v in args.items()}
+            factory_kwargs = dict(kwargs, wavenum_min=wavenum_min, wavenum_max=wavenum_max,
+                                  medium=medium, wstep=wstep, pressure=pressure,
+                                  broadening_max_width=broadening_max_width,
+                                  optimization=optimization)
+            key = json.dumps([mol, margs['isotope'], margs['databank'], equilibrium,
+                              {k: v for k, v in factory_kwargs.items() if k != 'pressure'}],
+                             sort_keys=True, default=str)
+            entry = self._entry(key)
+            with entry['lock']:
+                if entry['sf'] is None:
+                    entry['sf'] = self._new_factory(mol, margs['isotope'], margs['databank'],
+                                                    equilibrium, use_cached=use_cached,
+                                                    **factory_kwargs)
+                entry['requests'] += 1
+                sf = entry['sf']
+                if equilibrium:
+                    s = sf.eq_spectrum(Tgas=Tgas, mole_fraction=margs['mole_fraction'],
+                                       path_length=path_length, pressure=pressure, name=name)
+                else:
+                    s = sf.non_eq_spectrum(Tvib=Tvib, Trot=Trot, Ttrans=Tgas,
+                                           overpopulation=overpopulation,
+                                           mole_fraction=margs['mole_fraction'],
+                                           path_length=path_length, pressure=pressure,
+                                           name=name)
+            s_list.append(s)
+        return MergeSlabs(*s_list)
+
+    def status(self):
+        ''' Factories in memory (setup and number of requests), and statistics '''
+        with self._lock:
+            factories = [dict(zip(['molecule', 'isotope', 'databank', 'equilibrium', 'params'],
+                                  json.loads(key)), requests=entry['requests'])
+                         for key, entry in self._factories.items()]
+        return {'factories': factories,
+                'requests': self.requests,
+                'factories_created': self.created,
+                'uptime': time() - self._t0}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    ''' ``GET /status``, ``POST /calc_spectrum`` (JSON arguments), ``POST /shutdown`` '''
+
+    def _send(self, code, body, content_type='application/json'):
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/status':
+            self._send(200, json.dumps(self.server.service.status()).encode())
+        else:
+            self.send_error(404)
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers['Content-Length'])) or b'{}')
+        if self.path == '/shutdown':
+            self._send(200, b'{}')
+            threading.Thread(target=self.server.shutdown).start()
+        elif self.path == '/calc_spectrum':
+            dtype = request.pop('dtype', 'float64')
+            quantities = request.pop('quantities', None)
+            try:
+                s = self.server.service.calc_spectrum(**request)
+                body = encode_spectrum(s, np.dtype(dtype), quantities)
+            except Exception as err:
+                if self.server.service.verbose:
+                    traceback.print_exc()
+                self._send(400 if isinstance(err, (ValueError, TypeError, KeyError)) else 500,
+                           json.dumps({'error': type(err).__name__, 'message': str(err)}).encode())
+                return
+            self._send(200, body, 'application/octet-stream')
+        else:
+            self.send_error(404)
+
+    def log_message(self, format, *args):
+        if self.server.service.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+
+def serve(host=DEFAULT_HOST, port=DEFAULT_PORT, max_factories=8, verbose=True):
+    ''' Run a :class:`~radis_tools.service.SpectrumService` on ``host:port``,
+    until a ``/shutdown`` request. Local use only: requests are not authenticated. '''
+    server = ThreadingHTTPServer((host, port), _Handler)
+    server.daemon_threads = True
+    server.service = SpectrumService(max_factories=max_factories, verbose=verbose)
+    if verbose:
+        print('RADIS spectrum service on http://{0}:{1}'.format(host, port))
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='RADIS spectrum service')
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--max-factories', type=int, default=8)
+    parser.add_argument('--quiet', action='store_true')
+    args = parser.parse_args()
+    serve(args.host, args.port, args.max_factories, verbose=not args.quiet)
@@ -0,0 +1,295 @@
+# -*- coding: utf-8 -*-
+"""
+Spectral-range sharding: calculate a wide spectral range as several sub-ranges
+in parallel, and stitch them back into one Spectrum.
+
+Each shard is calculated by a worker process with its own
+:py:class:`~radis.lbl.factory.SpectrumFactory`, on a sub-range of the
+wavenumber grid. RADIS loads the lines within ``broadening_max_width/2`` of
+each side of the sub-range, so lines from the neighbouring shards that
+overlap the shard are accounted for. Shards are calculated with a margin of a
+few grid points, and trimmed to the full grid when stitched.
+
+Peak memory per worker scales with the shard width instead of the full range:
+use more shards than workers to reduce it further.
+
+Notes
+-----
+
+With ``optimization=None`` (direct broadening of every line) the stitched
+spectrum is identical to a single calculation over the full range, to the
+rounding of the wavenumber grid of each shard. With the DLM (``chunksize='DLM'`` or ``optimization='min-RMS'``), the
+lineshape database depends on the lines of each shard: differences are within
+the DLM accuracy.
+
+With ``databank='fetch'``, the lines are fetched once by the calling process
+(one query per isotope over the full range), and each worker loads the lines
+of its sub-range with :func:`~radis_tools.linedb.load_databank`: shards do not
+query the online database.
+
+In the stitched spectra, ``calculation_time`` is the wall time of the whole
+sharded calculation (all ``calcs``), and the line counts ``lines_calculated``,
+``lines_cutoff`` and ``lines_in_continuum`` count each line once, in the shard
+that owns its center. The split between ``lines_cutoff`` and
+``lines_in_continuum`` is exact without a pseudo-continuum; with one, the lines
+of each shard that were not calculated are split in the ratio of that shard.
+
+On Windows, guard the calling code with ``if __name__ == '__main__':``
+
+"""
+
+from __future__ import print_function, absolute_import, division
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from time import time
+import numpy as np
+import pandas as pd
+from radis import SpectrumFactory, Spectrum
+from radis.io.hitran import parse_global_quanta, parse_local_quanta
+from radis.io.query import fetch_astroquery
+from radis.io.tools import drop_object_format_columns, replace_PQR_with_m101
+from radis.misc.progress_bar import ProgressBar
+from .linedb import load_databank, open_databank_cache
+
+
+def fetch_lines(factory_kwargs, drop_non_numeric=True, verbose=True):
+    ''' Lines that :py:meth:`~radis.lbl.factory.SpectrumFactory.fetch_databank`
+    downloads for ``SpectrumFactory(**factory_kwargs)``, including the
+    neighbouring lines
+
+    Returns
+    -------
+
+    lines: pandas DataFrame
+        all isotopes, with the quanta parsed as in ``fetch_databank``
+    '''
+    sf = SpectrumFactory(**factory_kwargs)
+    molecule = sf.input.molecule
+    df = pd.concat([fetch_astroquery(molecule, iso, sf.params.wavenum_min_calc,
+                                     sf.params.wavenum_max_calc, verbose=verbose)
+                    for iso in sf._get_isotope_list()], ignore_index=True)
+    df = parse_local_quanta(df, molecule)
+    df = parse_global_quanta(df, molecule)
+    if drop_non_numeric:
+        if 'branch' in df:
+            replace_PQR_with_m101(df)
+        df = drop_object_format_columns(df, verbose=verbose)
+    return df
+
+
+def _crop_lines(lines, factory_kwargs):
+    ''' Lines of ``lines`` (see :func:`~radis_tools.sharding.fetch_lines`) used
+    by ``SpectrumFactory(**factory_kwargs)`` '''
+    sf = SpectrumFactory(**factory_kwargs)
+    wmin, wmax = sf.params.wavenum_min_calc, sf.params.wavenum_max_calc
+    return lines[(lines.wav >= wmin) & (lines.wav <= wmax)].reset_index(drop=True)
+
+
+def _fetch_kwargs(databank_kwargs):
+    ''' ``load_databank`` arguments equivalent to the ``fetch_databank`` arguments
+    ``databank_kwargs``, for lines fetched by :func:`~radis_tools.sharding.fetch_lines` '''
+    kwargs = dict(format='hitran', parfuncfmt='hapi', levelsfmt='radis', drop_columns=[])
+    kwargs.update({k: v for k, v in databank_kwargs.items()
+                   if k not in ['source', 'drop_non_numeric']})
+    return dict(kwargs, path=[])      # lines are given: no database file
+
+
+def _calc_shard(factory_kwargs, databank, databank_kwargs, calcs, owned,
+                line_cache=False, lines=None):
+    ''' Calculate all ``calcs`` on one shard. Returns arrays only, and the
+    number of lines centered in the ``owned`` range ``(wmin, wmax)``, in cm-1 '''
+
+    sf = SpectrumFactory(**factory_kwargs)
+    if databank == 'fetch':
+        # lines fetched by the calling process: do not query the online database
+        load_databank(sf, None, lines=lines, verbose=False, **_fetch_kwargs(databank_kwargs))
+    elif line_cache:
+        load_databank(sf, databank, verbose=False, **databank_kwargs)
+    else:
+        sf.load_databank(databank, **databank_kwargs)
+
+    def _n_owned(df):
+        return int(((df.wav >= owned[0]) & (df.wav < owned[1])).sum())
+
+    n_lines = _n_owned(sf.df0)
+    out = []
+    for method, kwargs in calcs:
+        s = getattr(sf, method)(**kwargs)
+        quantities = {var: s.get(var, wunit='cm-1')[1] for var in s.get_vars()}
+        conditions = dict(s.conditions)
+        if 'lines_calculated' in conditions:
+            n_calculated = _n_owned(sf.df1)
+            n_cutoff = conditions.get('lines_cutoff') or 0
+            n_continuum = conditions.get('lines_in_continuum') or 0
+            if n_cutoff + n_continuum > 0:
+                n_continuum = int(round((n_lines - n_calculated) * n_continuum
+                                        / (n_cutoff + n_continuum)))
+            conditions['lines_calculated'] = n_calculated
+            if conditions.get('lines_cutoff') is not None:
+                conditions['lines_cutoff'] = n_lines - n_calculated - n_continuum
+            if conditions.get('lines_in_continuum') is not None:
+                conditions['lines_in_continuum'] = n_continuum
+        out.append((s.get_wavenumber(), quantities, dict(s.units),
+                    conditions, dict(s.cond_units)))
+    return out
+
+
+def shard_limits(n_points, n_shards, margin=2):
+    ''' Split a grid of ``n_points`` into ``n_shards`` contiguous index ranges
+
+    Returns
+    -------
+
+    limits: list of (i_min, i_max, j_min, j_max)
+        ``[i_min, i_max]`` are the grid indices owned by each shard (inclusive),
+        ``[j_min, j_max]`` the indices calculated, with ``margin`` more points on
+        each side
+
+    '''
+    edges = np.linspace(0, n_points, n_shards + 1).round().astype(int)
+    return [(a, b - 1, max(0, a - margin), min(n_points - 1, b - 1 + margin))
+            for a, b in zip(edges[:-1], edges[1:]) if b > a]
+
+
+def calc_sharded(factory_kwargs, databank, calcs, n_shards=None, max_workers=None,
+                 databank_kwargs={}, line_cache=False, verbose=True):
+    ''' Calculate spectra over a wide range as parallel sub-ranges, and stitch them
+
+    Parameters
+    ----------
+
+    factory_kwargs: dict
+        arguments of :py:class:`~radis.lbl.factory.SpectrumFactory`. Must include
+        ``wavenum_min``, ``wavenum_max`` (cm-1) and ``wstep``.
+
+    databank: str
+        line database name, loaded in each worker with
+        :py:meth:`~radis.lbl.factory.SpectrumFactory.load_databank`, or ``'fetch'``
+        to use :py:meth:`~radis.lbl.factory.SpectrumFactory.fetch_databank`. The
+        lines are then fetched once, by the calling process.
+
+    calcs: list of (str, dict)
+        SpectrumFactory methods and their arguments, e.g.
+        ``[('eq_spectrum', {'Tgas': 4000, 'pressure': 1})]``. All are calculated with
+        the same factory, so the database is loaded once per shard.
+
+    Other Parameters
+    ----------------
+
+    n_shards: int, or ``None``
+        number of sub-ranges. If ``None``, one per worker.
+
+    max_workers: int, or ``None``
+        number of processes. If ``None``, use all processors.
+
+    databank_kwargs: dict
+        arguments of ``load_databank`` / ``fetch_databank``. With ``'fetch'``, the
+        ``fetch_databank`` arguments are converted to those of
+        :func:`~radis_tools.linedb.load_databank`.
+
+    line_cache: bool
+        if ``True``, load the databank through a
+        :class:`~radis_tools.linedb.LineDatabaseCache`: each shard reads only the
+        lines of its sub-range. The cache is built first if needed.
+
+    Returns
+    -------
+
+    spectra: list of :class:`~radis.spectrum.spectrum.Spectrum`
+        one stitched spectrum per element of ``calcs``
+
+    Examples
+    --------
+
+    ::
+
+        s_forebody, s_freeflow = calc_sharded(
+                dict(wavenum_min=2000, wavenum_max=2500, wstep=0.01, isotope='1'),
+                'HITEMP-CO2',
+                [('eq_spectrum', dict(Tgas=4000, pressure=1, mole_fraction=0.027, path_length=1)),
+                 ('non_eq_spectrum', dict(Tvib=2200, Trot=1690, pressure=0.017,
+                                          mole_fraction=0.606, path_length=3))],
+                n_shards=16, max_workers=4)
+
+    '''
+
+    t0 = time()
+    wmin, wmax = factory_kwargs['wavenum_min'], factory_kwargs['wavenum_max']
+    wstep = factory_kwargs['wstep']
+    n_points = int(round((wmax - wmin) / wstep)) + 1
+    if max_workers is None:
+        max_workers = os.cpu_count()
+    if n_shards is None:
+        n_shards = max_workers
+    limits = shard_limits(n_points, n_shards)
+    lines = None
+    if databank == 'fetch':
+        lines = fetch_lines(factory_kwargs, verbose=verbose,    # not once per shard
+                            drop_non_numeric=databank_kwargs.get('drop_non_numeric', True))
+    elif line_cache:
+        open_databank_cache(databank, verbose=verbose)      # not once per shard
+
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        futures = []
+        for n, (i_min, i_max, j_min, j_max) in enumerate(limits):
+            kwargs = dict(factory_kwargs, wavenum_min=wmin + j_min * wstep,
+                          wavenum_max=wmin + j_max * wstep)
+            # lines are owned by the shard of the nearest grid point; the first
+            # and last shards also own the neighbouring lines out of the range
+            owned = (wmin + (i_min - 0.5) * wstep if n > 0 else -np.inf,
+                     wmin + (i_max + 0.5) * wstep if n < len(limits) - 1 else np.inf)
+            futures.append(pool.submit(_calc_shard, kwargs, databank, databank_kwargs, calcs,
+                                       owned, line_cache,
+                                       _crop_lines(lines, kwargs) if lines is not None else None))
+        if verbose:
+            print('Calculating {0} shards of ~{1} points on {2} workers'.format(
+                  len(limits), n_points // len(limits), max_workers))
+            pb = ProgressBar(len(futures))
+        shards = []
+        for n, future in enumerate(futures):
+            shards.append(future.result())
+            if verbose:
+                pb.update(n)
+        if verbose:
+            pb.done()
+
+    calculation_time = time() - t0
+    return [_stitch([shard[k] for shard in shards], limits, wmin, wstep, n_points,
+                    calculation_time=calculation_time)
+            for k in range(len(calcs))]
+
+
+def _stitch(parts, limits, wmin, wstep, n_points, calculation_time=None):
+    ''' Stitch the shards of one spectrum, keeping the points owned by each shard.
+    Line counts of the shards are summed: they must count the lines they own only '''
+
+    w_parts = []
+    q_parts = {var: [] for var in parts[0][1]}
+    for (w, quantities, _, _, _), (i_min, i_max, _, _) in zip(parts, limits):
+        index = np.round((w - wmin) / wstep).astype(int)
+        b = (index >= i_min) & (index <= i_max)
+        w_parts.append(w[b])
+        for var in q_parts:
+            q_parts[var].append(quantities[var][b])
+
+    n = sum(len(wi) for wi in w_parts)
+    if n != n_points:
+        raise ValueError('Shards do not cover the spectral grid: {0} points '.format(n) +
+                         'instead of {0}. Check wstep'.format(n_points))
+    w = wmin + wstep * np.arange(n_points)
+
+    _, _, units, conditions, cond_units = parts[0]
+    conditions = dict(conditions)
+    conditions['wavenum_min'] = float(w[0])
+    conditions['wavenum_max'] = float(w[-1])
+    conditions['shards'] = len(parts)
+    for k in ['lines_calculated', 'lines_cutoff', 'lines_in_continuum']:
+        if conditions.get(k) is not None:
+            conditions[k] = sum(p[3][k] for p in parts)
+    if calculation_time is not None:
+        conditions['calculation_time'] = calculation_time
+
+    return Spectrum({var: (w, np.hstack(I)) for var, I in q_parts.items()},
+                    units, conditions=conditions, cond_units=cond_units,
+                    waveunit='cm-1', name=conditions.get('name'))
@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+"""
+Slit convolution with FFTs, for wide and finely gridded spectra.
+
+:py:meth:`~radis.spectrum.spectrum.Spectrum.apply_slit` convolves with
+:py:func:`numpy.convolve`, in O(N.M) for N spectral points and a slit of M
+points. A 10 nm slit on the 0.01 cm-1 grid of the JAXA example is ~1000
+points wide, and the direct convolution dominates the cost of the slit.
+
+:func:`~radis_tools.slit.convolve` chooses the convolution from the slit
+width: direct for narrow slits, overlap-add (:py:func:`scipy.signal.oaconvolve`:
+FFTs of blocks a few times the slit width, in O(N.log M)) for wider slits,
+and a single FFT when the slit is as wide as a fraction of the spectrum.
+Results agree with the direct convolution to the rounding errors of the FFTs
+(~1e-15 of the maximum).
+
+:func:`~radis_tools.slit.apply_slit` runs
+:py:meth:`~radis.spectrum.spectrum.Spectrum.apply_slit` with this
+convolution: slit functions, units, normalization and boundaries are those
+of RADIS. Slits that depend on the wavelength (``slit_dispersion``) are
+applied on spectral slices where the slit is considered constant, each of
+them convolved with the method adapted to its local width.
+
+:func:`~radis_tools.slit.compare_convolution` compares the result and the
+time of a method with the direct convolution, on a given spectrum.
+
+Notes
+-----
+
+RADIS is imported when a slit function is applied: :func:`~radis_tools.slit.convolve`
+works on arrays without it.
+
+"""
+
+from __future__ import print_function, absolute_import, division
+
+from time import time
+from warnings import warn
+import numpy as np
+from scipy.interpolate import splrep, splev
+from scipy.signal import oaconvolve, fftconvolve
+
+#: slits narrower than this (points) are convolved directly
+DIRECT_MAX_POINTS = 256
+#: slits wider than this fraction of the spectrum are convolved with a single FFT
+FFT_MIN_FRACTION = 0.1
+
+
+def choose_method(n_points, n_slit):
+    ''' Fastest convolution of a spectrum of ``n_points`` by a slit of ``n_slit``
+    points: ``'direct'``, ``'overlap-add'`` or ``'fft'`` '''
+    if n_slit < DIRECT_MAX_POINTS:
+        return 'direct'
+    if n_slit < FFT_MIN_FRACTION * n_points:
+        return 'overlap-add'
+    return 'fft'
+
+
+def convolve(I, I_slit, method='auto'):
+    ''' Same as ``np.convolve(I, I_slit, mode='same')``
+
+    Parameters
+    ----------
+
+    I, I_slit: arrays
+        spectrum and slit function, on the same evenly spaced grid
+
+    method: ``'auto'``, ``'direct'``, ``'overlap-add'``, ``'fft'``
+        if ``'auto'``, see :func:`~radis_tools.slit.choose_method`
+
+    '''
+    if method == 'auto':
+        method = choose_method(len(I), len(I_slit))
+    if method == 'direct' or len(I_slit) > len(I):
+        return np.convolve(I, I_slit, mode='same')
+    elif method == 'overlap-add':
+        return oaconvolve(I, I_slit, mode='same')
+    elif method == 'fft':
+        return fftconvolve(I, I_slit, mode='same')
+    raise ValueError('Unknown convolution method: {0}'.format(method))
+
+
+def convolve_with_slit(w, I, w_slit, I_slit, norm_by='area', mode='valid',
+                       slit_dispersion=None, k=1, bplot=False, verbose=True,
+                       assert_evenly_spaced=True, waveunit='', method='auto'):
+    ''' Same as :py:func:`~radis.tools.slit.convolve_with_slit`, with the
+    convolution ``method`` of :func:`~radis_tools.slit.convolve` '''
+    import radis.tools.slit
+    from radis.misc.arrays import evenly_distributed
+    from radis.misc.signal import resample_even
+    from radis.tools.slit import offset_dilate_slit_function, normalize_slit, remove_boundary
+
+    if abs(w[-1] - w[0]) <= abs(w_slit[-1] - w_slit[0]):
+        raise AssertionError('Slit function is broader ({0:.1f}{1}) than spectrum '.format(
+                             abs(w_slit[-1] - w_slit[0]), waveunit) +
+                             '({0:.1f}{1}). No valid range.'.format(abs(w[-1] - w[0]), waveunit))
+
+    if slit_dispersion is not None:
+        w_slit, I_slit = offset_dilate_slit_function(w_slit, I_slit, w, slit_dispersion,
+                                                     threshold=0.01, verbose=verbose)
+
+    # Slit function on the spectrum grid
+    wstep = abs(np.diff(w)).min()
+    if assert_evenly_spaced and not evenly_distributed(w, tolerance=wstep * 1e-3):
+        warn('Spectrum not evenly spaced. Resampling')
+        w, I = resample_even(w, I, resfactor=2, print_conservation=True)
+        wstep = abs(np.diff(w)).min()
+    if w_slit[-1] < w_slit[0]:
+        w_slit, I_slit = w_slit[::-1], I_slit[::-1]
+    if not np.allclose(np.diff(w_slit), wstep):
+        w_slit_interp = np.arange(w_slit[0], w_slit[-1] + wstep, wstep)
+        I_slit_interp = splev(w_slit_interp, splrep(w_slit, I_slit, k=k))
+    else:
+        w_slit_interp, I_slit_interp = w_slit, I_slit
+    w_slit_interp, I_slit_interp = normalize_slit(w_slit_interp, I_slit_interp,
+                                                  norm_by=norm_by)
+
+    if np.isnan(I_slit).any():
+        raise ValueError('Slit has nan value')
+    if not (I_slit >= 0).all():
+        raise ValueError('Slit is partially negative')
+    if bplot:
+        radis.tools.slit.plot_slit(w_slit, I_slit, waveunit=waveunit)
+
+    I_conv = convolve(I, I_slit_interp, method=method) * wstep
+
+    return remove_boundary(w, I_conv, mode, len_I=len(I), len_I_slit_interp=len(I_slit_interp))
+
+
+def apply_slit(s, slit_function, unit='nm', method='auto', **kwargs):
+    ''' Apply a slit function to Spectrum ``s``, as
+    :py:meth:`~radis.spectrum.spectrum.Spectrum.apply_slit`, with the
+    convolution ``method`` of :func:`~radis_tools.slit.convolve`
+
+    Parameters
+    ----------
+
+    s: :class:`~radis.spectrum.spectrum.Spectrum`
+
+    slit_function, unit: see :py:meth:`~radis.spectrum.spectrum.Spectrum.apply_slit`
+
+    method: ``'auto'``, ``'direct'``, ``'overlap-add'``, ``'fft'``
+        if ``'auto'``, chosen from the slit width, see :func:`~radis_tools.slit.choose_method`
+
+    kwargs: dict
+        forwarded to :py:meth:`~radis.spectrum.spectrum.Spectrum.apply_slit`, e.g.
+        ``shape``, ``mode``, ``slit_dispersion``
+
+    Returns
+    -------
+
+    s: :class:`~radis.spectrum.spectrum.Spectrum`
+        the same Spectrum, to chain: ``apply_slit(s, 10, 'nm').plot()``
+
+    Examples
+    --------
+
+    ::
+
+        apply_slit(s, 10, 'nm')                 # instead of s.apply_slit(10, 'nm')
+
+    '''
+    import radis.tools.slit
+
+    def _convolve_with_slit(*args, **kw):
+        return convolve_with_slit(*args, method=method, **kw)
+
+    # Spectrum.apply_slit imports convolve_with_slit when called: replace it
+    # for this call only
+    original = radis.tools.slit.convolve_with_slit
+    radis.tools.slit.convolve_with_slit = _convolve_with_slit
+    try:
+        s.apply_slit(slit_function, unit=unit, **kwargs)
+    finally:
+        radis.tools.slit.convolve_with_slit = original
+    s.conditions['slit_convolution'] = method
+    return s
+
+
+def compare_convolution(s, slit_function, unit='nm', method='auto', verbose=True, **kwargs):
+    ''' Compare :func:`~radis_tools.slit.apply_slit` with ``method`` to the
+    direct convolution of RADIS, on copies of Spectrum ``s``
+
+    Returns
+    -------
+
+    out: dict
+        ``'error'``: maximum difference of each convolved quantity, relative to its
+        maximum; ``'time_direct'``, ``'time'``: time of the direct convolution and
+        of ``method`` (s)
+    '''
+    s_direct = s.copy()
+    t0 = time()
+    s_direct.apply_slit(slit_function, unit=unit, **kwargs)
+    time_direct = time() - t0
+
+    s_method = s.copy()
+    t0 = time()
+    apply_slit(s_method, slit_function, unit=unit, method=method, **kwargs)
+    time_method = time() - t0
+
+    error = {}
+    for var in s_direct.get_vars():
+        if var.endswith('_noslit') or var + '_noslit' not in s_direct.get_vars():
+            continue
+        w_ref, I_ref = s_direct.get(var, wunit=s.get_waveunit(), copy=False)
+        w, I = s_method.get(var, wunit=s.get_waveunit(), copy=False)
+        if len(w) != len(w_ref):
+            raise ValueError('Convolved grids differ for {0}: {1} and {2} points'.format(
+                             var, len(w_ref), len(w)))
+        error[var] = np.abs(I - I_ref).max() / np.abs(I_ref).max()
+    if verbose:
+        for var, e in error.items():
+            print('{0}: max. relative difference {1:.1e}'.format(var, e))
+        print('Direct: {0:.3f}s, {1}: {2:.3f}s'.format(time_direct, method, time_method))
+    return {'error': error, 'time_direct': time_direct, 'time': time_method}
@@ -0,0 +1,317 @@
+# -*- coding: utf-8 -*-
+"""
+Binary spectrum files, loaded lazily.
+
+:py:func:`~radis.tools.database.load_spec` parses the whole JSON of a ``.spec``
+file and creates all its spectral arrays, even if only one quantity of a small
+range is used afterwards. For archives of thousands of spectra, opening them
+costs more than using them.
+
+:func:`~radis_tools.specfile.store_spec` writes a Spectrum in an HDF5 file
+(``.h5``): conditions and units as attributes, and one compressed, chunked
+dataset per spectral quantity. :func:`~radis_tools.specfile.load_spec` reads
+the attributes only: quantities are read from the file the first time they are
+accessed (e.g. by ``s.get()`` or ``s.plot()``), and only in the range of the
+Spectrum once cropped with :func:`~radis_tools.specfile.crop` (or with
+``wmin, wmax`` when loading). Other files are read and written by RADIS.
+
+Layout of the HDF5 file::
+
+    /            attributes: format, version, conditions, cond_units, units (JSON), name
+    /q/          non convoluted quantities, and their 'wavespace'
+    /q_conv/     convoluted quantities, and their 'wavespace'
+    /slit/       slit function ('wavespace', 'intensity'), if any
+
+Notes
+-----
+
+Lines and populations are not stored, as in ``s.store(discard=['lines', 'populations'])``.
+The file is opened again for each quantity read: a lazily loaded Spectrum
+keeps no file open, but its file must stay in place until all the quantities
+used are read.
+
+"""
+
+from __future__ import print_function, absolute_import, division
+
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from os.path import splitext
+import h5py
+import json_tricks
+import numpy as np
+from radis import Spectrum
+import radis.tools.database
+from radis.spectrum.operations import crop as radis_crop
+
+#: written in the ``format`` attribute of the files
+FORMAT = 'radis_tools.specfile'
+VERSION = 1
+#: points per chunk of the datasets: the unit of the partial reads
+CHUNK_POINTS = 2 ** 14
+
+
+class LazyQuantities(MutableMapping):
+    ''' Quantities of a group of a spectrum file, read from the file when first
+    accessed. Replaces the ``_q`` or ``_q_conv`` dictionary of a Spectrum.
+
+    A mapping, not a dict subclass: every access (``q[k]``, ``q.items()``,
+    ``dict(q)``, ``{**q}``...) goes through ``__getitem__`` and reads the
+    quantities not read yet.
+
+    Parameters
+    ----------
+
+    file: str
+        HDF5 file written by :func:`~radis_tools.specfile.store_spec`
+
+    group: ``'q'``, ``'q_conv'``
+
+    names: list of str
+        quantities of the group, with ``'wavespace'``
+
+    window: slice
+        range of the datasets read, see :meth:`~radis_tools.specfile.LazyQuantities.crop`
+
+    '''
+
+    def __init__(self, file, group, names, window=slice(0, None)):
+        self._arrays = OrderedDict((k, None) for k in names)     # None: not read yet
+        self.file = file
+        self.group = group
+        self.window = window
+
+    def __getitem__(self, k):
+        I = self._arrays[k]
+        if I is None:
+            with h5py.File(self.file, 'r') as f:
+                I = f[self.group][k][self.window]
+            self._arrays[k] = I
+        return I
+
+    def __setitem__(self, k, I):
+        self._arrays[k] = I
+
+    def __delitem__(self, k):
+        del self._arrays[k]
+
+    def __iter__(self):
+        return iter(self._arrays)
+
+    def __len__(self):
+        return len(self._arrays)
+
+    def __contains__(self, k):
+        return k in self._arrays     # without reading it
+
+    def __repr__(self):
+        return 'LazyQuantities({0}:/{1}, read: {2}/{3})'.format(
+               self.file, self.group, len(self.loaded()), len(self))
+
+    def copy(self):
+        return {k: self[k] for k in self}
+
+    def __reduce__(self):
+        # pickled and deep-copied as a plain dict
+        return (dict, (self.copy(),))
+
+    def loaded(self):
+        ''' Names of the quantities already read '''
+        return [k for k, I in self._arrays.items() if I is not None]
+
+    def crop(self, start, stop):
+        ''' Keep points ``start:stop`` of the current window. Quantities already
+        read are sliced, the others will only be read in the new window. '''
+        offset = self.window.start
+        self.window = slice(offset + start, offset + stop)
+        for k in self.loaded():
+            self._arrays[k] = self._arrays[k][start:stop].copy()
+
+    def view(self):
+        ''' Another LazyQuantities of the same file and window. Quantities
+        already read are shared. '''
+        out = LazyQuantities(self.file, self.group, list(self), self.window)
+        out._arrays.update((k, self._arrays[k]) for k in self.loaded())
+        return out
+
+
+def _is_lazy(s):
+    return any(isinstance(q, LazyQuantities) and len(q) for q in [s._q, s._q_conv])
+
+
+def _view(q):
+    return q.view() if isinstance(q, LazyQuantities) else dict(q)
+
+
+def make_spectrum(q, q_conv, conditions, units, cond_units, name, file, slit={}):
+    ''' A Spectrum with the quantity dictionaries ``q`` and ``q_conv``, as is
+
+    The Spectrum constructor reads and copies the arrays of all quantities: it
+    is called with a 2-point placeholder quantity, whose dictionaries are then
+    replaced by ``q`` and ``q_conv``. '''
+    s = Spectrum({'abscoeff': (np.arange(2.), np.zeros(2))}, units={'abscoeff': 'cm-1'},
+                 conditions=conditions, cond_units=cond_units, name=name, warnings=False)
+    s._q = q
+    s._q_conv = q_conv
+    s._slit = dict(slit)
+    s.units = units
+    s.file = file
+    return s
+
+
+def store_spec(s, file, compression='gzip', **kwargs):
+    ''' Store Spectrum ``s`` in ``file``. HDF5 file, read lazily by
+    :func:`~radis_tools.specfile.load_spec`, unless ``file`` ends with ``.spec``.
+
+    Parameters
+    ----------
+
+    s: :class:`~radis.spectrum.spectrum.Spectrum`
+
+    file: str
+        ``.h5`` file, replaced if it exists. If ``.spec``, stored by
+        :py:meth:`~radis.spectrum.spectrum.Spectrum.store` with ``kwargs``
+
+    compression: ``'gzip'``, ``'lzf'``, int (gzip level), or ``None``
+        compression of the spectral arrays. ``'lzf'`` is faster, ``'gzip'``
+        is smaller.
+
+    Returns
+    -------
+
+    file: str
+        name of the stored file
+
+    Examples
+    --------
+
+    ::
+
+        store_spec(s, 'co2_300K.h5')
+        s2 = load_spec('co2_300K.h5')           # conditions only
+        s2.plot('radiance_noslit')              # reads radiance_noslit
+
+    '''
+    if splitext(file)[1] == '.spec':
+        return s.store(file, **kwargs)
+    if kwargs:
+        raise ValueError('Unexpected arguments for an HDF5 file: {0}'.format(list(kwargs)))
+    opts = {}
+    if compression is not None:
+        if isinstance(compression, int):
+            opts = dict(compression='gzip', compression_opts=compression)
+        else:
+            opts = dict(compression=compression)
+        opts['shuffle'] = True      # bytes of floats grouped: compresses better
+
+    # ... conditions that cannot be written in JSON are discarded, as by s.store()
+    conditions = {k: v for k, v in s.conditions.items() if radis.tools.database.is_jsonable(v)}
+    with h5py.File(file, 'w') as f:
+        f.attrs['format'] = FORMAT
+        f.attrs['version'] = VERSION
+        f.attrs['conditions'] = json_tricks.dumps(conditions)
+        f.attrs['cond_units'] = json_tricks.dumps(s.cond_units or {})
+        f.attrs['units'] = json_tricks.dumps(s.units or {})
+        f.attrs['name'] = json_tricks.dumps(s.name)
+        for group, q in [('q', s._q), ('q_conv', s._q_conv), ('slit', s._slit)]:
+            g = f.create_group(group)
+            for k, v in q.items():
+                v = np.asarray(v)
+                g.create_dataset(k, data=v, chunks=(max(min(len(v), CHUNK_POINTS), 1),),
+                                 **opts)
+    return file
+
+
+def load_spec(file, wmin=None, wmax=None, wunit='default', lazy=True, **kwargs):
+    ''' Load a Spectrum stored by :func:`~radis_tools.specfile.store_spec`. Conditions
+    are read, quantities are read from the file when they are first used.
+
+    Parameters
+    ----------
+
+    file: str
+        HDF5 file, or ``.spec`` file (read by :py:func:`~radis.tools.database.load_spec`
+        with ``kwargs``)
+
+    wmin, wmax: float, or ``None``
+        if given, the Spectrum is cropped, see :func:`~radis_tools.specfile.crop`:
+        only this range of the quantities is read
+
+    wunit: ``'nm'``, ``'cm-1'``, or ``'default'``
+        unit of ``wmin, wmax``. If ``'default'``, waveunit of the Spectrum
+
+    lazy: bool
+        if ``False``, all quantities are read
+
+    Returns
+    -------
+
+    s: :class:`~radis.spectrum.spectrum.Spectrum`
+
+    Examples
+    --------
+
+    ::
+
+        s = load_spec('co2_300K.h5', 4000, 4200, 'nm')     # reads only 4000-4200 nm
+
+    '''
+    if not h5py.is_hdf5(file):
+        s = radis.tools.database.load_spec(file, **kwargs)
+    else:
+        if kwargs:
+            raise ValueError('Unexpected arguments for an HDF5 file: {0}'.format(list(kwargs)))
+        with h5py.File(file, 'r') as f:
+            if f.attrs.get('format') != FORMAT:
+                raise ValueError('{0} is not a spectrum file of {1}'.format(file, FORMAT))
+            conditions = json_tricks.loads(f.attrs['conditions'])
+            cond_units = json_tricks.loads(f.attrs['cond_units'])
+            units = json_tricks.loads(f.attrs['units'])
+            name = json_tricks.loads(f.attrs['name'])
+            names = {group: list(f[group].keys()) for group in ['q', 'q_conv']}
+            slit = {k: v[()] for k, v in f['slit'].items()}
+        q, q_conv = [LazyQuantities(file, group, names[group]) for group in ['q', 'q_conv']]
+        s = make_spectrum(q, q_conv, conditions, units, cond_units, name, file, slit)
+
+    if wmin is not None or wmax is not None:
+        crop(s, wmin, wmax, wunit)
+    if not lazy:
+        _load_all(s)
+    return s
+
+
+def _load_all(s):
+    for q in [s._q, s._q_conv]:
+        for k in q:
+            q[k]
+    s._q, s._q_conv = dict(s._q), dict(s._q_conv)
+    return s
+
+
+def crop(s, wmin=None, wmax=None, wunit='default', inplace=True):
+    ''' Same as :py:meth:`~radis.spectrum.spectrum.Spectrum.crop`. On a
+    Spectrum loaded by :func:`~radis_tools.specfile.load_spec`, quantities
+    not read yet will only be read in the cropped range. '''
+    if wunit == 'default':
+        wunit = s.get_waveunit()
+    if not _is_lazy(s):
+        return radis_crop(s, wmin, wmax, wunit, inplace=inplace)
+    if len(s._q) > 0 and len(s._q_conv) > 0:
+        raise NotImplementedError('Cant crop this Spectrum as there are both convoluted '
+                                  'and not convoluted quantities stored')
+    if not inplace:
+        s = make_spectrum(_view(s._q), _view(s._q_conv), dict(s.conditions), dict(s.units),
+                          dict(s.cond_units), s.name, s.file, s._slit)
+    for q in [s._q, s._q_conv]:
+        if len(q) == 0:
+            continue
+        # ... RADIS crop (units, air/vacuum, boundaries) of the indices of the wavespace
+        w = q['wavespace']
+        s_index = make_spectrum({'wavespace': w, 'index': np.arange(len(w))}, {},
+                                {'waveunit': s.get_waveunit()}, {}, {}, None, None)
+        index = radis_crop(s_index, wmin, wmax, wunit, inplace=True)._q['index']
+        if len(index):
+            q.crop(index.min(), index.max() + 1)
+        else:
+            q.crop(0, 0)
+    return s
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+"""
+Compact storage of many spectra on the same grid: reduced precision, shared
+arrays.
+
+A layer Spectrum of :func:`~radis_tools.layers.calc_layers` holds 6 float64
+quantities and its own copy of the wavenumber grid: 9.3 MB on the 166k-point
+grid of the radiative forcing example, and ``slab.copy()`` before
+``rescale_mole_fraction()`` duplicates all of them.
+
+- :func:`~radis_tools.storage.compact` stores the quantities in float32, and
+  makes spectra on the same grid share one wavespace array (4.0 MB per layer
+  in the example above). Quantities recalculated by RADIS afterwards (e.g.
+  ``radiance_noslit`` in ``rescale_*``) can be float64 again: compact them again.
+- :func:`~radis_tools.storage.copy_view` is a copy that shares the arrays of
+  the original Spectrum. ``rescale_*`` methods do not modify arrays: they
+  replace them with the rescaled ones, which are the only new arrays. Shared
+  arrays are made read-only in both spectra, so that in-place operations
+  (e.g. ``s *= 2``) raise an error instead of changing the other one: the
+  original Spectrum stays read-only after the copy is discarded.
+- :func:`~radis_tools.storage.compare_precision` is the accuracy check: a
+  result (e.g. the line-of-sight) calculated from float32 spectra is compared
+  to the float64 one.
+
+Notes
+-----
+
+Accuracy check on the 4.3 µm CO2 band (``HITEMP-CO2-TEST``, 4668 points), the
+87 layers of the 1976 Standard Atmosphere at 400 ppm, and the irradiance of
+:func:`~radis_tools.los.calc_irradiance` (4 angles) over a 288 K ground:
+
+=================================  ==========================  ==========================
+float32 vs float64                 max. difference (/ max)     integral (relative)
+=================================  ==========================  ==========================
+irradiance (``radiance_noslit``)   1.2e-08                     1.1e-10
+=================================  ==========================  ==========================
+
+Errors are those of the float32 rounding of the layer quantities (~6e-8):
+the transfer itself is solved in float64 by :func:`~radis_tools.los.calc_irradiance`.
+With ``SerialSlabs(s_earth_0, *slabs)``, which multiplies the float32
+transmittances, the radiance differs by 7e-07.
+They are orders of magnitude below the radiative forcing of a CO2 change
+(~1% of the irradiance). Layer memory goes from 261 kB to 112 kB.
+Run :func:`~radis_tools.storage.compare_precision` on a profile to check a
+new case.
+
+"""
+
+from __future__ import print_function, absolute_import, division
+
+from copy import deepcopy
+import numpy as np
+from .specfile import make_spectrum
+
+
+def _read_only(I):
+    I.flags.writeable = False
+    return I
+
+
+def compact(spectra, dtype='float32'):
+    ''' Store the quantities of ``spectra`` in ``dtype``, and share the wavespace
+    arrays of spectra on the same grid. Modifies the spectra.
+
+    Parameters
+    ----------
+
+    spectra: list of :class:`~radis.spectrum.spectrum.Spectrum`
+
+    dtype: str, or numpy dtype
+        e.g. ``'float32'``. The wavespace stays in float64, and is made read-only.
+
+    Returns
+    -------
+
+    spectra: list of :class:`~radis.spectrum.spectrum.Spectrum`
+        the same spectra, ``conditions['storage_dtype']`` set to ``dtype``
+
+    Examples
+    --------
+
+    ::
+
+        slabs = compact(calc_layers(sf, ...))
+        print(compare_precision(slabs, lambda slabs: calc_irradiance(slabs, source=s_earth_0)))
+
+    '''
+    dtype = np.dtype(dtype)
+    grids = []
+    for s in spectra:
+        for q in [s._q, s._q_conv]:
+            for k in list(q.keys()):
+                if k == 'wavespace':
+                    for w in grids:
+                        if len(w) == len(q[k]) and np.array_equal(w, q[k]):
+                            q[k] = w
+                            break
+                    else:
+                        grids.append(_read_only(q[k]))
+                elif q[k].dtype != dtype:
+                    q[k] = q[k].astype(dtype)
+        s.conditions['storage_dtype'] = dtype.name
+    return spectra
+
+
+def copy_view(s, quantity='all'):
+    ''' Same as :py:meth:`~radis.spectrum.spectrum.Spectrum.copy`, but the
+    copy shares the spectral arrays of ``s`` (made read-only), until they are
+    replaced, e.g. by ``rescale_*`` methods
+
+    The arrays are made read-only in ``s`` too, and stay read-only: in-place
+    operations on ``s`` (e.g. ``s *= 2``) raise a ``ValueError`` afterwards.
+    ``rescale_*`` methods still work on ``s``, as they replace the arrays. Use
+    :py:meth:`~radis.spectrum.spectrum.Spectrum.copy` if ``s`` must stay writable.
+
+    Parameters
+    ----------
+
+    s: :class:`~radis.spectrum.spectrum.Spectrum`
+
+    quantity: str, list of str, or ``'all'``
+        quantities of the copy. Fewer quantities: less to rescale.
+
+    Returns
+    -------
+
+    s: :class:`~radis.spectrum.spectrum.Spectrum`
+
+    Examples
+    --------
+
+    ::
+
+        s278 = copy_view(slabs[i], 'abscoeff')      # no array copied
+        s278.rescale_mole_fraction(278e-6)          # only abscoeff is rescaled
+
+    '''
+    if quantity != 'all' and isinstance(quantity, str):
+        quantity = [quantity]
+    groups = []
+    for q in [s._q, s._q_conv]:
+        keys = [k for k in q.keys() if quantity == 'all' or k in quantity]
+        groups.append({k: _read_only(q[k]) for k in ['wavespace'] + keys if k in q} if keys else {})
+    if quantity != 'all' and not any(groups):
+        raise KeyError('{0} not in {1}'.format(quantity, s.get_vars()))
+    units = {k: u for k, u in s.units.items() if quantity == 'all' or k in quantity}
+    return make_spectrum(groups[0], groups[1], deepcopy(s.conditions), units,
+                         deepcopy(s.cond_units), s.name, s.file, s._slit)
+
+
+def memory_usage(spectra):
+    ''' Memory of the spectral arrays of ``spectra`` (bytes). Arrays shared
+    between spectra are counted once. '''
+    buffers = {}
+    for s in spectra:
+        for q in [s._q, s._q_conv]:
+            for k in q:
+                I = q[k]
+                while isinstance(I.base, np.ndarray):
+                    I = I.base
+                buffers[id(I)] = I.nbytes
+    return sum(buffers.values())
+
+
+def compare_precision(spectra, solve, dtype='float32', verbose=True):
+    ''' Compare ``solve(spectra)`` calculated from ``spectra`` stored in ``dtype``
+    (see :func:`~radis_tools.storage.compact`) to the result in full precision.
+    ``spectra`` are not modified: the reduced-precision spectra are compacted
+    copies.
+
+    Parameters
+    ----------
+
+    spectra: list of :class:`~radis.spectrum.spectrum.Spectrum`
+        in full precision
+
+    solve: function
+        ``solve(spectra)`` returns a Spectrum, e.g. ``lambda slabs: SerialSlabs(*slabs)``
+
+    Returns
+    -------
+
+    out: dict
+        ``'error'``: maximum difference of each quantity, relative to its maximum;
+        ``'integral_error'``: relative difference of the integral of each quantity
+    '''
+    s_ref = solve(spectra)
+    s = solve(compact([s.copy() for s in spectra], dtype))
+
+    error = {}
+    integral_error = {}
+    for var in s_ref.get_vars():
+        w_ref, I_ref = s_ref.get(var, wunit='cm-1', copy=False)
+        w, I = s.get(var, wunit='cm-1', copy=False)
+        error[var] = np.abs(I - I_ref).max() / np.abs(I_ref).max()
+        integral_error[var] = abs(np.trapz(I, w) / np.trapz(I_ref, w_ref) - 1)
+    if verbose:
+        for var in error:
+            print('{0} ({1}): max. relative difference {2:.1e}, integral {3:.1e}'.format(
+                  var, np.dtype(dtype).name, error[var], integral_error[var]))
+    return {'error': error, 'integral_error': integral_error}
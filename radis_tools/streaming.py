@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+"""
+Out-of-core spectrum calculation within a memory limit.
+
+The memory of a line-by-line calculation scales with the number of lines of
+the spectral range: :py:meth:`~radis.lbl.factory.SpectrumFactory.load_databank`
+loads all of them, and each calculation copies them and adds populations,
+intensities and broadening widths, before the lineshapes are calculated.
+For HITEMP CO2 at 4000 K this is several GB, and ``chunksize`` only splits the
+last step.
+
+:func:`~radis_tools.streaming.calc_streamed` reads the lines from a
+:class:`~radis_tools.linedb.LineDatabaseCache` in chunks, calculates each
+chunk with the SpectrumFactory, and adds the absorption and emission
+coefficients of the chunks on the spectral grid (coefficients of lines add
+up). Transmittance and radiance of the slab are calculated once, at the end.
+
+The chunk size is chosen automatically: the memory allocated while
+calculating a chunk is measured with :py:mod:`tracemalloc`, and the next
+chunk is sized from the memory used per line. Without the DLM, the
+``chunksize`` of the lineshape calculation is reduced to fit the limit too.
+The peak memory is stored in the conditions of the spectrum.
+
+Notes
+-----
+
+The limit applies to the memory allocated by the calculation. The Python
+interpreter and the loaded modules (a few hundred MB) come on top. Partition
+functions and energy levels are initialized once, with the first chunk: their
+memory is counted, but cannot be split.
+
+With ``optimization=None`` the result is identical to a single calculation,
+to rounding errors. With the DLM, the lineshape database depends on the lines
+of each chunk: differences are within the DLM accuracy.
+
+"""
+
+from __future__ import print_function, absolute_import, division
+
+import re
+import tracemalloc
+import warnings
+from time import time
+import numpy as np
+from radis import Spectrum
+from radis.misc.progress_bar import ProgressBar
+from radis.phys.blackbody import planck
+from radis.phys.convert import cm2nm
+from .layers import get_wavenumber_grid
+from .linedb import load_databank, open_databank_cache
+from .los import slab_quantities
+
+#: bytes per line, first guess before the memory per line is measured on the first chunk
+BYTES_PER_LINE = 4000
+#: lines of the first chunk, which also initializes partition functions and energies
+FIRST_CHUNK_LINES = 1000
+#: bytes per (line x spectral point) of the lineshape calculation without the DLM
+BYTES_PER_BROADENED_POINT = 64
+#: spectral arrays (of the size of the spectral grid) allocated for each chunk
+SPECTRAL_ARRAYS = 24
+#: fraction of the free memory used by each chunk
+SAFETY = 0.8
+
+
+def parse_memory(size):
+    ''' Memory size in bytes, from a number of MB or a string such as
+    ``'4GB'``, ``'500 MB'``, ``'2GiB'`` '''
+    if not isinstance(size, str):
+        return float(size) * 1e6
+    match = re.match(r'^\s*([\d.]+)\s*([kMGT]?)(i?)B\s*$', size, re.IGNORECASE)
+    if match is None:
+        raise ValueError('Cannot read memory size: {0}. Use e.g. 4GB'.format(size))
+    value, prefix, binary = match.groups()
+    power = ' KMGT'.index(prefix.upper() or ' ')
+    return float(value) * (1024 if binary else 1000) ** power
+
+
+def calc_streamed(sf, databank, memory_limit, method='eq_spectrum', folder=None,
+                  databank_kwargs={}, verbose=True, **kwargs):
+    ''' Calculate a spectrum with the lines of ``databank`` streamed in chunks,
+    within ``memory_limit``
+
+    Equivalent to::
+
+        sf.load_databank(databank, **databank_kwargs)
+        s = getattr(sf, method)(**kwargs)
+
+    Parameters
+    ----------
+
+    sf: :class:`~radis.lbl.factory.SpectrumFactory`
+        spectral range and calculation parameters. Its line database is
+        replaced by the chunks, and is not loaded anymore afterwards.
+
+    databank: str
+        databank name in the RADIS configuration file (``~/.radis``), e.g.
+        ``'HITEMP-CO2'``. Its line cache is built at the first use, see
+        :func:`~radis_tools.linedb.open_databank_cache`.
+
+    memory_limit: float, or str
+        memory allocated by the calculation, in MB, or as a string, e.g. ``'4GB'``
+
+    method: str
+        SpectrumFactory method, e.g. ``'eq_spectrum'``, ``'non_eq_spectrum'``
+
+    Other Parameters
+    ----------------
+
+    folder: str, or ``None``
+        line cache folder, see :func:`~radis_tools.linedb.load_databank`
+
+    databank_kwargs: dict
+        arguments of :py:meth:`~radis.lbl.factory.SpectrumFactory.load_databank`
+
+    kwargs: dict
+        arguments of ``method``, e.g. ``Tgas=4000, path_length=1``
+
+    Returns
+    -------
+
+    s: :class:`~radis.spectrum.spectrum.Spectrum`
+        with ``abscoeff``, ``emisscoeff``, ``absorbance``, ``transmittance_noslit``
+        and ``radiance_noslit``. ``s.conditions['peak_memory']`` is the peak
+        memory allocated by the calculation (MB), and ``s.conditions['line_chunks']``
+        the number of chunks.
+
+    Raises
+    ------
+
+    MemoryError
+        if the spectral arrays alone do not fit in ``memory_limit``
+
+    Examples
+    --------
+
+    ::
+
+        sf = SpectrumFactory(wavelength_min=4000, wavelength_max=5000, wstep=0.01,
+                             isotope='1')
+        s = calc_streamed(sf, 'HITEMP-CO2', '4GB', Tgas=4000, pressure=1,
+                          mole_fraction=0.027, path_length=1)
+        print(s.conditions['peak_memory'], 'MB')
+
+    '''
+
+    t0 = time()
+    budget = parse_memory(memory_limit)
+    cache = open_databank_cache(databank, folder=folder, verbose=verbose)
+    isotopes = None
+    if sf.input.isotope != 'all':
+        isotopes = [int(k) for k in sf.input.isotope.split(',')]
+    spans = cache.spans(sf.params.wavenum_min_calc, sf.params.wavenum_max_calc, isotopes)
+    n_lines = sum(j - i for (_, i, j) in spans)
+    if n_lines == 0:
+        raise ValueError('{0} has 0 lines in range {1:.2f}-{2:.2f}cm-1'.format(
+                         databank, sf.params.wavenum_min_calc, sf.params.wavenum_max_calc))
+
+    fixed = SPECTRAL_ARRAYS * len(get_wavenumber_grid(sf)) * 8
+    if fixed > budget:
+        raise MemoryError('The spectral arrays alone need {0:.0f} MB: '.format(fixed / 1e6) +
+                          'increase memory_limit, or reduce the spectral range')
+
+    tracing = tracemalloc.is_tracing()
+    if not tracing:
+        tracemalloc.start()
+    start = tracemalloc.get_traced_memory()[0]
+    tracemalloc.reset_peak()
+
+    # ... without the DLM, limit the (lines x spectral points) broadened at once
+    chunksize = sf.misc.chunksize
+    if sf.params.optimization is None:
+        limit = budget / 4 / BYTES_PER_BROADENED_POINT
+        sf.misc.chunksize = limit if chunksize is None else min(chunksize, limit)
+
+    bytes_per_line = BYTES_PER_LINE
+    coefficients = {}
+    columns = None
+    peak = 0
+    n_chunks = 0
+    n_done = 0
+    sums = {}
+    if verbose:
+        print('Streaming {0} lines of {1} within {2:.0f} MB'.format(n_lines, databank,
+                                                                    budget / 1e6))
+        pb = ProgressBar(n_lines)
+    try:
+        for (partition, i, j) in spans:
+            while i < j:
+                current = tracemalloc.get_traced_memory()[0]
+                free = budget - (current - start) - fixed
+                n = min(int(SAFETY * free / bytes_per_line), j - i)
+                if n_chunks == 0:
+                    n = min(n, FIRST_CHUNK_LINES)
+                if n < 1:
+                    raise MemoryError('memory_limit reached with {0:.0f} MB '.format(
+                                      (current - start) / 1e6) + 'allocated. Increase it')
+                tracemalloc.reset_peak()
+
+                lines = cache.read(partition, i, i + n, columns)
+                if n_chunks == 0:
+                    # partition functions and energies are initialized once
+                    load_databank(sf, databank, folder=folder, lines=lines, verbose=False,
+                                  **databank_kwargs)
+                    columns = [k for k in sf.df0.columns if k in cache.columns]
+                    # ... and are not counted in the memory per line
+                    peak = max(peak, tracemalloc.get_traced_memory()[1] - start)
+                    tracemalloc.reset_peak()
+                    current = (tracemalloc.get_traced_memory()[0]
+                               - sf.df0.memory_usage(index=False).sum())
+                else:
+                    sf._fetch_molecular_parameters(lines)
+                    sf.df0 = lines
+                del lines
+                s = getattr(sf, method)(**kwargs)
+                sf.df0 = sf.df1 = None      # ... before the next chunk is read
+
+                for var in ['abscoeff', 'emisscoeff']:
+                    if var not in s.get_vars():
+                        continue
+                    w, I = s.get(var, wunit='cm-1', copy=False)
+                    if var in coefficients:
+                        coefficients[var] += I
+                    else:
+                        coefficients[var] = np.array(I)
+                for k in ['lines_calculated', 'lines_cutoff']:
+                    if k in s.conditions:
+                        sums[k] = sums.get(k, 0) + s.conditions[k]
+                last = s
+                del s
+
+                used = tracemalloc.get_traced_memory()[1] - current
+                peak = max(peak, tracemalloc.get_traced_memory()[1] - start)
+                bytes_per_line = max((used - fixed) / n, BYTES_PER_LINE / 40)
+                i += n
+                n_chunks += 1
+                n_done += n
+                if verbose:
+                    pb.update(n_done)
+    finally:
+        sf.misc.chunksize = chunksize
+        if not tracing:
+            tracemalloc.stop()
+    if verbose:
+        pb.done()
+
+    conditions = dict(last.conditions)
+    conditions.update(sums)
+    L = conditions['path_length']
+    units = {var: last.units[var] for var in coefficients}
+    if 'emisscoeff' not in coefficients and conditions.get('thermal_equilibrium'):
+        # ... equilibrium spectra of RADIS have no emission coefficient: Kirchhoff's law
+        B = planck(cm2nm(w), conditions['Tgas'], unit='mW/sr/cm2/nm')
+        coefficients['emisscoeff'] = coefficients['abscoeff'] * B
+        units['emisscoeff'] = 'mW/cm3/sr/nm'
+    quantities = {var: (w, I) for var, I in coefficients.items()}
+    if 'abscoeff' in coefficients:
+        quantities['absorbance'] = (w, coefficients['abscoeff'] * L)
+        units['absorbance'] = '-ln(I/I0)'
+    if 'emisscoeff' in coefficients:
+        if 'abscoeff' in coefficients and conditions.get('self_absorption', True):
+            T, radiance = slab_quantities(coefficients['abscoeff'],
+                                          coefficients['emisscoeff'], L)
+            quantities['transmittance_noslit'] = (w, T)
+            units['transmittance_noslit'] = ''
+        else:
+            radiance = coefficients['emisscoeff'] * L
+        quantities['radiance_noslit'] = (w, radiance)
+        units['radiance_noslit'] = units['emisscoeff'].replace('cm3', 'cm2')
+
+    conditions.update({'memory_limit': budget / 1e6,
+                       'peak_memory': peak / 1e6,
+                       'line_chunks': n_chunks,
+                       'calculation_time': time() - t0})
+    cond_units = dict(last.cond_units, memory_limit='MB', peak_memory='MB')
+    if peak > budget:
+        warnings.warn('Peak memory ({0:.0f} MB) exceeded memory_limit ({1:.0f} MB)'.format(
+                      peak / 1e6, budget / 1e6))
+    if verbose:
+        print('Calculated {0} lines in {1} chunks. Peak memory: {2:.0f} MB ({3:.1f}s)'.format(
+              n_lines, n_chunks, peak / 1e6, time() - t0))
+
+    return Spectrum(quantities, units, conditions=conditions, cond_units=cond_units,
+                    waveunit='cm-1', name=last.get_name())
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""
+Parallel, resumable sweeps: run the same calculation for many keys (e.g. all
+molecules of a database) in a process pool, and keep track of each of them in
+a manifest file.
+
+The manifest is a ``.json`` file with, for every key, its ``status``
+(``'done'`` or ``'failed'``), the ``calculation_time`` and number of
+``lines`` returned by the calculation, and the ``error`` message if it failed.
+It is updated after every completed calculation, so an interrupted sweep is
+resumed where it stopped: entries already done are skipped, and only the
+failed ones are retried. Entries without a manifest entry whose output file
+already exists (e.g. from a sweep run before the manifest) are recorded as
+done, without calculating them again.
+
+"""
+
+from __future__ import print_function, absolute_import, division
+
+import json
+import os
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from os.path import exists
+import pandas as pd
+from radis.misc.progress_bar import ProgressBar
+
+
+class SweepManifest(object):
+    ''' Status of every entry of a sweep, stored in a ``.json`` file
+
+    Parameters
+    ----------
+
+    filename: str
+        manifest file. Loaded if it exists.
+
+    Examples
+    --------
+
+    ::
+
+        manifest = SweepManifest('out/manifest.json')
+        print(manifest.summary())
+
+    '''
+
+    def __init__(self, filename):
+
+        self.filename = filename
+        if exists(filename):
+            with open(filename) as f:
+                self.entries = json.load(f)
+        else:
+            self.entries = {}
+
+    def pending(self, keys, retry_failed=True):
+        ''' Keys that still have to be calculated: not done yet, or failed if
+        ``retry_failed`` '''
+        statuses = ['done'] if retry_failed else ['done', 'failed']
+        return [k for k in keys if self.entries.get(k, {}).get('status') not in statuses]
+
+    def update(self, key, **entry):
+        ''' Set the entry of ``key`` and save the manifest '''
+        self.entries[key] = entry
+        self.save()
+
+    def save(self):
+        ''' Write the manifest, without leaving a truncated file if interrupted '''
+        with open(self.filename + '.tmp', 'w') as f:
+            json.dump(self.entries, f, indent=2)
+        os.replace(self.filename + '.tmp', self.filename)
+
+    def summary(self):
+        ''' Return all entries as a pandas DataFrame, one row per key '''
+        return pd.DataFrame.from_dict(self.entries, orient='index')
+
+
+def run_sweep(task, keys, manifest, max_workers=None, retry_failed=True, output=None,
+              verbose=True):
+    ''' Run ``task(key)`` for all keys that are not done yet, in a process pool
+
+    Parameters
+    ----------
+
+    task: function
+        called with one key. Must be defined at the module level (to be sent to
+        the worker processes). Returns a dict, stored in the manifest, that
+        may include ``'calculation_time'`` and ``'lines'``. Exceptions are
+        caught, and stored in the manifest as failed entries.
+
+    keys: list of str
+        all entries of the sweep, e.g. ``MOLECULES_LIST_EQUILIBRIUM``
+
+    manifest: :class:`~radis_tools.sweep.SweepManifest`, or str
+        manifest, or its filename
+
+    Other Parameters
+    ----------------
+
+    max_workers: int, or ``None``
+        number of processes. If ``None``, use all processors.
+
+    retry_failed: bool
+        if ``True``, also run the entries that failed in a previous sweep.
+        Default ``True``.
+
+    output: function, or ``None``
+        ``output(key)`` is the output file of a key. Keys not in the manifest
+        whose output file exists are recorded as done, and not calculated.
+
+    Returns
+    -------
+
+    manifest: :class:`~radis_tools.sweep.SweepManifest`
+
+    Notes
+    -----
+
+    On Windows, guard the calling code with ``if __name__ == '__main__':``
+
+    '''
+
+    if not isinstance(manifest, SweepManifest):
+        manifest = SweepManifest(manifest)
+    if output is not None:
+        for k in keys:
+            if k not in manifest.entries and exists(output(k)):
+                manifest.update(k, status='done', error=None, output=output(k),
+                                calculation_time=None, lines=None)
+    pending = manifest.pending(keys, retry_failed=retry_failed)
+    if verbose:
+        print('{0} entries to calculate ({1} already done)'.format(
+              len(pending), len(keys) - len(pending)))
+    if len(pending) == 0:
+        return manifest
+
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        futures = {}
+        for k in pending:
+            futures[pool.submit(task, k)] = k
+        if verbose:
+            pb = ProgressBar(len(futures))
+        for n, future in enumerate(as_completed(futures)):
+            k = futures[future]
+            try:
+                entry = dict(future.result() or {})
+                entry['status'] = 'done'
+                entry['error'] = None
+            except Exception as err:
+                entry = {'status': 'failed',
+                         'error': ''.join(traceback.format_exception_only(type(err), err)).strip()}
+                if verbose:
+                    print('Error with {0}: {1}'.format(k, entry['error']))
+            manifest.update(k, **entry)
+            if verbose:
+                pb.update(n)
+        if verbose:
+            pb.done()
+
+    if verbose:
+        failed = manifest.pending(keys, retry_failed=True)
+        print('Sweep done: {0} done, {1} failed'.format(len(keys) - len(failed), len(failed)))
+    return manifest
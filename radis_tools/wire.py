@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""
+Binary format of the spectra sent by the spectrum service
+(:py:mod:`radis_tools.service`) to its client (``radis_client.py``).
+
+Responses of ``/calc_spectrum`` are::
+
+    b'RDSP' | header length (uint32, little-endian) | header (JSON) | arrays
+
+The header has the conditions, units, name and waveunit of the Spectrum, and
+``arrays``: a list of ``[name, dtype, length]`` of the raw arrays that follow,
+in order (``'q/wavespace'``, ``'q/abscoeff'``, ... ``'q_conv/radiance'``).
+
+Notes
+-----
+
+This module imports the standard library and numpy only: the client loads it
+without importing RADIS.
+
+"""
+
+from __future__ import print_function, absolute_import, division
+
+import json
+import struct
+from collections import OrderedDict
+import numpy as np
+
+MAGIC = b'RDSP'
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+
+
+def to_json(x):
+    ''' JSON value of numpy scalars and arrays (``default`` of :py:func:`json.dumps`) '''
+    if isinstance(x, np.generic):
+        return x.item()
+    if isinstance(x, np.ndarray):
+        return x.tolist()
+    return str(x)
+
+
+def pack(header, arrays):
+    ''' Payload of the ``header`` dict and the ``arrays`` (ordered dict of 1D arrays) '''
+    header = dict(header, arrays=[[k, I.dtype.str, len(I)] for k, I in arrays.items()])
+    header = json.dumps(header, default=to_json).encode()
+    return b''.join([MAGIC, struct.pack('<I', len(header)), header] +
+                    [np.ascontiguousarray(I).tobytes() for I in arrays.values()])
+
+
+def unpack(payload):
+    ''' Header dict and arrays of a payload. Arrays are read-only views of ``payload``. '''
+    if payload[:4] != MAGIC:
+        raise ValueError('Not a spectrum payload')
+    n = struct.unpack('<I', payload[4:8])[0]
+    header = json.loads(payload[8:8 + n].decode())
+    offset = 8 + n
+    arrays = OrderedDict()
+    for k, dtype, length in header.pop('arrays'):
+        arrays[k] = np.frombuffer(payload, dtype=dtype, count=length, offset=offset)
+        offset += arrays[k].nbytes
+    return header, arrays
@@ -0,0 +1,299 @@
+# -*- coding: utf-8 -*-
+"""
+Precomputed absorption cross-section tables ``sigma(w, T, P)``.
+
+A :class:`~radis_tools.xsec.CrossSectionTable` is calculated once for a given
+SpectrumFactory setup on a (T, P) grid, and stored on disk as a memory-mapped
+``.npy`` file, with its metadata in a ``.json`` file next to it. Layer spectra
+are then interpolated in the table (linearly in T and in log(P)) instead of
+being recomputed line-by-line.
+
+The table is calculated with the steps of
+:py:meth:`~radis.lbl.factory.SpectrumFactory.eq_spectrum` (see
+:func:`~radis_tools.layers.calc_abscoeff`): at the grid points, the interpolated
+spectra are those of ``eq_spectrum``, to the storage precision. The
+interpolation error is estimated against ``eq_spectrum`` at the center of every
+(T, P) cell, where linear interpolation is the least accurate, and stored with
+the table.
+
+"""
+
+from __future__ import print_function, absolute_import, division
+
+import hashlib
+import json
+from os.path import exists
+from time import time
+import numpy as np
+from radis.misc.progress_bar import ProgressBar
+from .layers import (broadcast_layers, calc_abscoeff, number_density,
+                     make_layer_spectra)
+
+
+def factory_key(sf):
+    ''' Identify the setup of a SpectrumFactory: spectral grid, broadening
+    parameters, and a fingerprint of its line database '''
+    df = sf.df0
+    fingerprint = hashlib.md5()
+    for k in ['wav', 'int', 'El', 'airbrd', 'selbrd']:
+        fingerprint.update(np.ascontiguousarray(df[k].values).tobytes())
+    return {'molecule': sf.input.molecule,
+            'isotope': sf.input.isotope,
+            'wavenum_min': sf.input.wavenum_min,
+            'wavenum_max': sf.input.wavenum_max,
+            'wstep': sf.params.wstep,
+            'broadening_max_width': sf.params.broadening_max_width,
+            'cutoff': sf.params.cutoff or 0,
+            'lines': len(df),
+            'lines_md5': fingerprint.hexdigest(),
+            }
+
+
+class CrossSectionTable(object):
+    ''' Absorption cross-sections tabulated on a (T, P) grid
+
+    Use :meth:`~radis_tools.xsec.CrossSectionTable.build` to calculate a new
+    table, :meth:`~radis_tools.xsec.CrossSectionTable.open` to open an existing
+    one, or :meth:`~radis_tools.xsec.CrossSectionTable.load_or_build`.
+
+    Parameters
+    ----------
+
+    filename: str
+        table file, without extension. The table is in ``filename.npy``, its
+        metadata in ``filename.json``
+
+    Examples
+    --------
+
+    ::
+
+        table = CrossSectionTable.load_or_build('out/co2_xsec', sf,
+                                                Tgas=np.arange(180, 301, 10),
+                                                pressure=np.geomspace(2e-6, 1.1, 20),
+                                                mole_fraction=400e-6)
+        print(table.error)
+        slabs = table.layers(atm.T_K, atm.P_Pa*1e-5, atm.path_length*1e5, 400e-6)
+
+    Attributes
+    ----------
+
+    sigma: memory-mapped array, shape ``(len(Tgas), len(pressure), len(w))``
+        absorption cross-sections (cm2/molecule)
+
+    error: float
+        maximum error of the interpolated absorption coefficient, relative to
+        its maximum, at the center of the (T, P) cells
+
+    '''
+
+    def __init__(self, filename):
+
+        with open(filename + '.json') as f:
+            self.metadata = json.load(f)
+        self.filename = filename
+        self.Tgas = np.array(self.metadata['Tgas'])
+        self.pressure = np.array(self.metadata['pressure'])
+        self.mole_fraction = self.metadata['mole_fraction']
+        self.error = self.metadata.get('error')
+        key = self.metadata['factory']
+        self.w = key['wavenum_min'] + key['wstep'] * np.arange(self.metadata['N'])
+        self.sigma = np.load(filename + '.npy', mmap_mode='r')
+
+    @classmethod
+    def open(cls, filename, sf=None):
+        ''' Open an existing table. If ``sf`` is given, check that the table
+        was calculated with the same SpectrumFactory setup '''
+        table = cls(filename)
+        if sf is not None and table.metadata['factory'] != factory_key(sf):
+            raise ValueError('Cross-section table {0} was calculated with a '.format(filename)+
+                             'different SpectrumFactory setup:\n{0}\nvs\n{1}'.format(
+                              table.metadata['factory'], factory_key(sf)))
+        return table
+
+    @classmethod
+    def build(cls, filename, sf, Tgas, pressure, mole_fraction, dtype=np.float32,
+              validate=True, verbose=True):
+        ''' Calculate a new table line-by-line, with the steps of
+        :py:meth:`~radis.lbl.factory.SpectrumFactory.eq_spectrum`, and store it
+
+        Parameters
+        ----------
+
+        filename: str
+            table file, without extension
+
+        sf: :class:`~radis.lbl.factory.SpectrumFactory`
+            with a line database already loaded
+
+        Tgas: array
+            temperature grid (K)
+
+        pressure: array
+            pressure grid (bar). Interpolation is linear in log(pressure): use
+            ``np.geomspace``
+
+        mole_fraction: float
+            mole fraction used for self-broadening
+
+        Other Parameters
+        ----------------
+
+        dtype: numpy dtype
+            storage type of the table. Default ``float32``.
+
+        validate: bool
+            if ``True``, calculate ``eq_spectrum`` spectra at the center of every
+            (T, P) cell to estimate the interpolation error. Default ``True``.
+
+        '''
+
+        t0 = time()
+        Tgas = np.sort(np.asarray(Tgas, dtype=np.float64))
+        pressure = np.sort(np.asarray(pressure, dtype=np.float64))
+        w = sf.wavenumber
+
+        sigma = np.lib.format.open_memmap(filename + '.npy', mode='w+', dtype=dtype,
+                                          shape=(len(Tgas), len(pressure), len(w)))
+        if verbose:
+            print('Building cross-section table: {0}x{1} (T, P) conditions'.format(
+                  len(Tgas), len(pressure)))
+            pb = ProgressBar(len(Tgas))
+        for i, T in enumerate(Tgas):
+            if verbose:
+                pb.update(i)
+            _, abscoeff, _ = calc_abscoeff(sf, np.full(len(pressure), T), pressure,
+                                           mole_fraction, verbose=False)
+            sigma[i] = abscoeff / number_density(T, pressure, mole_fraction)[:, None]
+        if verbose:
+            pb.done()
+        sigma.flush()
+        del sigma
+
+        metadata = {'Tgas': Tgas.tolist(),
+                    'pressure': pressure.tolist(),
+                    'mole_fraction': mole_fraction,
+                    'N': len(w),
+                    'factory': factory_key(sf),
+                    'error': None,
+                    'calculation_time': time() - t0,
+                    }
+        with open(filename + '.json', 'w') as f:
+            json.dump(metadata, f, indent=2)
+
+        table = cls(filename)
+        if validate:
+            table.validate(sf, verbose=verbose)
+        return table
+
+    @classmethod
+    def load_or_build(cls, filename, sf, Tgas, pressure, mole_fraction, **kwargs):
+        ''' Open the table ``filename`` if it exists and matches the SpectrumFactory
+        setup, else build it. See :meth:`~radis_tools.xsec.CrossSectionTable.build` '''
+        if exists(filename + '.json') and exists(filename + '.npy'):
+            table = cls(filename)
+            if (table.metadata['factory'] == factory_key(sf) and
+                    np.allclose(table.Tgas, np.sort(Tgas)) and
+                    np.allclose(table.pressure, np.sort(pressure)) and
+                    table.mole_fraction == mole_fraction):
+                return table
+            del table
+        return cls.build(filename, sf, Tgas, pressure, mole_fraction, **kwargs)
+
+    def interpolate(self, Tgas, pressure):
+        ''' Cross-sections (cm2/molecule) interpolated at each (Tgas, pressure)
+        condition, linearly in T and in log(P)
+
+        Returns
+        -------
+
+        sigma: 2D array, shape ``(len(Tgas), len(w))``
+
+        '''
+
+        Tgas, pressure = broadcast_layers(Tgas, pressure)
+        if (Tgas.min() < self.Tgas[0] or Tgas.max() > self.Tgas[-1] or
+                pressure.min() < self.pressure[0] or pressure.max() > self.pressure[-1]):
+            raise ValueError('Conditions outside of the table: T=[{0}, {1}] K, '.format(
+                             self.Tgas[0], self.Tgas[-1]) +
+                             'P=[{0:.2e}, {1:.2e}] bar'.format(self.pressure[0], self.pressure[-1]))
+
+        def weights(grid, x):
+            i = np.clip(np.searchsorted(grid, x) - 1, 0, len(grid) - 2)
+            return i, (x - grid[i]) / (grid[i + 1] - grid[i])
+
+        i, ti = weights(self.Tgas, Tgas)
+        j, tj = weights(np.log(self.pressure), np.log(pressure))
+
+        sigma = np.empty((len(Tgas), len(self.w)))
+        for n in range(len(Tgas)):
+            a, b, u, v = i[n], j[n], ti[n], tj[n]
+            sigma[n] = ((1 - u) * (1 - v) * self.sigma[a, b] + u * (1 - v) * self.sigma[a + 1, b]
+                        + (1 - u) * v * self.sigma[a, b + 1] + u * v * self.sigma[a + 1, b + 1])
+        return sigma
+
+    def abscoeff(self, Tgas, pressure, mole_fraction):
+        ''' Absorption coefficient (cm-1) of each layer, shape ``(layer, len(w))`` '''
+        Tgas, pressure, mole_fraction = broadcast_layers(Tgas, pressure, mole_fraction)
+        return (self.interpolate(Tgas, pressure)
+                * number_density(Tgas, pressure, mole_fraction)[:, None])
+
+    def layers(self, Tgas, pressure, path_length, mole_fraction):
+        ''' Return the Spectrum of each layer, interpolated in the table
+
+        Same inputs and outputs as :func:`~radis_tools.layers.calc_layers`. The
+        ``mole_fraction`` only scales the absorption coefficient:
+        self-broadening is the one of the table.
+        '''
+        t0 = time()
+        Tgas, pressure, path_length, mole_fraction = broadcast_layers(Tgas, pressure,
+                                                                      path_length,
+                                                                      mole_fraction)
+        abscoeff = self.abscoeff(Tgas, pressure, mole_fraction)
+        conditions = {k: self.metadata['factory'][k] for k in
+                      ['molecule', 'isotope', 'wstep', 'broadening_max_width', 'cutoff']}
+        conditions['calculation_time'] = (time() - t0) / len(Tgas)
+        conditions['xsec_table'] = self.filename
+        return make_layer_spectra(self.w, abscoeff, Tgas, pressure, path_length,
+                                  mole_fraction, conditions=conditions)
+
+    def validate(self, sf, verbose=True):
+        ''' Compare the interpolated cross-sections with
+        :py:meth:`~radis.lbl.factory.SpectrumFactory.eq_spectrum` at the center
+        of every (T, P) cell, and store the maximum relative error in the table
+        metadata
+
+        Returns
+        -------
+
+        error: float
+            maximum error, relative to the maximum cross-section at each condition
+
+        '''
+        T_mid = (self.Tgas[1:] + self.Tgas[:-1]) / 2
+        P_mid = np.sqrt(self.pressure[1:] * self.pressure[:-1])
+        x = self.mole_fraction
+
+        error = 0
+        if verbose:
+            print('Validating cross-section table at {0} cell centers'.format(
+                  len(T_mid) * len(P_mid)))
+            pb = ProgressBar(len(T_mid))
+        for i, T in enumerate(T_mid):
+            if verbose:
+                pb.update(i)
+            _, abscoeff, _ = calc_abscoeff(sf, np.full(len(P_mid), T), P_mid, x,
+                                           verbose=False)
+            sigma_lbl = abscoeff / number_density(T, P_mid, x)[:, None]
+            sigma = self.interpolate(np.full(len(P_mid), T), P_mid)
+            error = max(error, (np.abs(sigma - sigma_lbl).max(axis=1)
+                                / sigma_lbl.max(axis=1)).max())
+        if verbose:
+            pb.done()
+            print('Cross-section table: max. interpolation error {0:.2%}'.format(error))
+
+        self.error = float(error)
+        self.metadata['error'] = self.error
+        with open(self.filename + '.json', 'w') as f:
+            json.dump(self.metadata, f, indent=2)
+        return self.error
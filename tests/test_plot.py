@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""
+Min/max envelope of :func:`~radis_tools.plot.minmax_envelope`, compared to
+the minimum and maximum of each bin calculated point by point.
+
+Run from the repository root::
+
+    python -m pytest tests
+
+"""
+
+from __future__ import print_function, absolute_import, division
+
+import numpy as np
+import pytest
+from radis_tools.plot import minmax_envelope
+
+
+def reference_envelope(x, y, n_bins):
+    ''' Minimum and maximum of each non-empty bin, in the order they appear '''
+    edges = np.linspace(x.min(), x.max(), n_bins + 1)
+    bins = np.clip(np.searchsorted(edges, x, side='right') - 1, 0, n_bins - 1)
+    out = []
+    for b in np.unique(bins):
+        i = np.nonzero(bins == b)[0]
+        i_min, i_max = i[np.argmin(y[i])], i[np.argmax(y[i])]
+        out.extend(y[sorted([i_min, i_max])])
+    return np.array(out)
+
+
+@pytest.mark.parametrize('n_bins', [1, 7, 300])
+def test_minmax_envelope(n_bins):
+    rng = np.random.default_rng(0)
+    x = np.linspace(0, 1, 10001)
+    y = rng.random(len(x))
+    xe, ye = minmax_envelope(x, y, n_bins)
+    assert len(xe) == len(ye) == 2 * n_bins
+    assert np.array_equal(ye, reference_envelope(x, y, n_bins))
+    assert ye.max() == y.max() and ye.min() == y.min()     # peaks are kept
+
+
+def test_minmax_envelope_decreasing():
+    # e.g. a wavelength grid from a wavenumber grid
+    x = 1e7 / np.linspace(2000, 2500, 5001)
+    y = np.sin(x)
+    xe, ye = minmax_envelope(x, y, 50)
+    assert np.all(np.diff(xe) >= 0)
+    assert np.array_equal(ye, reference_envelope(x[::-1], y[::-1], 50))
+
+
+def test_minmax_envelope_small():
+    x, y = np.arange(10.), np.arange(10.) ** 2
+    xe, ye = minmax_envelope(x, y, 5)
+    assert np.array_equal(xe, x) and np.array_equal(ye, y)
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""
+Sub-ranges of :func:`~radis_tools.sharding.shard_limits`, and stitching of
+synthetic shards.
+
+Run from the repository root::
+
+    python -m pytest tests
+
+"""
+
+from __future__ import print_function, absolute_import, division
+
+import numpy as np
+import pytest
+
+pytest.importorskip('radis')      # radis_tools.sharding imports RADIS
+
+from radis_tools.sharding import shard_limits, _stitch     # noqa: E402
+
+
+@pytest.mark.parametrize('n_points, n_shards', [(101, 1), (101, 3), (1000, 16), (5, 8)])
+def test_shard_limits(n_points, n_shards):
+    limits = shard_limits(n_points, n_shards, margin=2)
+    assert len(limits) == min(n_points, n_shards)
+    owned = np.hstack([np.arange(i_min, i_max + 1) for i_min, i_max, _, _ in limits])
+    assert np.array_equal(owned, np.arange(n_points))     # contiguous, no overlap
+    for i_min, i_max, j_min, j_max in limits:
+        assert j_min == max(0, i_min - 2)
+        assert j_max == min(n_points - 1, i_max + 2)
+
+
+def synthetic_shards(limits, wmin, wstep, n_lines):
+    ''' Shards of ``abscoeff = w**2``, calculated on their index range with margins '''
+    parts = []
+    for (_, _, j_min, j_max), n in zip(limits, n_lines):
+        w = wmin + wstep * np.arange(j_min, j_max + 1)
+        parts.append((w, {'abscoeff': w ** 2}, {'abscoeff': 'cm-1'},
+                      {'Tgas': 700, 'lines_calculated': n, 'lines_cutoff': 1,
+                       'lines_in_continuum': 0, 'calculation_time': 10},
+                      {'Tgas': 'K'}))
+    return parts
+
+
+def test_stitch():
+    wmin, wstep, n_points = 2000, 0.01, 101
+    limits = shard_limits(n_points, 3)
+    s = _stitch(synthetic_shards(limits, wmin, wstep, [5, 6, 7]), limits, wmin, wstep,
+                n_points, calculation_time=2.5)
+    w, k = s.get('abscoeff', wunit='cm-1')
+    assert np.allclose(w, wmin + wstep * np.arange(n_points))
+    assert np.allclose(k, w ** 2)
+    assert s.conditions['wavenum_min'] == pytest.approx(2000)
+    assert s.conditions['wavenum_max'] == pytest.approx(2001)
+    assert s.conditions['shards'] == 3
+    # line counts of each shard are summed; the time is the wall time given
+    assert s.conditions['lines_calculated'] == 18
+    assert s.conditions['lines_cutoff'] == 3
+    assert s.conditions['lines_in_continuum'] == 0
+    assert s.conditions['calculation_time'] == 2.5
+
+
+def test_stitch_missing_points():
+    wmin, wstep = 2000, 0.01
+    limits = shard_limits(101, 3)
+    parts = synthetic_shards(limits, wmin, wstep, [5, 6, 7])
+    with pytest.raises(ValueError):
+        _stitch(parts, limits, wmin, wstep, 102)
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""
+Equivalence of the FFT slit convolutions of :py:mod:`radis_tools.slit` with
+the direct convolution (:py:func:`numpy.convolve` and
+:py:meth:`~radis.spectrum.spectrum.Spectrum.apply_slit`), on synthetic spectra.
+
+Run from the repository root::
+
+    python -m pytest tests
+
+"""
+
+from __future__ import print_function, absolute_import, division
+
+import numpy as np
+import pytest
+from radis_tools.slit import convolve, choose_method, apply_slit
+
+#: maximum difference with the direct convolution, relative to the maximum
+RTOL = 1e-10
+
+
+def synthetic_spectrum(n_points=20001, n_lines=300, seed=0):
+    ''' Lorentzian lines on an evenly spaced 0.01 cm-1 grid. Skips the test
+    without RADIS '''
+    radis = pytest.importorskip('radis')
+    rng = np.random.default_rng(seed)
+    w = np.linspace(2000, 2000 + 0.01 * (n_points - 1), n_points)   # cm-1
+    I = np.zeros_like(w)
+    for w0, S in zip(rng.uniform(w[0], w[-1], n_lines), rng.random(n_lines)):
+        I += S * 0.02 ** 2 / ((w - w0) ** 2 + 0.02 ** 2)
+    return radis.Spectrum.from_array(w, I, 'radiance_noslit', 'cm-1', 'mW/cm2/sr/nm')
+
+
+def assert_close(I, I_ref):
+    assert I.shape == I_ref.shape
+    assert np.abs(I - I_ref).max() <= RTOL * np.abs(I_ref).max()
+
+
+@pytest.mark.parametrize('n_slit', [11, 301, 2001, 6001])
+@pytest.mark.parametrize('method', ['auto', 'direct', 'overlap-add', 'fft'])
+def test_convolve(method, n_slit):
+    rng = np.random.default_rng(1)
+    I = rng.random(20000)
+    I_slit = np.exp(-np.linspace(-3, 3, n_slit) ** 2)
+    assert_close(convolve(I, I_slit, method=method), np.convolve(I, I_slit, mode='same'))
+
+
+def test_convolve_slit_longer_than_spectrum():
+    rng = np.random.default_rng(2)
+    I, I_slit = rng.random(100), rng.random(301)
+    for method in ['overlap-add', 'fft']:
+        assert_close(convolve(I, I_slit, method=method), np.convolve(I, I_slit, mode='same'))
+
+
+def test_choose_method():
+    assert choose_method(100000, 11) == 'direct'
+    assert choose_method(100000, 1001) == 'overlap-add'
+    assert choose_method(100000, 20001) == 'fft'
+    with pytest.raises(ValueError):
+        convolve(np.ones(10), np.ones(3), method='unknown')
+
+
+@pytest.mark.parametrize('slit', [0.2, 5, 20])   # nm: ~10, ~250 and ~1000 points
+@pytest.mark.parametrize('method', ['auto', 'overlap-add', 'fft'])
+def test_apply_slit(method, slit):
+    s = synthetic_spectrum()
+    s_ref = s.copy()
+    s_ref.apply_slit(slit, 'nm')
+    apply_slit(s, slit, 'nm', method=method)
+    w_ref, I_ref = s_ref.get('radiance', wunit='cm-1')
+    w, I = s.get('radiance', wunit='cm-1')
+    assert np.array_equal(w, w_ref)
+    assert_close(I, I_ref)
+    assert s.conditions['slit_convolution'] == method
+
+
+@pytest.mark.parametrize('shape', ['triangular', 'gaussian'])
+def test_apply_slit_shape(shape):
+    s = synthetic_spectrum()
+    s_ref = s.copy()
+    s_ref.apply_slit(5, 'nm', shape=shape)
+    apply_slit(s, 5, 'nm', shape=shape, method='fft')
+    assert_close(s.get('radiance', wunit='cm-1')[1], s_ref.get('radiance', wunit='cm-1')[1])
+
+
+@pytest.mark.parametrize('method', ['auto', 'overlap-add', 'fft'])
+def test_apply_slit_dispersion(method):
+    s = synthetic_spectrum()
+
+    def slit_dispersion(lbd):
+        return 1 + (lbd - 4700) / 5000     # linear dispersion (nm -> dilation)
+
+    s_ref = s.copy()
+    s_ref.apply_slit(20, 'nm', slit_dispersion=slit_dispersion)
+    apply_slit(s, 20, 'nm', method=method, slit_dispersion=slit_dispersion)
+    w_ref, I_ref = s_ref.get('radiance', wunit='cm-1')
+    w, I = s.get('radiance', wunit='cm-1')
+    assert np.array_equal(w, w_ref)
+    assert_close(I, I_ref)
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+"""
+Memory sizes read by :func:`~radis_tools.streaming.parse_memory`.
+
+Run from the repository root::
+
+    python -m pytest tests
+
+"""
+
+from __future__ import print_function, absolute_import, division
+
+import pytest
+
+pytest.importorskip('radis')      # radis_tools.streaming imports RADIS
+
+from radis_tools.streaming import parse_memory     # noqa: E402
+
+
+@pytest.mark.parametrize('size, nbytes', [('4GB', 4e9),
+                                          ('500 MB', 5e8),
+                                          (' 1.5 gb ', 1.5e9),
+                                          ('2GiB', 2 * 1024 ** 3),
+                                          ('64kB', 64e3),
+                                          ('100B', 100),
+                                          (500, 5e8),          # MB
+                                          (0.5, 5e5)])
+def test_parse_memory(size, nbytes):
+    assert parse_memory(size) == nbytes
+
+
+@pytest.mark.parametrize('size', ['4', '4 GBs', 'GB', '4 PB', ''])
+def test_parse_memory_invalid(size):
+    with pytest.raises(ValueError):
+        parse_memory(size)
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+"""
+Round trip of the binary spectrum format of :py:mod:`radis_tools.wire`.
+
+Run from the repository root::
+
+    python -m pytest tests
+
+"""
+
+from __future__ import print_function, absolute_import, division
+
+from collections import OrderedDict
+import numpy as np
+import pytest
+from radis_tools.wire import MAGIC, pack, unpack
+
+
+def test_pack_unpack():
+    arrays = OrderedDict([('q/wavespace', np.linspace(2000, 2001, 11)),
+                          ('q/abscoeff', np.arange(11, dtype=np.float32)),
+                          ('q_conv/radiance', np.ones(5))])
+    header = {'conditions': {'Tgas': np.float64(700), 'isotope': '1,2'},
+              'units': {'abscoeff': 'cm-1'}, 'waveunit': 'cm-1', 'name': None}
+    payload = pack(header, arrays)
+    assert payload[:4] == MAGIC
+
+    header_out, arrays_out = unpack(payload)
+    assert header_out == {'conditions': {'Tgas': 700.0, 'isotope': '1,2'},
+                          'units': {'abscoeff': 'cm-1'}, 'waveunit': 'cm-1', 'name': None}
+    assert list(arrays_out) == list(arrays)
+    for k, I in arrays.items():
+        assert arrays_out[k].dtype == I.dtype
+        assert np.array_equal(arrays_out[k], I)
+        assert not arrays_out[k].flags.writeable      # views of the payload
+
+
+def test_pack_non_contiguous():
+    I = np.arange(20.)[::2]
+    _, arrays = unpack(pack({}, OrderedDict([('q/abscoeff', I)])))
+    assert np.array_equal(arrays['q/abscoeff'], I)
+
+
+def test_unpack_not_a_spectrum():
+    with pytest.raises(ValueError):
+        unpack(b'<html>Bad gateway</html>')